@@ -0,0 +1,746 @@
+'''
+Vectorised backtest engine for the PenskeFile H4 EMA/ATR/MACD strategy (main.py)
+
+- Builds the 4 hour quote bars from hourly bid/ask arrays
+- Computes H4ema, H4atr, H4macd and the goLong/goShort/signalLong/signalShort series as whole arrays
+- Replays the entry rules, GreenLight gating, ShiftFirmStop ladder and LetProfitsRun exits trade by
+  trade instead of hour by hour, giving the same trades as the event driven algorithm (signals and
+  entries on each completed 4 hour bar, stops and exits on every hourly bar)
+
+Quotes are passed as any mapping (dict of arrays, numpy record array) holding 'time' (bar start in
+UTC epoch seconds) and the bid/ask OHLC columns listed in QUOTE_COLUMNS. Positions are sized on the
+cash book in USD like Portfolio.Cash, so crosses also take the quotes of their conversion_pair().
+
+Run directly for a parity check against the event driven reference on synthetic data:
+    python backtest.py [years] [pair]
+'''
+
+from collections import namedtuple
+from datetime import datetime
+import calendar
+import csv
+import math
+import sys
+import time as timer
+
+import numpy as np
+
+from thresholds import THRESHOLDS, PairThresholds
+
+QUOTE_COLUMNS = ('bid_open', 'bid_high', 'bid_low', 'bid_close', 'ask_open', 'ask_high', 'ask_low', 'ask_close')
+
+HOUR = 3600
+FOUR_HOURS = 4 * HOUR
+
+QUOTED_IN_USD = ('EUR', 'GBP', 'AUD', 'NZD', 'XAU', 'XAG', 'XPT', 'XPD')    # market convention XXXUSD, others USDXXX
+
+# Synthetic quotes are seeded by position here so pairs don't move in lockstep (AUDUSD keeps seed 0)
+PAIRS = ('AUDUSD', 'GBPJPY', 'NZDJPY', 'EURUSD', 'GBPUSD', 'USDJPY', 'USDCHF', 'USDCAD', 'NZDUSD', 'EURJPY',
+         'EURGBP', 'AUDJPY', 'EURAUD', 'EURCHF', 'EURCAD', 'EURNZD', 'GBPAUD', 'GBPCAD', 'GBPCHF', 'GBPNZD',
+         'AUDCAD', 'AUDCHF', 'AUDNZD', 'CADJPY', 'CHFJPY', 'NZDCAD', 'NZDCHF', 'CADCHF', 'USDSGD', 'USDHKD',
+         'USDNOK', 'USDSEK', 'USDDKK', 'USDMXN', 'USDZAR', 'USDTRY', 'USDPLN', 'USDCZK', 'USDHUF', 'USDCNH',
+         'EURNOK', 'EURSEK', 'EURPLN', 'EURTRY', 'SGDJPY', 'ZARJPY', 'HKDJPY', 'GBPSGD', 'AUDSGD', 'EURHUF')
+
+StrategyParams = namedtuple('StrategyParams', [
+    'xbaseline_signal', 'stop_atr', 'high_histogram', 'mid_histogram', 'low_histogram', 'tradeopen_atr',
+    'loss_risk', 'downside_risk', 'upside_risk', 'bar_range_limit', 'cash', 'warmup'])
+
+# Entry branches in OnData order (the elif chain)
+WITH_LONG, WITH_SHORT, AGAINST_LONG, AGAINST_SHORT = 1, 2, 3, 4
+
+# Exit reasons
+OPEN, STOPPED, CLOSED = 0, 1, 2
+
+# pnl is in USD: the quote currency P&L at the conversion rate of the exit hour
+TRADE_DTYPE = np.dtype([
+    ('entry_time', 'i8'), ('exit_time', 'i8'), ('side', 'i1'), ('branch', 'i1'), ('quantity', 'i8'),
+    ('entry_price', 'f8'), ('initial_stop', 'f8'), ('exit_price', 'f8'), ('exit_reason', 'i1'),
+    ('stop_rung', 'i1'), ('pnl', 'f8')])
+
+
+DEFAULTS = {'loss_risk': 0.015, 'downside_risk': 1.5, 'upside_risk': 2, 'bar_range_limit': 0.0350,
+            'cash': 10000, 'warmup': 100}
+
+
+def params_for(ccypair, **overrides):
+    '''
+    Strategy parameters for a pair
+
+    Thresholds not given as overrides come from the thresholds.py table (see calibrate.py) and raise
+    KeyError when the pair is missing, just like main.py.
+    '''
+    values = dict(DEFAULTS, **overrides)
+    for name in PairThresholds._fields:
+        if name not in values:
+            values[name] = getattr(THRESHOLDS[ccypair], name)
+    return StrategyParams(**values)
+
+
+def price_rounding(ccypair):
+    return 3 if ccypair[-3:] == 'JPY' else 5
+
+
+def position_size(cash, atr, ccypair, params):
+    ''' BuyPositionSize from OnData (1.5% of a/c cash risked over ATR x DownsideRisk) '''
+    tradeRisk = cash * params.loss_risk
+    atrMultiplier = round(atr * 10000, 2)
+    scale = 1000000 if ccypair[-3:] == 'JPY' else 10000
+    return math.ceil((tradeRisk / (atrMultiplier * params.downside_risk)) * scale)
+
+
+def cash_change(ccypair, quantity, price):
+    '''
+    (USD, quote currency) changes in the LEAN cash book for a fill
+
+    The base currency leg of a cross is left out: it is back to 0 whenever the pair is flat, which is
+    when the next position is sized.
+    '''
+    if ccypair[3:] == 'USD':
+        return -quantity * price, 0.0
+    if ccypair[:3] == 'USD':
+        return float(quantity), -quantity * price
+    return 0.0, -quantity * price
+
+
+def conversion_pair(ccypair):
+    ''' The XXXUSD/USDXXX pair that converts ccypair's quote currency to USD, None when ccypair itself does '''
+    quote = ccypair[3:]
+    if quote == 'USD' or ccypair[:3] == 'USD':
+        return None
+    return quote + 'USD' if quote in QUOTED_IN_USD else 'USD' + quote
+
+
+def quote_rates(quotes, ccypair, conversion=None):
+    '''
+    USD per unit of ccypair's quote currency on every hourly bar, as Portfolio.Cash converts the cash
+    book: 1 for XXXUSD, the pair's own mid for USDXXX, otherwise the latest mid of the conversion_pair()
+    quotes (0 without them or before their first bar, like a cash book with no conversion feed)
+    '''
+    t = np.asarray(quotes['time'], dtype=np.int64)
+    if ccypair[3:] == 'USD':
+        return np.ones(len(t))
+    if ccypair[:3] == 'USD':
+        return 1.0 / mid(quotes, 'close')
+    if conversion is None:
+        return np.zeros(len(t))
+    latest = np.searchsorted(np.asarray(conversion['time'], dtype=np.int64), t, side='right') - 1
+    price = np.where(latest >= 0, mid(conversion, 'close')[np.maximum(latest, 0)], 0.0)
+    if conversion_pair(ccypair)[:3] == 'USD':
+        return np.divide(1.0, price, out=np.zeros(len(t)), where=price > 0)
+    return price
+
+
+def stop_ladder(side, entry, price, atr, ccypair, params):
+    '''
+    Initial stop and the SetStopSchedule rungs built by InitialLongTargets/InitialShortTargets
+
+    Returns (initial stop, second target, rungs) where each rung is (trigger, new stop, ATR gated).
+    '''
+    r = price_rounding(ccypair)
+    initialStop = round(price - side * atr * params.downside_risk, r)
+    target = lambda multiple: round(entry + side * atr * multiple, r)
+    rungs = (
+        (target(1.5), entry, True),                                     # ATRx1.5 -> breakeven
+        (target(params.upside_risk), target(0.5), True),                # ATRx2 -> ATRx0.5
+        (target(4), target(2.5), False),                                # ATRx4 -> ATRx2.5
+        (target(10), target(8), False))                                 # ATRx10 -> ATRx8
+    return initialStop, target(params.upside_risk), rungs
+
+
+''' BARS & INDICATORS '''
+
+def resample_h4(quotes):
+    '''
+    Consolidates hourly quote bars into 4 hour bars aligned to midnight UTC
+
+    Returns (h4 bars, completion index) where the completion index is the hourly bar whose OnData
+    first sees the 4 hour bar: its last hourly bar when that closes the period, otherwise the next
+    hourly bar after a data gap (the consolidator scan fires before that bar is processed).
+    '''
+    t = np.asarray(quotes['time'], dtype=np.int64)
+    period = t // FOUR_HOURS
+    starts = np.flatnonzero(np.r_[True, period[1:] != period[:-1]])
+    ends = np.r_[starts[1:], len(t)] - 1
+
+    bars = {'time': period[starts] * FOUR_HOURS}
+    for side in ('bid', 'ask'):
+        bars[side + '_open'] = np.asarray(quotes[side + '_open'], dtype=float)[starts]
+        bars[side + '_high'] = np.maximum.reduceat(np.asarray(quotes[side + '_high'], dtype=float), starts)
+        bars[side + '_low'] = np.minimum.reduceat(np.asarray(quotes[side + '_low'], dtype=float), starts)
+        bars[side + '_close'] = np.asarray(quotes[side + '_close'], dtype=float)[ends]
+
+    closesPeriod = t[ends] + HOUR >= (period[ends] + 1) * FOUR_HOURS
+    completion = np.where(closesPeriod, ends, ends + 1)
+    return bars, completion
+
+
+def mid(bars, field):
+    ''' QuoteBar.Open/High/Low/Close are the mid of the bid and ask bars '''
+    return (np.asarray(bars['bid_' + field], dtype=float) + np.asarray(bars['ask_' + field], dtype=float)) / 2
+
+
+def ema(values, period):
+    ''' LEAN ExponentialMovingAverage: identity on the first sample, ready after period samples '''
+    k = 2.0 / (period + 1)
+    out = np.empty(len(values))
+    current = 0.0
+    for i, value in enumerate(values.tolist()):
+        current = value if i == 0 else value * k + current * (1 - k)
+        out[i] = current
+    return out
+
+
+def wilder(values, period):
+    ''' LEAN WilderMovingAverage: simple average until ready, then Wilder smoothing '''
+    out = np.empty(len(values))
+    current = 0.0
+    for i, value in enumerate(values.tolist()):
+        current = current + (value - current) / min(i + 1, period)
+        out[i] = current
+    return out
+
+
+def atr(high, low, close, period=14):
+    previous = np.r_[np.nan, close[:-1]]
+    trueRange = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+    return wilder(trueRange, period)
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    '''
+    LEAN MovingAverageConvergenceDivergence
+
+    The signal line only takes samples once the slow EMA is ready and the histogram stays at 0 until
+    the signal line is ready. Returns (macd, signal, histogram, samples until ready).
+    '''
+    line = ema(close, fast) - ema(close, slow)
+    signalLine = np.zeros(len(close))
+    signalLine[slow - 1:] = ema(line[slow - 1:], signal)
+    histogram = np.zeros(len(close))
+    ready = slow + signal - 1
+    histogram[ready - 1:] = line[ready - 1:] - signalLine[ready - 1:]
+    return line, signalLine, histogram, ready
+
+
+def h4_indicators(bars):
+    ''' H4ema(100), H4atr(14), H4macd(12,26,9) and the IndicatorExtensions triggers on 4 hour bars '''
+    close = mid(bars, 'close')
+    series = {'ema': ema(close, 100), 'atr': atr(mid(bars, 'high'), mid(bars, 'low'), close, 14)}
+    series['macd'], series['signal'], series['histogram'], macdReady = macd(close, 12, 26, 9)
+
+    series['goLong'] = series['histogram'] - series['atr'] * 0.1
+    series['goShort'] = series['atr'] * -0.1 - series['histogram']
+    series['signalLong'] = series['signal'] * -1 - series['atr']
+    series['signalShort'] = series['signal'] - series['atr']
+
+    # Failsafe inputs from the latest completed bar
+    high, low, open_ = mid(bars, 'high'), mid(bars, 'low'), mid(bars, 'open')
+    series['barRangePct'] = (high - low) / open_
+    series['askClose'] = np.asarray(bars['ask_close'], dtype=float)
+    series['ready'] = max(100, 14, macdReady, 3)
+    return series
+
+
+''' SIGNALS '''
+
+SERIES_COLUMNS = ('time', 'hist0', 'atr0', 'bidLow', 'askHigh', 'bid', 'ask', 'price', 'quoteRate',
+                  'barHour', 'barReady', 'barHist0', 'barHist1', 'barSignal1', 'barAtr', 'barGoLong0', 'barGoLong1',
+                  'barGoShort0', 'barGoShort1', 'barSignalLong0', 'barSignalShort0', 'barRangePct', 'barBaseline')
+
+
+def indicator_series(quotes, ccypair, conversion=None):
+    '''
+    Indicator arrays independent of the strategy parameters
+
+    Hourly columns feed the OnData stop & exit checks, where window[0] is the value from the latest
+    completed 4 hour bar, and quoteRate (quote_rates()) the position sizing. The bar* columns have one
+    entry per 4 hour bar and feed FourHourBarHandler, where window[1] is the previous bar; barHour is
+    the hourly index the handler runs at. conversion holds the conversion_pair() quotes for a cross.
+    '''
+    t = np.asarray(quotes['time'], dtype=np.int64)
+    n = len(t)
+    bars, completion = resample_h4(quotes)
+    h4 = h4_indicators(bars)
+    latest = np.searchsorted(completion, np.arange(n), side='right') - 1
+    have = latest >= 0
+    latest = np.maximum(latest, 0)
+
+    def previous(values):
+        return np.r_[0.0, values[:-1]]
+
+    series = {'time': t}
+    series['hist0'] = np.where(have, h4['histogram'][latest], 0.0)
+    series['atr0'] = np.where(have, h4['atr'][latest], 0.0)
+    series['bidLow'] = np.asarray(quotes['bid_low'], dtype=float)
+    series['askHigh'] = np.asarray(quotes['ask_high'], dtype=float)
+    series['bid'] = np.asarray(quotes['bid_close'], dtype=float)
+    series['ask'] = np.asarray(quotes['ask_close'], dtype=float)
+    series['price'] = (series['bid'] + series['ask']) / 2
+    series['quoteRate'] = quote_rates(quotes, ccypair, conversion)
+
+    # Indicators and both rolling windows (3 bars) ready
+    series['barHour'] = completion
+    series['barReady'] = np.arange(len(completion)) >= max(h4['ready'], 3) - 1
+    series['barHist0'], series['barHist1'] = h4['histogram'], previous(h4['histogram'])
+    series['barSignal1'] = previous(h4['signal'])
+    series['barAtr'] = h4['atr']
+    series['barGoLong0'], series['barGoLong1'] = h4['goLong'], previous(h4['goLong'])
+    series['barGoShort0'], series['barGoShort1'] = h4['goShort'], previous(h4['goShort'])
+    series['barSignalLong0'], series['barSignalShort0'] = h4['signalLong'], h4['signalShort']
+    series['barRangePct'] = h4['barRangePct']
+    series['barBaseline'] = np.round(h4['askClose'] - h4['ema'], 5)
+    return series
+
+
+def slice_series(series, lo, hi):
+    '''
+    indicator_series() restricted to hourly bars lo..hi-1, as if the algorithm started at lo
+
+    Indicator values keep the full history before lo. The 4 hour bars are the ones the handler
+    sees inside the slice, with barHour rebased, so Signals/run start with fresh GreenLight state
+    and params.warmup blocks trading for the first bars like SetWarmup.
+    '''
+    hours = np.asarray(series['barHour'])
+    keep = (hours >= lo) & (hours < hi)
+    sliced = {}
+    for name in SERIES_COLUMNS:
+        if not name.startswith('bar'):
+            sliced[name] = series[name][lo:hi]
+        elif name == 'barHour':
+            sliced[name] = hours[keep] - lo
+        else:
+            sliced[name] = series[name][keep]
+    return sliced
+
+
+class Signals(object):
+    ''' Entry branches and GreenLight inputs for one parameter set, derived from indicator_series() '''
+
+    def __init__(self, series, ccypair, params):
+        self.ccypair = ccypair
+        self.params = params
+        for name in ('time', 'hist0', 'atr0', 'bidLow', 'askHigh', 'bid', 'ask', 'price', 'quoteRate', 'barHour', 'barAtr'):
+            setattr(self, name, series[name])
+        n, bars = len(self.time), len(self.barHour)
+
+        # Bars completing after the data (the trailing partial bar) never reach the handler
+        ready = series['barReady'] & (self.barHour >= params.warmup) & (self.barHour < n)
+        self.start = int(np.argmax(ready)) if ready.any() else bars
+
+        baseline = series['barBaseline']
+        crossLong = (series['barGoLong1'] < 0) & (series['barGoLong0'] > 0)
+        crossShort = (series['barGoShort1'] < 0) & (series['barGoShort0'] > 0)
+        threshold = params.xbaseline_signal
+        branch = np.select([
+            crossLong & (baseline > 0),
+            crossShort & (baseline < 0),
+            (series['barSignalLong0'] > 0) & crossLong & (baseline < 0) & (series['barSignal1'] < threshold * -1),
+            (series['barSignalShort0'] > 0) & crossShort & (baseline > 0) & (series['barSignal1'] > threshold)],
+            [WITH_LONG, WITH_SHORT, AGAINST_LONG, AGAINST_SHORT], 0)
+        self.branch = np.where(ready, branch, 0).astype(np.int8)
+
+        hist0, hist1 = series['barHist0'], series['barHist1']
+        cross = ready & (((hist1 < 0) & (hist0 > 0)) | ((hist1 > 0) & (hist0 < 0)))
+        kill = ready & ((series['barRangePct'] > params.bar_range_limit) | (self.barAtr > params.tradeopen_atr))
+        index = np.arange(bars)
+        self.lastCross = np.maximum.accumulate(np.where(cross, index, -1))
+        self.lastKill = np.maximum.accumulate(np.where(kill, index, -1))
+
+        # Hour of the latest crossing bar, for HighHistThreshold resets seen by OnData
+        crossHours = np.full(n, -1)
+        crossHours[self.barHour[cross]] = self.barHour[cross]
+        self.lastCrossHour = np.maximum.accumulate(crossHours)
+
+
+def _first(predicate, lo, n, chunk=256):
+    ''' First index >= lo where predicate(lo, hi) is true, scanning in growing chunks (n if none) '''
+    while lo < n:
+        hi = min(n, lo + chunk)
+        hits = np.flatnonzero(predicate(lo, hi))
+        if hits.size:
+            return lo + int(hits[0])
+        lo, chunk = hi, chunk * 2
+    return n
+
+
+''' REPLAY '''
+
+def run(quotes, ccypair='AUDUSD', params=None, series=None, conversion=None):
+    '''
+    Backtests one pair, returning the trades as a TRADE_DTYPE array
+
+    Pass series (from indicator_series) instead of quotes to reuse the indicator arrays across runs.
+    Positions are sized on the USD value of the cash book, so a cross needs the conversion_pair()
+    quotes (conversion, or in the series) for its realised P&L to count.
+    '''
+    params = params or params_for(ccypair)
+    s = Signals(series if series is not None else indicator_series(quotes, ccypair, conversion), ccypair, params)
+    n, bars = len(s.time), len(s.barHour)
+    usd, quote = float(params.cash), 0.0
+    trades = []
+
+    lastReset = -1                  # Bar whose entry set GreenLight to 'N'
+    lastHighHist = -1               # Latest hour where HighHistThreshold was set to 'Y'
+    flatFrom = s.start              # First bar the handler sees the pair flat
+
+    while flatFrom < bars:
+
+        # GreenLight is 'Y' when the histogram crossed after the last entry and no failsafe has fired
+        # since (failsafes only run while flat, i.e. from flatFrom)
+        f, reset = flatFrom, lastReset
+        def entry(lo, hi):
+            lc, lk = s.lastCross[lo:hi], s.lastKill[lo:hi]
+            return (s.branch[lo:hi] > 0) & (lc > reset) & ((lk < f) | (lc > lk))
+        k = _first(entry, flatFrom, bars)
+        if k >= bars:
+            break
+        e = int(s.barHour[k])
+
+        branch = int(s.branch[k])
+        side = 1 if branch in (WITH_LONG, AGAINST_LONG) else -1
+        quantity = position_size(usd + quote * s.quoteRate[e], s.barAtr[k], ccypair, params) * side
+        entryPrice = float(s.ask[e] if side > 0 else s.bid[e])
+        initialStop, secondTarget, rungs = stop_ladder(side, entryPrice, float(s.price[e]), float(s.barAtr[k]), ccypair, params)
+        usdChange, quoteChange = cash_change(ccypair, quantity, entryPrice)
+        usd, quote = usd + usdChange, quote + quoteChange
+        lastReset = k
+
+        # LetProfitsRun exit, independent of the stop ladder
+        if side > 0:
+            setHigh = s.hist0 > params.high_histogram
+            carry = lastHighHist
+            def exit_(lo, hi):
+                hy = np.maximum(np.maximum.accumulate(np.where(setHigh[e:hi], np.arange(e, hi), -1)), carry)[lo - e:]
+                high = (hy >= 0) & (hy >= s.lastCrossHour[lo:hi])
+                h = s.hist0[lo:hi]
+                return (s.bid[lo:hi] > secondTarget) & ((high & (h < params.mid_histogram)) | (~high & (h < params.low_histogram)))
+        else:
+            setHigh = s.hist0 < params.high_histogram * -1
+            carry = lastHighHist
+            def exit_(lo, hi):
+                hy = np.maximum(np.maximum.accumulate(np.where(setHigh[e:hi], np.arange(e, hi), -1)), carry)[lo - e:]
+                high = (hy >= 0) & (hy >= s.lastCrossHour[lo:hi])
+                h = s.hist0[lo:hi]
+                return (s.ask[lo:hi] < secondTarget) & ((high & (h > params.mid_histogram * -1)) | (~high & (h > params.low_histogram * -1)))
+        x = _first(exit_, e, n)
+
+        # Walk the stop ladder: a rung moves the stop from the next hour, the stop fills before OnData
+        stop, rung, rungFrom, stopFrom = initialStop, 0, e, e + 1
+        while True:
+            r = n
+            if rung < len(rungs):
+                trigger, newStop, gated = rungs[rung]
+                atrOk = s.atr0 > params.stop_atr if gated else np.ones(n, dtype=bool)
+                moved = s.price > trigger if side > 0 else s.price < trigger
+                limit = min(n, x + 1)
+                r = _first(lambda lo, hi: moved[lo:hi] & atrOk[lo:hi], rungFrom, limit)
+                r = n if r >= limit else r
+            stopped = s.bidLow < stop if side > 0 else s.askHigh > stop
+            limit = min(n, r + 1, x + 1)
+            st = _first(lambda lo, hi: stopped[lo:hi], stopFrom, limit)
+            st = n if st >= limit else st
+            if st < n and st <= x and st <= r:
+                exitAt, lastOnData, reason = st, st - 1, STOPPED
+                exitPrice = min(stop, float(s.bid[st])) if side > 0 else max(stop, float(s.ask[st]))
+                break
+            if x <= r or r >= n:                                        # a close drops that hour's stop update
+                if x < n:
+                    exitAt, lastOnData, reason = x, x, CLOSED
+                    exitPrice = float(s.bid[x] if side > 0 else s.ask[x])
+                else:
+                    exitAt, lastOnData, reason, exitPrice = -1, n - 1, OPEN, math.nan
+                break
+            stop, rung, rungFrom, stopFrom = newStop, rung + 1, r, r + 1
+
+        # The handler runs before stop fills, so the pair is next seen flat by a bar after the exit hour
+        flatFrom = int(np.searchsorted(s.barHour, exitAt, side='right')) if reason != OPEN else bars
+
+        highs = np.flatnonzero(setHigh[e:lastOnData + 1])
+        if highs.size:
+            lastHighHist = e + int(highs[-1])
+
+        if reason != OPEN:
+            usdChange, quoteChange = cash_change(ccypair, -quantity, exitPrice)
+            usd, quote = usd + usdChange, quote + quoteChange
+        trades.append((s.time[e], s.time[exitAt] if exitAt >= 0 else -1, side, branch, quantity, entryPrice,
+                       initialStop, exitPrice, reason, rung,
+                       quantity * (exitPrice - entryPrice) * (s.quoteRate[exitAt] if exitAt >= 0 else 1.0)))
+
+    return np.array(trades, dtype=TRADE_DTYPE)
+
+
+''' EVENT DRIVEN REFERENCE '''
+
+class _Average(object):
+    ''' Incremental EMA (alpha = 2/(n+1)) or Wilder average, as in LEAN '''
+
+    def __init__(self, period, wilder=False):
+        self.period, self.wilder = period, wilder
+        self.samples, self.value = 0, 0.0
+
+    def update(self, value):
+        self.samples += 1
+        if self.wilder:
+            self.value += (value - self.value) / min(self.samples, self.period)
+        elif self.samples == 1:
+            self.value = value
+        else:
+            k = 2.0 / (self.period + 1)
+            self.value = value * k + self.value * (1 - k)
+        return self.samples >= self.period
+
+
+def run_reference(quotes, ccypair='AUDUSD', params=None, conversion=None):
+    '''
+    Hour by hour replay of PenskeFile with incremental indicators, used to check run()
+
+    Follows the LEAN time slice order: consolidators (FourHourBarHandler), stop fills, then OnData.
+    Deliberately written like the algorithm rather than for speed.
+    '''
+    params = params or params_for(ccypair)
+    t = np.asarray(quotes['time'], dtype=np.int64).tolist()
+    col = dict((name, np.asarray(quotes[name], dtype=float).tolist()) for name in QUOTE_COLUMNS)
+    n = len(t)
+    rates = quote_rates(quotes, ccypair, conversion).tolist()
+
+    ema100, fast, slow, signal = _Average(100), _Average(12), _Average(26), _Average(9)
+    atr14 = _Average(14, wilder=True)
+    ind = {'ema': 0.0, 'atr': 0.0, 'signal': 0.0, 'histogram': 0.0}
+    ready = {'ema': False, 'atr': False, 'macd': False}
+    bars = []
+    w = dict((name, []) for name in ('histogram', 'signal', 'atr', 'goLong', 'goShort', 'signalLong', 'signalShort', 'ema'))
+    state = {'GreenLight': 'N', 'HighHistThreshold': 'N', 'AdjustStop': 0, 'quantity': 0, 'stop': None,
+             'usd': float(params.cash), 'quote': 0.0, 'trade': None, 'prevClose': None}
+    trades = []
+
+    def book(quantity, price):
+        usd, quote = cash_change(ccypair, quantity, price)
+        state['usd'] += usd
+        state['quote'] += quote
+
+    def record(i, fill, reason):
+        entryTime, side, branch, q, entry, initialStop = state['trade']['opened']
+        state['quantity'], state['trade'] = 0, None
+        if reason != OPEN:
+            book(-q, fill)
+        trades.append((entryTime, t[i] if reason != OPEN else -1, side, branch, q, entry, initialStop, fill, reason,
+                       state['AdjustStop'], q * (fill - entry) * rates[i]))
+
+    def four_hour_bar(i, bar):
+        # Registered indicators first
+        o, h, l, c = [(bar['bid_' + f] + bar['ask_' + f]) / 2 for f in ('open', 'high', 'low', 'close')]
+        ready['ema'] = ema100.update(c)
+        prevClose = state['prevClose']
+        ready['atr'] = atr14.update(h - l if prevClose is None else max(h - l, abs(h - prevClose), abs(l - prevClose)))
+        state['prevClose'] = c
+        fastReady, slowReady = fast.update(c), slow.update(c)
+        if fastReady and slowReady:
+            if signal.update(fast.value - slow.value):
+                ind['histogram'] = fast.value - slow.value - signal.value
+                ready['macd'] = True
+            ind['signal'] = signal.value
+        ind['ema'], ind['atr'] = ema100.value, atr14.value
+
+        # FourHourBarHandler
+        bars.insert(0, bar)
+        values = {'histogram': ind['histogram'], 'signal': ind['signal'], 'atr': ind['atr'], 'ema': ind['ema'],
+                  'goLong': ind['histogram'] - ind['atr'] * 0.1, 'goShort': ind['atr'] * -0.1 - ind['histogram'],
+                  'signalLong': ind['signal'] * -1 - ind['atr'], 'signalShort': ind['signal'] - ind['atr']}
+        for name, window in w.items():
+            window.insert(0, values[name])
+            del window[3:]
+        del bars[3:]
+        if i < params.warmup or not all(ready.values()) or len(bars) < 3:
+            return
+
+        barRangePct = (h - l) / o
+        baseline = round(bar['ask_close'] - w['ema'][0], 5)
+        if (w['histogram'][1] < 0 and w['histogram'][0] > 0) or (w['histogram'][1] > 0 and w['histogram'][0] < 0):
+            state['GreenLight'], state['HighHistThreshold'] = 'Y', 'N'
+        if state['quantity']:
+            return
+
+        if barRangePct > params.bar_range_limit or w['atr'][0] > params.tradeopen_atr:
+            state['GreenLight'] = 'N'
+        crossLong = w['goLong'][1] < 0 and w['goLong'][0] > 0
+        crossShort = w['goShort'][1] < 0 and w['goShort'][0] > 0
+        branch = 0
+        if state['GreenLight'] == 'Y' and crossLong and baseline > 0:
+            branch = WITH_LONG
+        elif state['GreenLight'] == 'Y' and crossShort and baseline < 0:
+            branch = WITH_SHORT
+        elif state['GreenLight'] == 'Y' and w['signalLong'][0] > 0 and crossLong and baseline < 0 and w['signal'][1] < params.xbaseline_signal * -1:
+            branch = AGAINST_LONG
+        elif state['GreenLight'] == 'Y' and w['signalShort'][0] > 0 and crossShort and baseline > 0 and w['signal'][1] > params.xbaseline_signal:
+            branch = AGAINST_SHORT
+        if branch:
+            side = 1 if branch in (WITH_LONG, AGAINST_LONG) else -1
+            q = position_size(state['usd'] + state['quote'] * rates[i], w['atr'][0], ccypair, params) * side
+            bid, ask = col['bid_close'][i], col['ask_close'][i]
+            entry = ask if side > 0 else bid
+            book(q, entry)
+            initialStop, secondTarget, rungs = stop_ladder(side, entry, (bid + ask) / 2, w['atr'][0], ccypair, params)
+            state.update(quantity=q, stop=initialStop, AdjustStop=0, GreenLight='N')
+            state['trade'] = {'entry': i, 'target': secondTarget, 'rungs': rungs,
+                              'opened': (t[i], side, branch, q, entry, initialStop)}
+
+    working = None
+    for i in range(n):
+        # Consolidator scan, then bar update
+        if working is not None and t[i] >= working['end']:
+            four_hour_bar(i, working)
+            working = None
+        if working is None:
+            working = dict((name, col[name][i]) for name in QUOTE_COLUMNS)
+            working['end'] = t[i] // FOUR_HOURS * FOUR_HOURS + FOUR_HOURS
+        else:
+            for side in ('bid', 'ask'):
+                working[side + '_high'] = max(working[side + '_high'], col[side + '_high'][i])
+                working[side + '_low'] = min(working[side + '_low'], col[side + '_low'][i])
+                working[side + '_close'] = col[side + '_close'][i]
+        if t[i] + HOUR >= working['end']:
+            four_hour_bar(i, working)
+            working = None
+
+        bid, ask = col['bid_close'][i], col['ask_close'][i]
+        price = (bid + ask) / 2
+        q, trade = state['quantity'], state['trade']
+
+        # Stop fills (not on the data the order was placed with)
+        if q and i > trade['entry']:
+            if q > 0 and col['bid_low'][i] < state['stop']:
+                record(i, min(state['stop'], bid), STOPPED)
+            elif q < 0 and col['ask_high'][i] > state['stop']:
+                record(i, max(state['stop'], ask), STOPPED)
+
+        # OnData: ShiftFirmStop & LetProfitsRun for an invested pair
+        q, trade = state['quantity'], state['trade']
+        if not q:
+            continue
+        side = 1 if q > 0 else -1
+
+        stop, rung = state['stop'], state['AdjustStop']
+        for trigger, newStop, gated in trade['rungs'][rung:]:
+            if (price - trigger) * side > 0 and (not gated or w['atr'][0] > params.stop_atr):
+                stop, rung = newStop, rung + 1
+            else:
+                break
+
+        if w['histogram'][0] * side > params.high_histogram:
+            state['HighHistThreshold'] = 'Y'
+        threshold = params.mid_histogram if state['HighHistThreshold'] == 'Y' else params.low_histogram
+        if side > 0 and bid > trade['target'] and w['histogram'][0] < threshold:
+            record(i, bid, CLOSED)
+        elif side < 0 and ask < trade['target'] and w['histogram'][0] > threshold * -1:
+            record(i, ask, CLOSED)
+        else:
+            state['stop'], state['AdjustStop'] = stop, rung                # sent at the flush, a close drops it
+
+    if state['trade'] is not None:
+        record(n - 1, math.nan, OPEN)
+    return np.array(trades, dtype=TRADE_DTYPE)
+
+
+''' DATA & PARITY '''
+
+def load_quotes_csv(path):
+    '''
+    Reads hourly quotes from a CSV file with a header row of time + QUOTE_COLUMNS
+
+    time is the bar start in UTC, either epoch seconds or 'YYYY-MM-DD HH:MM[:SS]'.
+    '''
+    with open(path) as f:
+        rows = list(csv.DictReader(f))
+    quotes = {'time': np.array([_epoch(row['time']) for row in rows], dtype=np.int64)}
+    for name in QUOTE_COLUMNS:
+        quotes[name] = np.array([row[name] for row in rows], dtype=float)
+    return quotes
+
+
+def _epoch(value):
+    value = value.strip()
+    if value.lstrip('-').isdigit():
+        return int(value)
+    stamp = datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S' if len(value) > 16 else '%Y-%m-%d %H:%M')
+    return int(calendar.timegm(stamp.timetuple()))
+
+
+def synthetic_quotes(years=1, seed=0, start=1514764800, price=0.78, spread=0.00012, volatility=0.0012):
+    ''' Random walk hourly quotes with Oanda-like weekend gaps (Fri 21:00 to Sun 21:00 UTC) '''
+    rng = np.random.default_rng(seed)
+    t = start + np.arange(int(years * 365 * 24)) * HOUR
+    weekday, hour = (t // 86400 + 3) % 7, (t // HOUR) % 24           # 1970-01-01 was a Thursday
+    t = t[~(((weekday == 4) & (hour >= 21)) | (weekday == 5) | ((weekday == 6) & (hour < 21)))]
+    n = len(t)
+
+    # Volatility regimes so the failsafes and stop ladder all get exercised
+    regime = np.repeat(rng.uniform(0.5, 2.0, n // 500 + 1), 500)[:n]
+    steps = rng.standard_normal((n, 4)) * volatility * regime[:, None] / 2
+    close = price * np.exp(np.cumsum(steps.sum(axis=1)))
+    open_ = np.r_[price, close[:-1]]
+    wick = np.abs(steps[:, :2]) * close[:, None]
+    high = np.maximum(open_, close) + wick[:, 0]
+    low = np.minimum(open_, close) - wick[:, 1]
+    half = spread * price / 2
+
+    quotes = {'time': t}
+    for side, sign in (('bid', -1), ('ask', 1)):
+        quotes[side + '_open'] = open_ + sign * half
+        quotes[side + '_high'] = high + sign * half
+        quotes[side + '_low'] = low + sign * half
+        quotes[side + '_close'] = close + sign * half
+    return quotes
+
+
+def synthetic_pair(ccypair, years=1):
+    ''' synthetic_quotes with ccypair's own seed, and yen prices and spread for xxxJPY '''
+    jpy = ccypair[-3:] == 'JPY'
+    seed = PAIRS.index(ccypair) if ccypair in PAIRS else len(PAIRS) + sum(map(ord, ccypair))
+    return synthetic_quotes(years, seed=seed, price=80.0 if jpy else 0.78, spread=0.0002 if jpy else 0.00012)
+
+
+def load_source(args, ccypair):
+    ''' Quotes for ccypair from the --synthetic YEARS, --store ROOT or --csv PATH command line options '''
+    if args.synthetic:
+        return synthetic_pair(ccypair, args.synthetic)
+    if args.store:
+        import quotestore
+        return quotestore.QuoteStore(args.store).quotes(ccypair)
+    if args.csv:
+        return load_quotes_csv(args.csv.format(pair=ccypair))
+    raise ValueError('one of --csv, --store or --synthetic is required')
+
+
+def load_conversion(args, ccypair):
+    ''' load_source() quotes of ccypair's conversion_pair(), None when it needs none or they're missing '''
+    conversion = conversion_pair(ccypair)
+    if conversion is None:
+        return None
+    try:
+        return load_source(args, conversion)
+    except (KeyError, OSError):
+        return None
+
+
+def parity(quotes, ccypair='AUDUSD', params=None, conversion=None):
+    ''' Compares run() with run_reference(), returning (matches, vectorised trades, reference trades) '''
+    fast = run(quotes, ccypair, params, conversion=conversion)
+    reference = run_reference(quotes, ccypair, params, conversion)
+    same = len(fast) == len(reference)
+    for name in TRADE_DTYPE.names if same else ():
+        a, b = fast[name], reference[name]
+        same = same and (np.array_equal(a, b) if a.dtype.kind in 'iu' else np.allclose(a, b, rtol=0, atol=1e-9, equal_nan=True))
+    return same, fast, reference
+
+
+if __name__ == '__main__':
+    years = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    ccypair = sys.argv[2] if len(sys.argv) > 2 else 'AUDUSD'
+    quotes = synthetic_pair(ccypair, years)
+    conversion = synthetic_pair(conversion_pair(ccypair), years) if conversion_pair(ccypair) else None
+    began = timer.perf_counter()
+    trades = run(quotes, ccypair, conversion=conversion)
+    elapsed = timer.perf_counter() - began
+    same, _, reference = parity(quotes, ccypair, conversion=conversion)
+    print('{} hourly bars, {} trades in {:.3f}s, parity with event driven run: {}'.format(
+        len(quotes['time']), len(trades), elapsed, 'OK' if same else 'MISMATCH ({} reference trades)'.format(len(reference))))
@@ -0,0 +1,290 @@
+'''
+Benchmarks for the PenskeFile hot path and whole backtest throughput
+
+Drives main.PenskeFile through the local simulator (simulator.py) at 1, 10 and 50 pairs on synthetic
+or recorded quotes and reports, per scenario:
+
+- hourly bars per second end to end (best of --repeat uninstrumented runs)
+- latency percentiles for OnData, FourHourBarHandler, UpdateSignals, ShiftFirmStop, LetProfitsRun,
+  Failsafes, CancelOutstandings, OpenLong & OpenShort (best of --repeat timed runs, times are inclusive)
+- peak RSS, tracemalloc peak and Python memory blocks retained per bar (a separate traced run)
+
+Each scenario runs in a fresh process so the memory numbers are its own. Every repeated figure also
+records its spread, (worst - best) / best over the repeats. Results are written as JSON, and --compare
+flags regressions against a saved baseline (exit status 1): a metric regresses when it moves by more
+than the tolerance or twice the larger spread of the two runs, whichever is wider. p99 is only
+compared for methods called at least --min-calls times.
+
+    python bench.py --out baseline.json
+    python bench.py --store store --pairs AUDUSD,GBPJPY --counts 1,2 --out recorded.json
+    python bench.py --compare baseline.json --tolerance 0.1
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time as timer
+import tracemalloc
+
+import numpy as np
+
+import backtest
+import calibrate
+import simulator
+import thresholds
+
+METHODS = ('OnData', 'FourHourBarHandler', 'UpdateSignals', 'ShiftFirmStop', 'LetProfitsRun', 'Failsafes',
+           'CancelOutstandings', 'OpenLong', 'OpenShort')
+
+WARMUP = 100
+MIN_P99_CALLS = 200                     # fewer calls make p99 one of the few slowest calls, mostly noise
+SPREAD_FACTOR = 2.0                     # allowed change in multiples of the run to run spread
+
+
+''' DATA '''
+
+def source(data):
+    '''
+    Quote source for a data spec: ('synthetic', years), ('store', root) or ('csv', path with {pair})
+
+    Synthetic pairs each get their own seed (backtest.synthetic_pair) so they don't move in lockstep.
+    '''
+    kind, value = data
+    if kind == 'synthetic':
+        return lambda ticker: backtest.synthetic_pair(ticker, value)
+    if kind == 'store':
+        import quotestore
+        return quotestore.QuoteStore(value)
+    return lambda ticker: backtest.load_quotes_csv(value.format(pair=ticker))
+
+
+''' MEASUREMENT '''
+
+def instrument(algorithmType, samples):
+    ''' Subclass of algorithmType whose METHODS append their duration (ns) to samples[name] '''
+    namespace = {}
+    for name in METHODS:
+        if hasattr(algorithmType, name):
+            namespace[name] = _timed(getattr(algorithmType, name), samples.setdefault(name, []))
+    return type('Timed' + algorithmType.__name__, (algorithmType,), namespace)
+
+
+def _timed(method, sink):
+    clock, append = timer.perf_counter_ns, sink.append
+
+    def timed(self, *args):
+        began = clock()
+        try:
+            return method(self, *args)
+        finally:
+            append(clock() - began)
+    return timed
+
+
+def latencies(samples):
+    ''' Percentiles in microseconds for each method that was called '''
+    table = {}
+    for name, values in samples.items():
+        if values:
+            us = np.asarray(values, dtype=float) / 1000
+            p50, p90, p99 = np.percentile(us, (50, 90, 99))
+            table[name] = {'calls': len(us), 'p50_us': round(p50, 3), 'p90_us': round(p90, 3),
+                           'p99_us': round(p99, 3), 'max_us': round(us.max(), 3), 'total_ms': round(us.sum() / 1000, 3)}
+    return table
+
+
+def spread(values):
+    ''' (worst - best) / best of repeated measurements where lower is better '''
+    best = min(values)
+    return round((max(values) - best) / best, 4) if best > 0 else 0.0
+
+
+def best_latencies(tables):
+    ''' Per method and metric, the best of several latencies() tables and its spread over them '''
+    combined = {}
+    for name, stats in tables[0].items():
+        runs = [table[name] for table in tables if name in table]
+        best = dict((metric, min(run[metric] for run in runs)) for metric in stats)
+        best['spread'] = dict((metric, spread([run[metric] for run in runs]))
+                              for metric in ('p50_us', 'p90_us', 'p99_us', 'total_ms'))
+        combined[name] = best
+    return combined
+
+
+def scenario(spec):
+    '''
+    Runs one scenario (in its own process) and returns its result row
+
+    Pairs missing from thresholds.py (most of the synthetic universe) get thresholds calibrated on
+    their own quotes for the run. Failures are reported as skipped rather than stopping the suite.
+    '''
+    name, pairs = spec['name'], spec['pairs']
+    try:
+        algorithmType = simulator.load_algorithm(spec['algorithm'])
+        load = source(spec['data'])
+        quotes = dict((ccypair, load(ccypair)) for ccypair in pairs)
+        missing = dict((ccypair, quotes[ccypair]) for ccypair in pairs if ccypair not in thresholds.THRESHOLDS)
+        if missing:
+            thresholds.THRESHOLDS.update((ccypair, thresholds.PairThresholds(*row))
+                                         for ccypair, row in calibrate.calibrate(missing).items())
+        first = np.asarray(quotes[pairs[0]]['time'], dtype=np.int64)
+        start = simulator.EPOCH + timedelta(seconds=int(first[min(WARMUP, len(first) - 1)]))
+        end = simulator.EPOCH + timedelta(seconds=int(max(q['time'][-1] for q in quotes.values())) + backtest.HOUR)
+        hourlyBars = sum(len(q['time']) for q in quotes.values())
+        parameters = {'ccypairs': ','.join(pairs)}
+
+        def run(algorithm):
+            return simulator.Simulator(quotes, start, end, parameters=parameters).run(algorithm)
+
+        # Throughput, uninstrumented. Retained blocks are measured with the finished algorithm alive
+        seconds, blocks, orders = [], 0, 0
+        for _ in range(spec['repeat']):
+            before = sys.getallocatedblocks()
+            began = timer.perf_counter()
+            algorithm = run(algorithmType)
+            seconds.append(timer.perf_counter() - began)
+            blocks, orders = sys.getallocatedblocks() - before, len(algorithm.Transactions.orders)
+            del algorithm
+        best = min(seconds)
+
+        tables = []
+        for _ in range(spec['repeat']):
+            samples = {}
+            run(instrument(algorithmType, samples))
+            tables.append(latencies(samples))
+
+        tracemalloc.start()
+        run(algorithmType)
+        tracedPeak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return {'name': name, 'pairs': pairs, 'data': list(spec['data']), 'hourly_bars': hourlyBars,
+                'orders': orders, 'seconds': round(best, 4), 'bars_per_sec': round(hourlyBars / best, 1),
+                'seconds_spread': spread(seconds),
+                'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                'traced_peak_kb': round(tracedPeak / 1024, 1),
+                'retained_blocks_per_bar': round(blocks / hourlyBars, 4), 'methods': best_latencies(tables)}
+    except Exception as e:
+        return {'name': name, 'pairs': pairs, 'data': list(spec['data']), 'skipped': '{}: {}'.format(type(e).__name__, e)}
+
+
+def suite(specs):
+    rows = []
+    for spec in specs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            rows.append(pool.submit(scenario, spec).result())
+    return rows
+
+
+''' COMPARE '''
+
+def compare(current, baseline, tolerance=0.1, floorUs=1.0, minCalls=MIN_P99_CALLS):
+    '''
+    Regressions of current vs baseline results: (scenario, metric, baseline, current, change)
+
+    Throughput may not drop, and RSS and method p50/p99 may not grow, by more than tolerance or
+    SPREAD_FACTOR times the larger run to run spread recorded for the metric, whichever is wider.
+    Latency changes under floorUs microseconds are treated as noise, and p99 is skipped for methods
+    with fewer than minCalls calls in either run.
+    '''
+    previous = dict((row['name'], row) for row in baseline['scenarios'] if 'skipped' not in row)
+    regressions = []
+
+    def check(name, metric, old, new, higherIsWorse, spreads=(), floor=0.0):
+        if old is None or new is None or old <= 0 or abs(new - old) <= floor:
+            return
+        change = (new - old) / old
+        allowed = max([tolerance] + [SPREAD_FACTOR * s for s in spreads if s is not None])
+        if (change if higherIsWorse else -change) > allowed:
+            regressions.append((name, metric, old, new, round(change, 4)))
+
+    for row in current['scenarios']:
+        old = previous.get(row['name'])
+        if old is None or 'skipped' in row:
+            continue
+        check(row['name'], 'bars_per_sec', old['bars_per_sec'], row['bars_per_sec'], False,
+              (old.get('seconds_spread'), row.get('seconds_spread')))
+        check(row['name'], 'peak_rss_mb', old['peak_rss_mb'], row['peak_rss_mb'], True)
+        for method, stats in row['methods'].items():
+            before = old['methods'].get(method, {})
+            for metric in ('p50_us', 'p99_us'):
+                if metric == 'p99_us' and min(stats['calls'], before.get('calls', 0)) < minCalls:
+                    continue
+                spreads = (before.get('spread', {}).get(metric), stats.get('spread', {}).get(metric))
+                check(row['name'], '{}.{}'.format(method, metric), before.get(metric), stats[metric], True, spreads, floorUs)
+    return regressions
+
+
+''' COMMAND LINE '''
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'date': datetime.utcnow().isoformat(timespec='seconds'), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(), 'platform': platform.platform()}
+
+
+def report(rows):
+    for row in rows:
+        if 'skipped' in row:
+            print('{:<22} skipped ({})'.format(row['name'], row['skipped']))
+            continue
+        print('{:<22} {:>9,} bars {:>8.3f}s {:>10,.0f} bars/s  rss {:.1f} MB  traced {:.0f} KB  retained {:.3f} blocks/bar'.format(
+            row['name'], row['hourly_bars'], row['seconds'], row['bars_per_sec'], row['peak_rss_mb'],
+            row['traced_peak_kb'], row['retained_blocks_per_bar']))
+        for method, stats in sorted(row['methods'].items(), key=lambda item: -item[1]['total_ms']):
+            print('    {:<20} {:>9,} calls  p50 {:>8.2f}us  p90 {:>8.2f}us  p99 {:>8.2f}us  max {:>9.2f}us'.format(
+                method, stats['calls'], stats['p50_us'], stats['p90_us'], stats['p99_us'], stats['max_us']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark PenskeFile on the local simulator')
+    parser.add_argument('--algorithm', default='main.PenskeFile', help='module.Class')
+    parser.add_argument('--counts', default='1,10,50', help='pair counts to run, comma separated')
+    parser.add_argument('--pairs', help='pair universe in order (default: AUDUSD, GBPJPY, NZDJPY, ...)')
+    parser.add_argument('--years', type=float, default=2, help='synthetic years per pair')
+    parser.add_argument('--store', help='quotestore.py root for recorded quotes')
+    parser.add_argument('--csv', help='recorded hourly quote CSV path with {pair} placeholder')
+    parser.add_argument('--repeat', type=int, default=3, help='throughput and timed runs per scenario (best is kept)')
+    parser.add_argument('--out', help='write the results as JSON')
+    parser.add_argument('--compare', metavar='BASELINE', help='flag regressions against a saved JSON result')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative slowdown/growth, widened to twice the measured run to run spread')
+    parser.add_argument('--min-calls', type=int, default=MIN_P99_CALLS, help='fewest calls for which p99 is compared')
+    args = parser.parse_args(argv)
+
+    universe = args.pairs.split(',') if args.pairs else list(backtest.PAIRS)
+    data = ('store', args.store) if args.store else ('csv', args.csv) if args.csv else ('synthetic', args.years)
+    specs = []
+    for count in [int(c) for c in args.counts.split(',')]:
+        if count > len(universe):
+            parser.error('{} pairs requested but the universe only has {}'.format(count, len(universe)))
+        specs.append({'name': '{} pair{} {}'.format(count, '' if count == 1 else 's', data[0]),
+                      'pairs': universe[:count], 'data': data, 'repeat': args.repeat, 'algorithm': args.algorithm})
+
+    results = {'environment': environment(), 'scenarios': suite(specs)}
+    report(results['scenarios'])
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance, minCalls=args.min_calls)
+        for name, metric, old, new, change in regressions:
+            print('REGRESSION {:<22} {:<28} {} -> {} ({:+.1%})'.format(name, metric, old, new, change))
+        print('{} regression{} against {}'.format(len(regressions), '' if len(regressions) == 1 else 's', args.compare))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+'''
+Per pair threshold calibration for the PenskeFile strategy
+
+Reads hourly quotes for any number of pairs, builds their 4 hour bars and computes H4 ATR(14) and
+MACD(12,26,9) with backtest's indicators, then takes the quantiles of each distribution over the
+ready bars of every pair in one call:
+
+    stop_atr                ATR            stop schedule rungs 1-2 need ATR above it
+    tradeopen_atr           ATR            no entries above it (Failsafes)
+    xbaseline_signal        |signal|       against baseline entries need the signal line beyond it
+    high/mid/low_histogram  |histogram|    LetProfitsRun exits
+
+The table is a thresholds.py module, which main.py and backtest.py load once. It is printed to stdout
+unless --out names the module to update (--out thresholds.py replaces the shipped table). Pairs already
+in the table (thresholds.py itself when --out is missing or a new file) are kept unless they are
+recalibrated. --fit-to sets the quantile levels to where the given pairs' current thresholds sit in
+their own history, so new pairs are calibrated like the hand tuned ones.
+
+    python calibrate.py --store store --pairs EURUSD,GBPJPY --fit-to AUDUSD,NZDJPY > /tmp/thresholds.py
+    python calibrate.py --store store --pairs EURUSD,GBPJPY --fit-to AUDUSD,NZDJPY --out thresholds.py
+    python calibrate.py --synthetic 5 --pairs EURUSD --level stop_atr=0.6 --out /tmp/thresholds.py
+'''
+
+from datetime import datetime
+import argparse
+import os
+import runpy
+import sys
+
+import numpy as np
+
+import backtest
+
+FIELDS = ('xbaseline_signal', 'stop_atr', 'high_histogram', 'mid_histogram', 'low_histogram', 'tradeopen_atr')
+
+# Distribution each threshold is a quantile of, and its default level
+SOURCES = {'xbaseline_signal': 'signal', 'stop_atr': 'atr', 'high_histogram': 'histogram',
+           'mid_histogram': 'histogram', 'low_histogram': 'histogram', 'tradeopen_atr': 'atr'}
+LEVELS = {'xbaseline_signal': 0.9, 'stop_atr': 0.5, 'high_histogram': 0.9, 'mid_histogram': 0.7,
+          'low_histogram': 0.4, 'tradeopen_atr': 0.999}
+
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thresholds.py')
+
+
+''' INDICATORS '''
+
+def distributions(quotesByPair):
+    '''
+    ATR, |MACD histogram| and |MACD signal| per pair (rows in quotesByPair order), NaN where the
+    strategy wouldn't be trading yet or past the pair's data
+
+    The 4 hour bars and indicators are backtest's (resample_h4 and h4_indicators, which
+    indicator_series builds on), so the thresholds are quantiles of the values the strategy compares.
+    '''
+    indicators = [backtest.h4_indicators(backtest.resample_h4(quotes)[0]) for quotes in quotesByPair.values()]
+    width = max(len(h4['atr']) for h4 in indicators)
+    data = dict((name, np.full((len(indicators), width), np.nan)) for name in ('atr', 'histogram', 'signal'))
+    for row, h4 in enumerate(indicators):
+        ready = h4['ready'] - 1
+        data['atr'][row, ready:len(h4['atr'])] = h4['atr'][ready:]
+        data['histogram'][row, ready:len(h4['atr'])] = np.abs(h4['histogram'][ready:])
+        data['signal'][row, ready:len(h4['atr'])] = np.abs(h4['signal'][ready:])
+    return data
+
+
+''' CALIBRATION '''
+
+def calibrate(quotesByPair, levels=None):
+    ''' {pair: (threshold per FIELDS)} at the given quantile levels (LEVELS where not given) '''
+    levels = dict(LEVELS, **(levels or {}))
+    data = distributions(quotesByPair)
+    values = {}
+    for source in set(SOURCES.values()):
+        fields = [field for field in FIELDS if SOURCES[field] == source]
+        quantiles = np.nanquantile(data[source], [levels[field] for field in fields], axis=1)
+        values.update(zip(fields, quantiles))
+    return dict((pair, tuple(_significant(values[field][row]) for field in FIELDS))
+                for row, pair in enumerate(quotesByPair))
+
+
+def fit_levels(quotesByPair, table):
+    ''' Quantile levels where each pair's thresholds in table sit in its own history, averaged over the pairs '''
+    data = distributions(quotesByPair)
+    levels = {}
+    for field in FIELDS:
+        thresholds = np.array([table[pair][FIELDS.index(field)] for pair in quotesByPair])[:, None]
+        values = data[SOURCES[field]]
+        ranks = np.sum(values <= thresholds, axis=1) / np.sum(~np.isnan(values), axis=1)
+        levels[field] = float(np.clip(ranks.mean(), 0.0, 1.0))
+    return levels
+
+
+def _significant(value, digits=2):
+    return float('{:.{}g}'.format(value, digits))
+
+
+''' TABLE '''
+
+def load_table(path=TABLE_PATH):
+    ''' ({pair: thresholds tuple}, {pair: note}) from a thresholds.py, empty when it doesn't exist '''
+    if not os.path.exists(path):
+        return {}, {}
+    module = runpy.run_path(path)
+    return dict((pair, tuple(row)) for pair, row in module['THRESHOLDS'].items()), dict(module.get('NOTES', {}))
+
+
+def format_table(table, notes):
+    ''' thresholds.py source for the table '''
+    lines = [
+        "'''",
+        'Per pair thresholds for the PenskeFile strategy, generated by calibrate.py',
+        '',
+        'Loaded once when the algorithm initialises (main.py) and by backtest.params_for. Regenerate with',
+        'calibrate.py rather than editing by hand, NOTES records where each row came from.',
+        "'''",
+        '',
+        'from collections import namedtuple',
+        '',
+        "PairThresholds = namedtuple('PairThresholds', {})".format(repr(FIELDS)),
+        '',
+        'THRESHOLDS = {']
+    for pair in sorted(table):
+        lines.append("    '{}': PairThresholds({}),".format(pair, ', '.join(repr(float(v)) for v in table[pair])))
+    lines += ['}', '', 'NOTES = {']
+    for pair in sorted(table):
+        lines.append("    '{}': {},".format(pair, repr(notes.get(pair, ''))))
+    lines += ['}', '']
+    return '\n'.join(lines)
+
+
+def write_table(table, notes, path=TABLE_PATH):
+    staging = path + '.tmp'
+    with open(staging, 'w') as f:
+        f.write(format_table(table, notes))
+    os.replace(staging, path)
+
+
+''' COMMAND LINE '''
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Calibrate per pair PenskeFile thresholds from history')
+    parser.add_argument('--pairs', required=True, help='pairs to calibrate, comma separated')
+    parser.add_argument('--csv', help='hourly quote CSV path with {pair} placeholder')
+    parser.add_argument('--store', help='quotestore.py root to read the quotes from')
+    parser.add_argument('--synthetic', type=float, metavar='YEARS', help='use synthetic quotes instead of CSV')
+    parser.add_argument('--level', action='append', metavar='FIELD=QUANTILE', help='quantile level override')
+    parser.add_argument('--fit-to', help='pairs already in the table to fit the quantile levels to')
+    parser.add_argument('--out', help='thresholds module to update, starting from thresholds.py when it doesn\'t exist '
+                                      '(default: print the table to stdout)')
+    args = parser.parse_args(argv)
+
+    if not (args.synthetic or args.store or args.csv):
+        parser.error('one of --csv, --store or --synthetic is required')
+
+    base = args.out if args.out and os.path.exists(args.out) else TABLE_PATH     # otherwise start from the shipped table
+    table, notes = load_table(base)
+    log = lambda message: print(message, file=sys.stderr)
+
+    levels = {}
+    if args.fit_to:
+        reference = args.fit_to.split(',')
+        missing = [pair for pair in reference if pair not in table]
+        if missing:
+            parser.error('not in {}: {}'.format(base, ', '.join(missing)))
+        levels = fit_levels(dict((pair, backtest.load_source(args, pair)) for pair in reference), table)
+        log('Levels fitted to {}: {}'.format(args.fit_to, ', '.join('{} {:.3f}'.format(k, v) for k, v in levels.items())))
+    for item in args.level or ():
+        field, value = item.split('=', 1)
+        if field not in FIELDS:
+            parser.error('unknown threshold: {}'.format(field))
+        levels[field] = float(value)
+
+    quotesByPair = dict((pair, backtest.load_source(args, pair)) for pair in args.pairs.split(','))
+    levels = dict(LEVELS, **levels)
+    for pair, row in calibrate(quotesByPair, levels).items():
+        time = quotesByPair[pair]['time']
+        table[pair] = row
+        notes[pair] = 'calibrated {} from {} to {} at levels {}'.format(
+            datetime.utcnow().strftime('%Y-%m-%d'), _date(time[0]), _date(time[-1]),
+            ' '.join('{:.3g}'.format(levels[field]) for field in FIELDS))
+        log('{}: {}'.format(pair, ', '.join('{} {:g}'.format(field, value) for field, value in zip(FIELDS, row))))
+
+    if args.out:
+        write_table(table, notes, args.out)
+        log('{} pairs written to {}'.format(len(table), args.out))
+    else:
+        sys.stdout.write(format_table(table, notes))
+
+
+def _date(epoch):
+    return datetime.utcfromtimestamp(int(epoch)).strftime('%Y-%m-%d')
+
+
+if __name__ == '__main__':
+    main()
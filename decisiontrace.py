@@ -0,0 +1,138 @@
+'''
+Per bar decision trace for PenskeFile style strategies
+
+Replaces switching the commented Debug lines back on: each completed 4 hour bar writes one fixed
+width numeric record (histogram, signal, ATR, baseline, triggers, GreenLight, AdjustStop, the entry
+branch taken and the failsafe flags) into a preallocated ring buffer. Nothing is formatted or
+logged while the algorithm runs, so tracing costs one row assignment per bar.
+
+Records can be sampled (every Nth bar of each pair) or filtered by a condition. Save writes the
+records added since the previous Save, oldest first, as an .npz of the record array and the pair
+names to the ObjectStore, or to a file when the algorithm has none. The dumps of a run (on fills from
+OnOrderEvent and at the end) are consecutive segments that Load joins back into one array per field,
+so a fill costs only its new records.
+
+Usage from an algorithm (the trace parameter is "capacity[:every[:filter]]", e.g. "4096:1:entries"):
+    self.trace = DecisionTrace.FromParameter(self.GetParameter("trace"), self.GetParameter("trace_dump"))
+    self.trace.Record(self.Time, pair, branch, self.router.Quantity(pair.ccypair), self.Portfolio.Cash)
+    self.trace.Save(self, "trace-final")
+
+    columns = DecisionTrace.Load("storage/trace-12", "storage/trace-final")     # simulator.py ObjectStore files
+'''
+
+from datetime import datetime
+import io
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+
+TRACE_DTYPE = np.dtype([
+    ('time', 'i8'), ('pair', 'i2'), ('branch', 'i1'), ('greenLight', 'i1'), ('highHist', 'i1'),
+    ('adjustStop', 'i1'), ('barRangeExceeded', 'i1'), ('highVolWarning', 'i1'), ('quantity', 'i8'),
+    ('hist0', 'f8'), ('hist1', 'f8'), ('signal0', 'f8'), ('signal1', 'f8'), ('atr', 'f8'), ('ema', 'f8'),
+    ('baseline', 'f8'), ('goLong0', 'f8'), ('goLong1', 'f8'), ('goShort0', 'f8'), ('goShort1', 'f8'),
+    ('signalLong', 'f8'), ('signalShort', 'f8'), ('barRangePct', 'f8'), ('reversalLong', 'f8'),
+    ('reversalShort', 'f8'), ('cash', 'f8')])
+
+# Filters for the third part of the trace parameter, called as condition(pair, branch, quantity)
+CONDITIONS = {
+    'all': None,
+    'entries': lambda pair, branch, quantity: branch != 0,
+    'greenlight': lambda pair, branch, quantity: pair.GreenLight == 'Y',
+    'invested': lambda pair, branch, quantity: quantity != 0,
+    'failsafes': lambda pair, branch, quantity: pair.BarRangeExceeded == 'Y' or pair.HighVolWarning == 'Y'}
+
+class DecisionTrace(object):
+
+    def __init__(self, capacity=4096, every=1, condition=None, dumpPrefix=None):
+        self.records = np.zeros(capacity, dtype=TRACE_DTYPE)
+        self.capacity = capacity
+        self.every = every
+        self.condition = condition
+        self.dumpPrefix = dumpPrefix
+        self.offered = {}                                                  # bars offered per ccypair
+        self.count = 0
+        self.saved = 0                                                     # count at the last Save
+        self.pairs = {}
+
+    @staticmethod
+    def FromParameter(value, dumpPrefix=None):
+        ''' DecisionTrace from "capacity[:every[:filter]]", or None when tracing is off '''
+        if not value:
+            return None
+        parts = value.split(':')
+        capacity = int(parts[0])
+        every = int(parts[1]) if len(parts) > 1 and parts[1] else 1
+        condition = CONDITIONS[parts[2]] if len(parts) > 2 else None
+        return DecisionTrace(capacity, every, condition, dumpPrefix or None)
+
+    def Record(self, time, pair, branch, quantity, cash=0.0):
+        offered = self.offered[pair.ccypair] = self.offered.get(pair.ccypair, 0) + 1
+        if self.every > 1 and offered % self.every:
+            return
+        if self.condition is not None and not self.condition(pair, branch, quantity):
+            return
+
+        index = self.pairs.get(pair.ccypair)
+        if index is None:
+            index = self.pairs[pair.ccypair] = len(self.pairs)
+
+        self.records[self.count % self.capacity] = (
+            int((time - EPOCH).total_seconds()), index, branch, pair.GreenLight == 'Y', pair.HighHistThreshold == 'Y',
+            pair.AdjustStop, pair.BarRangeExceeded == 'Y', pair.HighVolWarning == 'Y', quantity,
+            pair.H4MACDhistogramWindow[0], pair.H4MACDhistogramWindow[1], pair.H4MACDsignalWindow[0],
+            pair.H4MACDsignalWindow[1], pair.H4atrWindow[0], pair.H4emaWindow[0], pair.Baseline,
+            pair.goLongWindow[0], pair.goLongWindow[1], pair.goShortWindow[0], pair.goShortWindow[1],
+            pair.signalLongWindow[0], pair.signalShortWindow[0], pair.barRangePct, pair.barReversalLong,
+            pair.barReversalShort, cash)
+        self.count += 1
+
+    def Snapshot(self, since=0):
+        ''' Copy of the held records from the since-th one recorded on, oldest first '''
+        first = max(since, self.count - self.capacity)
+        return self.records[np.arange(first, self.count) % self.capacity]
+
+    def Columns(self, since=0):
+        snapshot = self.Snapshot(since)
+        columns = dict((name, snapshot[name]) for name in TRACE_DTYPE.names)
+        columns['pairs'] = np.array(sorted(self.pairs, key=self.pairs.get))
+        return columns
+
+    def ToBytes(self, since=0):
+        buffer = io.BytesIO()
+        self.Dump(buffer, since)
+        return buffer.getvalue()
+
+    def Dump(self, path, since=0):
+        ''' Writes the held records from the since-th on and the pair names to path (.npz), see Load '''
+        np.savez(path, records=self.Snapshot(since), pairs=np.array(sorted(self.pairs, key=self.pairs.get)))
+
+    def Save(self, algorithm, name):
+        '''
+        Writes the records added since the last Save to the ObjectStore (the storage directory in
+        simulator.py), otherwise to name.npz. Nothing is written when there are none. Records the ring
+        buffer overwrote before they were saved are lost, so size the capacity for the gap between fills
+        '''
+        if self.count == self.saved:
+            return False
+        since, self.saved = self.saved, self.count
+        store = getattr(algorithm, 'ObjectStore', None)
+        if store is not None:
+            store.SaveBytes(name, bytearray(self.ToBytes(since)))
+        else:
+            self.Dump(name + '.npz', since)
+        return True
+
+    @staticmethod
+    def Load(*paths):
+        ''' Columns of one dump, or of consecutive Save segments joined in the order given '''
+        records, pairs = [], None
+        for path in paths:
+            with np.load(path) as data:
+                records.append(data['records'])
+                pairs = data['pairs']                                      # pair indices only ever grow
+        records = np.concatenate(records)
+        columns = dict((name, records[name]) for name in TRACE_DTYPE.names)
+        columns['pairs'] = pairs
+        return columns
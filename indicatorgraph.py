@@ -0,0 +1,383 @@
+'''
+Shared indicator graph for PenskeFile style strategies
+
+- One Resampler per symbol builds every timeframe (H1, H4, H8, D1 ...) in a single pass over the base
+  bars, each timeframe from the next smaller one it divides, feeding one node per (symbol, timeframe)
+- One indicator per distinct (symbol, timeframe, type, params), however many strategies or pairs use it
+- The scalar multiply/subtract triggers (goLong, goShort, signalLong, signalShort) are computed in one
+  fused step after the indicators update, replacing the IndicatorExtensions.Times/Minus wrappers
+- Subscribers are called once everything on the node holds the new bar, so several strategies or
+  variants on a timeframe share its bars and indicators. IndicatorGraph.Attach hands every algorithm
+  instance in a process the same graph while sharing is on (see variants.py)
+- EMA/ATR/MACD are Python ports of the LEAN indicators (same seeding and readiness) whose state can
+  be saved and restored for warm restarts (see snapshot.py), which the LEAN ones don't allow
+
+Usage from an algorithm:
+    self.graph = IndicatorGraph.Attach(self)
+    node = self.graph.Node("AUDUSD", ParsePeriod("4h"))
+    triggers = node.Triggers(100, 14, 12, 26, 9)
+    node.Subscribe(self.FourHourBarHandler)                 # handler(node, bar)
+'''
+
+from datetime import datetime, timedelta
+
+from QuantConnect import *
+from QuantConnect.Data.Consolidators import *
+from QuantConnect.Data.Market import *
+
+EPOCH = datetime(1970, 1, 1)
+UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+
+def ParsePeriod(text):
+    ''' timedelta from "30m", "1h", "4h", "8h", "1d" ... '''
+    return timedelta(seconds=int(text[:-1]) * UNITS[text[-1].lower()])
+
+class IndicatorValue(object):
+
+    __slots__ = ('Value',)
+
+    def __init__(self, value=0.0):
+        self.Value = value
+
+class IndicatorValueHolder(object):
+
+    # Sub-indicator outputs such as Macd.Histogram, read through .Current.Value
+
+    __slots__ = ('Current',)
+
+    def __init__(self):
+        self.Current = IndicatorValue()
+
+class Ema(object):
+
+    # LEAN ExponentialMovingAverage: identity on the first sample, ready after period samples
+
+    __slots__ = ('period', 'k', 'Samples', 'Current')
+
+    def __init__(self, period):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.Samples = 0
+        self.Current = IndicatorValue()
+
+    @property
+    def IsReady(self):
+        return self.Samples >= self.period
+
+    def Update(self, time, value):
+        self.Samples += 1
+        current = self.Current
+        current.Value = value if self.Samples == 1 else value * self.k + current.Value * (1 - self.k)
+        return self.Samples >= self.period
+
+    def State(self):
+        return (self.Samples, self.Current.Value)
+
+    def Restore(self, state):
+        self.Samples, self.Current.Value = int(state[0]), state[1]
+
+class Atr(object):
+
+    # LEAN AverageTrueRange (Wilders): first true range is high - low, simple average until ready
+
+    __slots__ = ('period', 'Samples', 'Current', 'previous')
+
+    def __init__(self, period):
+        self.period = period
+        self.Samples = 0
+        self.Current = IndicatorValue()
+        self.previous = None
+
+    @property
+    def IsReady(self):
+        return self.Samples >= self.period
+
+    def Update(self, bar):
+        high, low = bar.High, bar.Low
+        if self.previous is None:
+            trueRange = high - low
+        else:
+            trueRange = max(high - low, abs(high - self.previous), abs(low - self.previous))
+        self.previous = bar.Close
+        self.Samples += 1
+        current = self.Current
+        current.Value += (trueRange - current.Value) / min(self.Samples, self.period)
+        return self.Samples >= self.period
+
+    def State(self):
+        return (self.Samples, self.Current.Value, float('nan') if self.previous is None else self.previous)
+
+    def Restore(self, state):
+        self.Samples, self.Current.Value = int(state[0]), state[1]
+        self.previous = None if state[2] != state[2] else state[2]
+
+class Macd(object):
+
+    # LEAN MovingAverageConvergenceDivergence: Signal takes samples once Fast & Slow are ready,
+    # Histogram once Signal is ready
+
+    __slots__ = ('Fast', 'Slow', 'Signal', 'Histogram', 'Samples', 'Current')
+
+    def __init__(self, fast, slow, signal):
+        self.Fast, self.Slow, self.Signal = Ema(fast), Ema(slow), Ema(signal)
+        self.Histogram = IndicatorValueHolder()
+        self.Samples = 0
+        self.Current = IndicatorValue()
+
+    @property
+    def IsReady(self):
+        return self.Signal.IsReady
+
+    def Update(self, time, value):
+        self.Samples += 1
+        fastReady = self.Fast.Update(time, value)
+        slowReady = self.Slow.Update(time, value)
+        self.Current.Value = macd = self.Fast.Current.Value - self.Slow.Current.Value
+        if fastReady and slowReady and self.Signal.Update(time, macd):
+            self.Histogram.Current.Value = macd - self.Signal.Current.Value
+        return self.Signal.IsReady
+
+    def State(self):
+        return (self.Samples, self.Current.Value) + self.Fast.State() + self.Slow.State() + \
+            self.Signal.State() + (self.Histogram.Current.Value,)
+
+    def Restore(self, state):
+        self.Samples, self.Current.Value = int(state[0]), state[1]
+        self.Fast.Restore(state[2:4])
+        self.Slow.Restore(state[4:6])
+        self.Signal.Restore(state[6:8])
+        self.Histogram.Current.Value = state[8]
+
+class TriggerSet(object):
+
+    # Fused EMA/ATR/MACD trigger values for one parameter set on a node
+
+    __slots__ = ('ema', 'atr', 'macd', 'emaValue', 'atrValue', 'macdValue', 'histogram', 'signal',
+                 'goLong', 'goShort', 'signalLong', 'signalShort')
+
+    def __init__(self, ema, atr, macd):
+        self.ema = ema
+        self.atr = atr
+        self.macd = macd
+        self.emaValue = self.atrValue = self.macdValue = self.histogram = self.signal = 0.0
+        self.goLong = self.goShort = self.signalLong = self.signalShort = 0.0
+
+    @property
+    def IsReady(self):
+        return self.ema.IsReady and self.atr.IsReady and self.macd.IsReady
+
+    def Update(self):
+        self.emaValue = self.ema.Current.Value
+        self.atrValue = atr = self.atr.Current.Value
+        self.macdValue = self.macd.Current.Value
+        self.histogram = histogram = self.macd.Histogram.Current.Value
+        self.signal = signal = self.macd.Signal.Current.Value
+
+        self.goLong = histogram - atr * 0.1                              # Main Long trigger (1)
+        self.goShort = atr * -0.1 - histogram                            # Main Short trigger (2)
+        self.signalLong = signal * -1 - atr                              # Against baseline & Long (3)
+        self.signalShort = signal - atr                                  # Against baseline & Short (4)
+
+class Timeframe(object):
+
+    # Working bar of one Resampler period, as epoch seconds and bid/ask [open, high, low, close]
+
+    __slots__ = ('seconds', 'handlers', 'children', 'start', 'end', 'bid', 'ask')
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.handlers = []
+        self.children = []
+        self.start = None
+        self.end = None
+        self.bid = self.ask = None
+
+class Resampler(PythonConsolidator):
+
+    # Every timeframe of one symbol from its base bars in one pass. Periods are aligned to midnight UTC
+    # like QuoteBarConsolidator, and each is built from the largest smaller period dividing it
+    # (H1 -> H4 -> H8 -> D1), so a base bar updates one working bar however many timeframes there are.
+    # A period fires with the base bar that completes it, or on a later bar/scan after a data gap
+
+    def __init__(self, symbol, base):
+        self.InputType = QuoteBar
+        self.OutputType = QuoteBar
+        self.WorkingData = None
+        self.Consolidated = None
+        self.symbol = symbol
+        self.base = int(base.total_seconds())
+        self.baseHandlers = []
+        self.frames = {}
+        self.roots = []
+        self.ordered = []
+
+    def Subscribe(self, period, handler):
+        ''' handler(resampler, bar) for each completed bar of period (base bars are passed through) '''
+        seconds = int(period.total_seconds())
+        if seconds == self.base:
+            self.baseHandlers.append(handler)
+            return
+        if seconds % self.base:
+            raise ValueError("{} is not a multiple of the {}s base bars".format(period, self.base))
+        frame = self.frames.get(seconds)
+        if frame is None:
+            frame = self.frames[seconds] = Timeframe(seconds)
+            self.Link()
+        frame.handlers.append(handler)
+
+    def Link(self):
+        self.ordered = [self.frames[seconds] for seconds in sorted(self.frames)]
+        self.roots = []
+        for i, frame in enumerate(self.ordered):
+            frame.children = []
+            sources = [f for f in self.ordered[:i] if frame.seconds % f.seconds == 0]
+            (sources[-1].children if sources else self.roots).append(frame)
+
+    def Update(self, data):
+        for handler in self.baseHandlers:
+            handler(self, data)
+        self.symbol = data.Symbol
+        start = int((data.Time - EPOCH).total_seconds())
+        b, a = data.Bid, data.Ask
+        for frame in self.roots:
+            self.Add(frame, start, start + self.base, b.Open, b.High, b.Low, b.Close, a.Open, a.High, a.Low, a.Close)
+
+    def Add(self, frame, start, end, bo, bh, bl, bc, ao, ah, al, ac):
+        if frame.start is not None and start >= frame.end:
+            self.Fire(frame)
+        if frame.start is None:
+            frame.start = start - start % frame.seconds
+            frame.end = frame.start + frame.seconds
+            frame.bid, frame.ask = [bo, bh, bl, bc], [ao, ah, al, ac]
+        else:
+            bid, ask = frame.bid, frame.ask
+            if bh > bid[1]: bid[1] = bh
+            if bl < bid[2]: bid[2] = bl
+            if ah > ask[1]: ask[1] = ah
+            if al < ask[2]: ask[2] = al
+            bid[3], ask[3] = bc, ac
+        if end >= frame.end:
+            self.Fire(frame)
+
+    def Scan(self, time):
+        epoch = time if isinstance(time, int) else int((time - EPOCH).total_seconds())
+        for frame in self.ordered:
+            if frame.start is not None and epoch >= frame.end:
+                self.Fire(frame)
+
+    def Fire(self, frame):
+        start, end, bid, ask = frame.start, frame.end, frame.bid, frame.ask
+        frame.start = None
+        bar = QuoteBar(EPOCH + timedelta(seconds=start), self.symbol, Bar(*bid), 0, Bar(*ask), 0,
+                       timedelta(seconds=frame.seconds))
+        self.Consolidated = bar
+        for handler in frame.handlers:
+            handler(self, bar)
+        for child in frame.children:
+            self.Add(child, start, end, bid[0], bid[1], bid[2], bid[3], ask[0], ask[1], ask[2], ask[3])
+
+class BarNode(object):
+
+    # One timeframe for one symbol (fed by the symbol's Resampler) and everything computed from its bars
+
+    def __init__(self, resampler, symbol, period):
+        self.symbol = symbol
+        self.period = period
+        self.indicators = {}
+        self.triggers = {}
+        self.handlers = []
+        self.bar = None
+        self.resumeAfter = None                                          # restored bar end, see snapshot.py
+
+        resampler.Subscribe(period, self.OnBar)
+
+    def Indicator(self, kind, *params):
+        key = (kind,) + params
+        indicator = self.indicators.get(key)
+        if indicator is None:
+            if kind == 'EMA':
+                indicator = Ema(*params)
+            elif kind == 'ATR':
+                indicator = Atr(*params)
+            elif kind == 'MACD':
+                indicator = Macd(*params)
+            else:
+                raise ValueError("Unsupported indicator type: {}".format(kind))
+            self.indicators[key] = indicator
+        return indicator
+
+    def Triggers(self, emaPeriod=100, atrPeriod=14, fast=12, slow=26, signal=9):
+        key = (emaPeriod, atrPeriod, fast, slow, signal)
+        triggers = self.triggers.get(key)
+        if triggers is None:
+            triggers = TriggerSet(self.Indicator('EMA', emaPeriod), self.Indicator('ATR', atrPeriod),
+                                  self.Indicator('MACD', fast, slow, signal))
+            self.triggers[key] = triggers
+        return triggers
+
+    def Subscribe(self, handler):
+        if handler not in self.handlers:
+            self.handlers.append(handler)
+
+    def OnBar(self, sender, bar):
+
+        # After a restore the warm up replays bars the snapshot already holds, those are skipped
+
+        if self.resumeAfter is not None:
+            if bar.EndTime <= self.resumeAfter:
+                return
+            self.resumeAfter = None
+
+        self.bar = bar
+
+        # Close based indicators take (time, close), ATR takes the whole bar
+        for key, indicator in self.indicators.items():
+            if key[0] == 'ATR':
+                indicator.Update(bar)
+            else:
+                indicator.Update(bar.EndTime, bar.Close)
+
+        for triggers in self.triggers.values():
+            triggers.Update()
+
+        for handler in self.handlers:
+            handler(self, bar)
+
+class IndicatorGraph(object):
+
+    # Registry of resamplers by symbol and bar nodes by (symbol, timeframe), shared by every
+    # strategy/pair in the algorithm, or by every algorithm instance in the process while sharing
+
+    sharing = False
+    shared = None
+
+    def __init__(self, algorithm, base=timedelta(hours=1)):
+        self.algorithm = algorithm
+        self.base = base
+        self.resamplers = {}
+        self.nodes = {}
+
+    @classmethod
+    def Attach(cls, algorithm):
+        ''' The process wide graph while sharing is on, otherwise a new one for algorithm '''
+        if not cls.sharing:
+            return cls(algorithm)
+        if cls.shared is None:
+            cls.shared = cls(algorithm)
+        return cls.shared
+
+    def Resampler(self, symbol):
+        key = str(symbol)
+        resampler = self.resamplers.get(key)
+        if resampler is None:
+            resampler = self.resamplers[key] = Resampler(symbol, self.base)
+            self.algorithm.SubscriptionManager.AddConsolidator(symbol, resampler)
+        return resampler
+
+    def Node(self, symbol, period):
+        key = (str(symbol), period)
+        node = self.nodes.get(key)
+        if node is None:
+            node = BarNode(self.Resampler(symbol), symbol, period)
+            self.nodes[key] = node
+        return node
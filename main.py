@@ -4,6 +4,19 @@ VERSION 1.0 (Under Construction)
   Trades in profit at atrx2 and above will use histogram value thresholds to take profits
 - Firm stop will be shifted up again at atrx2 to atrx0.5 & at atrx4 to atrx2.5
 - Added failsafes and optimisation prior to Go Live on a demo account
+- Portfolio mode: one algorithm trades every pair in self.ccypairs, each with its own PairState
+- Signals, GreenLight & entries are evaluated once per completed 4 hour bar, stops & exits stay hourly
+- Indicators come from a shared IndicatorGraph (one per symbol/timeframe/params) with fused triggers
+- Firm stop shifts follow a stop schedule built at entry, only the next trigger is checked each update
+- Pairs come from the ccypairs parameter (comma separated, AUDUSD when not set)
+- Decision trace (trace parameter) records each 4 hour bar's inputs in a ring buffer instead of Debug lines
+- Warm restarts: indicator, window & trade state snapshots in the ObjectStore, restores only catch up missed bars
+- Orders go through an OrderRouter: intents are netted per pair and sent once at the end of each OnData pass
+- Per pair thresholds come from the calibrated thresholds.py table (calibrate.py), read once per pair
+- Signal timeframe (4h by default) and Downside/UpsideRisk can be set by parameters, so variants on H1/H4/H8/D1
+  can share one feed and indicator graph (variants.py)
+- Fills, stop updates, equity & positions go to a columnar results store (results parameter) instead of the fill
+  Debug line; results.py reports Sharpe, drawdown, win rate per entry branch & R multiples
 
 
 VERSION 0.1 (2 Oct 2020)
@@ -24,385 +37,532 @@ from QuantConnect import *
 from QuantConnect.Algorithm import *
 from QuantConnect.Indicators import *
 from QuantConnect.Data.Consolidators import *
-from datetime import date, datetime, timedelta
+from datetime import timedelta
+from indicatorgraph import IndicatorGraph, ParsePeriod
+from decisiontrace import DecisionTrace
+from orderrouter import OrderRouter
+from thresholds import THRESHOLDS
+from results import ResultsRecorder
+import snapshot
 import math
 
+TARGETS = ('InitialStopLong', 'MidStopLong', 'FirstTargetLong', 'SecondTargetLong', 'HighStopLong',
+           'ThirdTargetLong', 'HugeMoveStopLong', 'HugeMoveLong',
+           'InitialStopShort', 'MidStopShort', 'FirstTargetShort', 'SecondTargetShort', 'HighStopShort',
+           'ThirdTargetShort', 'HugeMoveStopShort', 'HugeMoveShort')
+
+class PairState(object):
+
+    # Everything PenskeFile tracks for one ccy pair. Slotted so 20+ pairs stay compact and attribute
+    # lookups in OnData stay cheap.
+
+    __slots__ = (
+        'ccypair', 'PriceRounding', 'JpyQuoted',
+        'triggers',
+        'window', 'H4emaWindow', 'H4atrWindow', 'H4macdWindow', 'H4MACDhistogramWindow', 'H4MACDsignalWindow',
+        'goLongWindow', 'goShortWindow', 'signalLongWindow', 'signalShortWindow',
+        'GreenLight', 'HighHistThreshold', 'AdjustStop', 'BarRangeExceeded', 'HighVolWarning',
+        'barRangePct', 'barReversalLong', 'barReversalShort', 'atrMultiplier', 'Baseline',
+        'TradeRisk', 'BuyPositionSize', 'SellPositionSize', 'CloseLongPosition', 'CloseShortPosition',
+        'XBaselineSignalThreshold', 'StopATRThreshold', 'HighHistogramThreshold', 'MidHistogramThreshold',
+        'LowHistogramThreshold', 'TradeOpenATRThreshold',
+        'XEntryPrice', 'EntryBranch', 'sl_order', 'StopFields', 'StopSchedule', 'StopSide', 'NextStopLevel') + TARGETS
+
+    def __init__(self, ccypair):
+        self.ccypair = ccypair
+        self.JpyQuoted = ccypair[-3:] == 'JPY'
+
+        if self.JpyQuoted:
+            self.PriceRounding = 3
+        else:
+            self.PriceRounding = 5
+
+        self.GreenLight = 'N'
+        self.HighHistThreshold = 'N'
+        self.AdjustStop = 0
+        self.EntryBranch = 0
+        self.BarRangeExceeded = 'N'
+        self.HighVolWarning = 'N'
+        self.sl_order = None
+        self.StopFields = UpdateOrderFields()
+
+        # Trade state until an entry (or a snapshot) sets it. A pair held without one has StopSide 0 and
+        # ShiftFirmStop rebuilds it from the holding and its stop order
+
+        self.StopSide = 0
+        self.StopSchedule = ()
+        self.NextStopLevel = float('inf')
+        self.XEntryPrice = float('nan')
+        for name in TARGETS:
+            setattr(self, name, float('nan'))
+
+    def SetStopTicket(self, ticket):
+        self.sl_order = ticket
+
 class PenskeFile(QCAlgorithm):
-    
+
     def Initialize(self):
-    
+
         # Setting main strategy parameters
 
         self.SetTimeZone(TimeZones.Utc)                                  # Sets settings to UTC time (-10 from AEST)
         #self.SetStartDate(date.today()-timedelta(days = 35))
         #self.SetEndDate(date.today()-timedelta(days = 1))
         self.SetStartDate(2018, 1, 16)
-        self.SetEndDate(2018, 3, 1) 
+        self.SetEndDate(2018, 3, 1)
         self.SetCash(10000)
         self.SetBrokerageModel(BrokerageName.OandaBrokerage)             # Configures Oanda fees, fill & slippage models
         self.SetWarmup(100)
 
-        # Securities to be traded
+        # Risk management variables (Set at 1.5% risk on each trade). Downside/UpsideRisk and the signal
+        # timeframe can be overridden per variant (downside_risk, upside_risk & timeframe parameters)
 
-        self.ccypair = "AUDUSD"                                          # For XAU pairs use .AddCfd
-        self.AddForex(self.ccypair, Resolution.Hour, Market.Oanda)
-        self.SetBenchmark(self.ccypair)
-        
-        if self.ccypair[-3:] == 'JPY':
-            self.PriceRounding = 3
-        else:
-            self.PriceRounding = 5
+        self.LossRisk = 0.015
+        self.DownsideRisk = float(self.GetParameter("downside_risk") or 1.5)
+        self.UpsideRisk = float(self.GetParameter("upside_risk") or 2)
+        self.timeframe = ParsePeriod(self.GetParameter("timeframe") or "4h")
+
+        # Securities to be traded (one PairState each, keyed by ticker)
+
+        self.ccypairs = (self.GetParameter("ccypairs") or "AUDUSD").split(",")   # For XAU pairs use .AddCfd
+        self.pairs = {}
+        self.graph = IndicatorGraph.Attach(self)
+        self.router = OrderRouter(self)                                  # Order intents, sent at the end of OnData
+
+        for ccypair in self.ccypairs:
+            self.AddForex(ccypair, Resolution.Hour, Market.Oanda)
+            self.pairs[ccypair] = self.InitialisePair(ccypair)
+
+        self.SetBenchmark(self.ccypairs[0])
+
+        # Decision trace, off unless the trace parameter is set ("capacity[:every[:filter]]"). With
+        # trace_dump set, the records added since the last dump are saved as <trace_dump>-<order id> on
+        # every fill and <trace_dump>-final at the end (DecisionTrace.Load joins them)
+
+        self.trace = DecisionTrace.FromParameter(self.GetParameter("trace"), self.GetParameter("trace_dump"))
+
+        # Warm restarts (see snapshot.py). State is saved to the ObjectStore under the snapshot parameter
+        # (PenskeFile-snapshot in live mode) after each slice that completed a 4 hour bar, shifted a stop
+        # or filled an order. A usable snapshot is restored here and the warm up only replays the bars
+        # after its last 4 hour bar. Pairs missing from it start cold, so then the full warm up runs (the
+        # restored pairs skip the bars they already hold)
+
+        self.snapshotKey = self.GetParameter("snapshot") or ("PenskeFile-snapshot" if self.LiveMode else None)
+        self.snapshotDue = False
+        restored = None
+
+        if self.snapshotKey and self.ObjectStore.ContainsKey(self.snapshotKey):
+            now = self.Time if self.LiveMode else self.StartDate
+            restored = snapshot.Restore(self, bytes(self.ObjectStore.ReadBytes(self.snapshotKey)), now)
+            cold = [ccypair for ccypair in self.ccypairs if ccypair not in (restored or ())]
+            if restored and not cold:
+                resume = min(restored.values())
+                self.SetWarmup(max(now - resume, timedelta(hours=1)))
+                self.Debug("Restored {}, catching up from {}".format(self.snapshotKey, resume))
+            elif restored:
+                self.Debug("Restored {} except {}, which start cold: full warm up".format(self.snapshotKey, ",".join(cold)))
+
+        # Results store (see results.py), off unless the results parameter names its root directory. Fills,
+        # stop updates, equity & positions are appended under <results>/<results_run> while the run goes on.
+        # A run that restored a snapshot carries on the run it restarted, any other starts it afresh
+
+        self.results = ResultsRecorder.FromParameter(self, self.GetParameter("results"), self.GetParameter("results_run"), {
+            "ccypairs": ",".join(self.ccypairs), "timeframe": self.GetParameter("timeframe") or "4h",
+            "downside_risk": self.DownsideRisk, "upside_risk": self.UpsideRisk}, resume=bool(restored))
+
+    def InitialisePair(self, ccypair):
+        pair = PairState(ccypair)
+
+        # Thresholds from the calibrated table (thresholds.py, see calibrate.py), copied onto the pair once
+
+        if ccypair not in THRESHOLDS:
+            raise KeyError("{} is missing from thresholds.py (see calibrate.py)".format(ccypair))
+        thresholds = THRESHOLDS[ccypair]
+        pair.XBaselineSignalThreshold = thresholds.xbaseline_signal
+        pair.StopATRThreshold = thresholds.stop_atr
+        pair.HighHistogramThreshold = thresholds.high_histogram
+        pair.MidHistogramThreshold = thresholds.mid_histogram
+        pair.LowHistogramThreshold = thresholds.low_histogram
+        pair.TradeOpenATRThreshold = thresholds.tradeopen_atr
+
+        # Four hour (self.timeframe) quote bars with the core indicators (EMA, ATR & MACD) and the fused
+        # Long/Short triggers (1)-(4). The graph updates them all before calling FourHourBarHandler
+
+        FourHours = self.graph.Node(ccypair, self.timeframe)
+        pair.triggers = FourHours.Triggers(100, 14, 12, 26, 9)
+        FourHours.Subscribe(self.FourHourBarHandler)
 
-        # Consolidation price data into four hour quote bars
-        
-        FourHours = QuoteBarConsolidator(timedelta(hours=4))
-        FourHours.DataConsolidated += self.FourHourBarHandler
-        self.SubscriptionManager.AddConsolidator(self.ccypair, FourHours)
-        
-        # Core indicator variables (4 hour EMA, ATR & MACD)
-
-        ema = self.EMA(self.ccypair, 100, Resolution.Hour)
-        self.H4ema = ExponentialMovingAverage(100)
-        self.RegisterIndicator(self.ccypair, self.H4ema, timedelta(hours=4))
-        
-        atr = self.ATR(self.ccypair, 14, MovingAverageType.Exponential, Resolution.Hour)
-        self.H4atr = AverageTrueRange(14)
-        self.RegisterIndicator(self.ccypair, self.H4atr, timedelta(hours=4))
-        
-        macd = self.MACD(self.ccypair, 12, 26, 9, MovingAverageType.Exponential, Resolution.Hour)
-        self.H4macd = MovingAverageConvergenceDivergence(12,26,9)
-        self.RegisterIndicator(self.ccypair, self.H4macd, timedelta(hours=4))
-        
-        self.SubscriptionManager.AddConsolidator(self.ccypair, FourHours)
-        self.GreenLight = 'N'
-        self.HighHistThreshold = 'N'
-        self.AdjustStop = 0
-        
-        # Indicator extensions
-        
-        # Main Long trigger (1)
-        self.workings1 = IndicatorExtensions.Times(self.H4atr, 0.1)
-        self.goLong = IndicatorExtensions.Minus(self.H4macd.Histogram, self.workings1)
-        
-        # Main Short trigger (2)
-        self.workings2 = IndicatorExtensions.Times(self.H4atr, -0.1)
-        self.goShort = IndicatorExtensions.Minus(self.workings2, self.H4macd.Histogram)
-        
-        # Against baseline & Long additional signal line trigger (3)
-        self.workings3a = IndicatorExtensions.Times(self.H4macd.Signal, -1)
-        self.workings3b = IndicatorExtensions.Times(self.H4atr, 1)
-        self.signalLong = IndicatorExtensions.Minus(self.workings3a, self.workings3b)
-        
-        # Against baseline & Short additional signal line trigger (4)
-        self.workings4 = IndicatorExtensions.Times(self.H4atr, 1)
-        self.signalShort = IndicatorExtensions.Minus(self.H4macd.Signal, self.workings4)
-        
         # Create rolling windows
-        
-        self.window = RollingWindow[QuoteBar](3)
-        
-        self.H4emaWindow = RollingWindow[float](3)
-        self.H4atrWindow = RollingWindow[float](3)
-        self.H4macdWindow = RollingWindow[float](3)
-        self.H4MACDhistogramWindow = RollingWindow[float](3)
-        self.H4MACDsignalWindow = RollingWindow[float](3)
-        
-        self.goLongWindow = RollingWindow[float](3)
-        self.goShortWindow = RollingWindow[float](3)
-        self.signalLongWindow = RollingWindow[float](3)
-        self.signalShortWindow = RollingWindow[float](3)
-        
+
+        pair.window = RollingWindow[QuoteBar](3)
+
+        pair.H4emaWindow = RollingWindow[float](3)
+        pair.H4atrWindow = RollingWindow[float](3)
+        pair.H4macdWindow = RollingWindow[float](3)
+        pair.H4MACDhistogramWindow = RollingWindow[float](3)
+        pair.H4MACDsignalWindow = RollingWindow[float](3)
+
+        pair.goLongWindow = RollingWindow[float](3)
+        pair.goShortWindow = RollingWindow[float](3)
+        pair.signalLongWindow = RollingWindow[float](3)
+        pair.signalShortWindow = RollingWindow[float](3)
+
+        return pair
+
     def FourHourBarHandler(self, sender, QuoteBar):
-        self.window.Add(QuoteBar)
-    
+        pair = self.pairs[QuoteBar.Symbol.Value]
+        pair.window.Add(QuoteBar)
+        self.UpdateSignals(pair)
+        self.snapshotDue = True
+
     def OnData(self, data):
 
-        # Update rolling windows
-        
-        self.H4emaWindow.Add(self.H4ema.Current.Value)      
-        self.H4atrWindow.Add(self.H4atr.Current.Value)
-        self.H4macdWindow.Add(self.H4macd.Current.Value)
-        self.H4MACDhistogramWindow.Add(self.H4macd.Histogram.Current.Value)
-        self.H4MACDsignalWindow.Add(self.H4macd.Signal.Current.Value)
-        
-        self.goLongWindow.Add(self.goLong.Current.Value)
-        self.goShortWindow.Add(self.goShort.Current.Value)
-        self.signalLongWindow.Add(self.signalLong.Current.Value)
-        self.signalShortWindow.Add(self.signalShort.Current.Value)
-        
-        # Data checks - everything ready?
-        
+        # Fast path: only stop & exit checks run hourly, for the invested pairs in this slice.
+        # Signals & entries run from FourHourBarHandler when a four hour bar completes
+
         if self.IsWarmingUp: return
-        if not (self.H4ema.IsReady and self.H4macd.IsReady and self.H4atr.IsReady) : return
-        if not (self.window.IsReady and self.H4emaWindow.IsReady and \
-        self.H4atrWindow.IsReady and self.H4macdWindow.IsReady and self.H4MACDhistogramWindow.IsReady \
-        and self.goLongWindow.IsReady and self.goShortWindow.IsReady and self.signalLongWindow.IsReady \
-        and self.signalShortWindow.IsReady and self.H4MACDsignalWindow.IsReady): return
-    
-        currBar = self.window[0]
-        pastBar = self.window[1]
-        self.barRangePct = (currBar.High - currBar.Low) / currBar.Open
-        self.barReversalLong = (currBar.High - currBar.Close) / currBar.High
-        self.barReversalShort = (currBar.Close - currBar.Low) / currBar.Low
-        
-        # Risk management variables/targets (Set at 1.5% risk on each trade) + Assoc. rolling windows
-        
-        self.LossRisk = 0.015
-        self.DownsideRisk = 1.5
-        self.UpsideRisk = 2
-        self.atrMultiplier = round(self.H4atrWindow[0] * 10000, 2)
-        
-        self.Baseline = round(currBar.Ask.Close - self.H4emaWindow[0], 5)
+
+        for symbol in data.QuoteBars.Keys:
+            pair = self.pairs.get(symbol.Value)
+            if pair is not None and self.Portfolio[symbol].Invested:
+                self.ShiftFirmStop(pair)
+                self.LetProfitsRun(pair)
+
+        # Net order actions from the bar handlers & exit checks, then one snapshot per slice once the
+        # fills are in
+
+        self.router.Flush()
+
+        if self.results is not None:
+            self.results.Bar(data)
+
+        if self.snapshotDue:
+            self.SaveSnapshot()
+
+    def UpdateSignals(self, pair):
+
+        # Update rolling windows (one value per completed four hour bar)
+
+        triggers = pair.triggers
+
+        pair.H4emaWindow.Add(triggers.emaValue)
+        pair.H4atrWindow.Add(triggers.atrValue)
+        pair.H4macdWindow.Add(triggers.macdValue)
+        pair.H4MACDhistogramWindow.Add(triggers.histogram)
+        pair.H4MACDsignalWindow.Add(triggers.signal)
+
+        pair.goLongWindow.Add(triggers.goLong)
+        pair.goShortWindow.Add(triggers.goShort)
+        pair.signalLongWindow.Add(triggers.signalLong)
+        pair.signalShortWindow.Add(triggers.signalShort)
+
+        # Data checks - everything ready?
+
+        if not triggers.IsReady : return
+        if not (pair.window.IsReady and pair.H4emaWindow.IsReady and \
+        pair.H4atrWindow.IsReady and pair.H4macdWindow.IsReady and pair.H4MACDhistogramWindow.IsReady \
+        and pair.goLongWindow.IsReady and pair.goShortWindow.IsReady and pair.signalLongWindow.IsReady \
+        and pair.signalShortWindow.IsReady and pair.H4MACDsignalWindow.IsReady): return
+
+        currBar = pair.window[0]
+        pastBar = pair.window[1]
+        pair.barRangePct = (currBar.High - currBar.Low) / currBar.Open
+        pair.barReversalLong = (currBar.High - currBar.Close) / currBar.High
+        pair.barReversalShort = (currBar.Close - currBar.Low) / currBar.Low
+
+        # Risk management targets + Assoc. rolling windows
+
+        pair.atrMultiplier = round(pair.H4atrWindow[0] * 10000, 2)
+
+        pair.Baseline = round(currBar.Ask.Close - pair.H4emaWindow[0], 5)
 
         # Setting position size (Variable based on % of a/c cash value)
-        
-        self.TradeRisk = self.Portfolio.Cash * self.LossRisk
-        
-        if self.ccypair[-3:] == 'JPY':
-            self.BuyPositionSize = math.ceil((self.TradeRisk / (self.atrMultiplier * self.DownsideRisk)) * 1000000)
+
+        pair.TradeRisk = self.Portfolio.Cash * self.LossRisk
+
+        if pair.JpyQuoted:
+            pair.BuyPositionSize = math.ceil((pair.TradeRisk / (pair.atrMultiplier * self.DownsideRisk)) * 1000000)
         else:
-            self.BuyPositionSize = math.ceil((self.TradeRisk / (self.atrMultiplier * self.DownsideRisk)) * 10000)
-        
-        self.SellPositionSize = self.BuyPositionSize * -1
-        
+            pair.BuyPositionSize = math.ceil((pair.TradeRisk / (pair.atrMultiplier * self.DownsideRisk)) * 10000)
+
+        pair.SellPositionSize = pair.BuyPositionSize * -1
+
         # GREEN LIGHT? (Ensures only one trade per MACD histogram signal)
         # Changes the GreenLight value to 'Y' each time the histogram crosses 0. When a trade is
-        # entered into, the value changes to 'N'. Trades will not be executed if the 
+        # entered into, the value changes to 'N'. Trades will not be executed if the
         # GreenLight value == 'N'.
-        
-        if self.H4MACDhistogramWindow[1] < 0 and self.H4MACDhistogramWindow[0] > 0:
-            self.GreenLight = 'Y'
-            self.HighHistThreshold = 'N'
-        if self.H4MACDhistogramWindow[1] > 0 and self.H4MACDhistogramWindow[0] < 0:
-            self.GreenLight = 'Y'
-            self.HighHistThreshold = 'N'
-        
+
+        if pair.H4MACDhistogramWindow[1] < 0 and pair.H4MACDhistogramWindow[0] > 0:
+            pair.GreenLight = 'Y'
+            pair.HighHistThreshold = 'N'
+        if pair.H4MACDhistogramWindow[1] > 0 and pair.H4MACDhistogramWindow[0] < 0:
+            pair.GreenLight = 'Y'
+            pair.HighHistThreshold = 'N'
+
+        # Catching up after a restore: GreenLight & the failsafe flags follow the replayed bars, but no
+        # orders are placed until the warm up ends
+
+        if self.IsWarmingUp:
+            if not self.Portfolio[pair.ccypair].Invested:
+                self.Failsafes(pair)
+            return
+
         ''' TRADE EXECUTION '''
 
-        if not self.Portfolio.Invested:
-            
-            # Runs through failsafe checklist
-            self.Failsafes()
+        branch = 0
 
-            XBaseline_Signal_Thresholds = {'AUDUSD': 0.0020, 'GBPJPY': 0.380, 'NZDJPY': 0.2}
+        if not self.Portfolio[pair.ccypair].Invested:
+
+            # Runs through failsafe checklist
+            self.Failsafes(pair)
 
             # With Baseline & Long
-            if self.GreenLight == 'Y' and self.goLongWindow[1] < 0 and self.goLongWindow[0] > 0 and self.Baseline > 0:
-                self.OpenLong()
+            if pair.GreenLight == 'Y' and pair.goLongWindow[1] < 0 and pair.goLongWindow[0] > 0 and pair.Baseline > 0:
+                branch = pair.EntryBranch = 1
+                self.OpenLong(pair)
 
             # With Baseline & Short
-            elif self.GreenLight == 'Y' and self.goShortWindow[1] < 0 and self.goShortWindow[0] > 0 and self.Baseline < 0:
-                self.OpenShort()
-            
+            elif pair.GreenLight == 'Y' and pair.goShortWindow[1] < 0 and pair.goShortWindow[0] > 0 and pair.Baseline < 0:
+                branch = pair.EntryBranch = 2
+                self.OpenShort(pair)
+
             # Against Baseline & Long
-            elif self.GreenLight == 'Y' and self.signalLongWindow[0] > 0 and self.goLongWindow[1] < 0 and\
-            self.goLongWindow[0] > 0 and self.Baseline < 0 and self.H4MACDsignalWindow[1] < XBaseline_Signal_Thresholds[self.ccypair] * -1:
-                self.OpenLong()
+            elif pair.GreenLight == 'Y' and pair.signalLongWindow[0] > 0 and pair.goLongWindow[1] < 0 and\
+            pair.goLongWindow[0] > 0 and pair.Baseline < 0 and pair.H4MACDsignalWindow[1] < pair.XBaselineSignalThreshold * -1:
+                branch = pair.EntryBranch = 3
+                self.OpenLong(pair)
 
             # Against Baseline & Short
-            elif self.GreenLight == 'Y' and self.signalShortWindow[0] > 0 and self.goShortWindow[1] < 0 and\
-            self.goShortWindow[0] > 0 and self.Baseline > 0 and self.H4MACDsignalWindow[1] > XBaseline_Signal_Thresholds[self.ccypair]:
-                self.OpenShort()
-            
-        self.ShiftFirmStop()
-        self.LetProfitsRun()
-        self.CancelOutstandings()
-        
+            elif pair.GreenLight == 'Y' and pair.signalShortWindow[0] > 0 and pair.goShortWindow[1] < 0 and\
+            pair.goShortWindow[0] > 0 and pair.Baseline > 0 and pair.H4MACDsignalWindow[1] > pair.XBaselineSignalThreshold:
+                branch = pair.EntryBranch = 4
+                self.OpenShort(pair)
+
+        self.CancelOutstandings(pair)
+
         ''' DEBUGGING '''
-        
-        #self.Debug("Reversal Short: {}".format(self.barReversalShort))
-        #self.Debug("Bar Low: {}, Bar Close: {}".format(self.window[0].Low, self.window[0].Close))
-        #self.Debug("Green light to trade?: {}, Adjust Stop Value: {}, High Histogram Threshold?: {}".format(self.GreenLight, self.AdjustStop, self.HighHistThreshold))
-        #self.Debug("Previous Histogram: {}, Current Histogram: {}".format(round(self.H4MACDhistogramWindow[1],5), round(self.H4MACDhistogramWindow[0],5)))
-        #self.Debug("Current ATR: {}, GoL: {} -> {}, GoS: {} -> {}"\
-        #.format(round(self.H4atrWindow[0],5), round(self.goLongWindow[1],6), round(self.goLongWindow[0],6)\
-        #, round(self.goShortWindow[1],6), round(self.goShortWindow[0],6)))
-        #self.Debug("Signal Long: {} -> {}, Signal Short: {} -> {}"\
-        #.format(round(self.signalLongWindow[1],6),round(self.signalLongWindow[0],6)\
-        #,round(self.signalShortWindow[1],6),round(self.signalShortWindow[0],6)))
-        #self.Debug("MACD Signal Line: {}, Signal Window: {}".format(self.H4macd.Signal, self.H4MACDsignalWindow[0]))
-        #self.Debug("EMA: {}, Baseline: {}".format(self.H4emaWindow[0], self.Baseline))
-        #openOrders = self.Transactions.GetOpenOrders()
-        #self.Debug("Open Tickets: {}".format(openOrders))
-        #self.Debug("Position: {}".format(self.Portfolio[self.ccypair].HoldingsValue))
+
+        # Decision inputs for this bar (branch: 1/2 with baseline long/short, 3/4 against, 0 none)
+
+        if self.trace is not None:
+            self.trace.Record(self.Time, pair, branch, self.router.Quantity(pair.ccypair), self.Portfolio.Cash)
 
         ''' STRATEGY FUNCTIONS '''
-    
-    def OpenLong(self):
-        self.XEntryPrice = self.Securities[self.ccypair].AskPrice
-        self.CloseLongPosition = self.BuyPositionSize * -1
-        self.MarketOrder(self.ccypair, self.BuyPositionSize)
-        self.InitialLongTargets()
-        self.AdjustStop = 0
-        self.GreenLight = 'N'
-        self.sl_order = self.StopMarketOrder(self.ccypair, self.SellPositionSize, self.InitialStopLong, 'SL')
 
-    def OpenShort(self):
-        self.XEntryPrice = self.Securities[self.ccypair].BidPrice
-        self.CloseShortPosition = self.SellPositionSize * -1
-        self.MarketOrder(self.ccypair, self.SellPositionSize)
-        self.InitialShortTargets()
-        self.AdjustStop = 0
-        self.GreenLight = 'N'
-        self.sl_order = self.StopMarketOrder(self.ccypair, self.BuyPositionSize, self.InitialStopShort, 'SL')
-
-    def InitialLongTargets(self):
-        self.InitialStopLong = round(self.Securities[self.ccypair].Price - (self.H4atrWindow[0] * self.DownsideRisk), self.PriceRounding) #-ATRx1.5
-        self.MidStopLong = round(self.XEntryPrice + (self.H4atrWindow[0] * 0.5), self.PriceRounding) #ATRx0.5
-        self.FirstTargetLong = round(self.XEntryPrice + (self.H4atrWindow[0] * 1.5), self.PriceRounding) #ATRx1.5
-        self.SecondTargetLong = round(self.XEntryPrice + (self.H4atrWindow[0] * self.UpsideRisk), self.PriceRounding) #ATRx2
-        self.HighStopLong = round(self.XEntryPrice + (self.H4atrWindow[0] * 2.5), self.PriceRounding) #ATRx2.5
-        self.ThirdTargetLong = round(self.XEntryPrice + (self.H4atrWindow[0] * 4), self.PriceRounding) #ATRx4
-        self.HugeMoveStopLong = round(self.XEntryPrice + (self.H4atrWindow[0] * 8), self.PriceRounding) #ATRx8
-        self.HugeMoveLong = round(self.XEntryPrice + (self.H4atrWindow[0] * 10), self.PriceRounding) #ATRx10
-        
-    def InitialShortTargets(self):
-        self.InitialStopShort = round(self.Securities[self.ccypair].Price + (self.H4atrWindow[0] * self.DownsideRisk), self.PriceRounding)
-        self.MidStopShort = round(self.XEntryPrice - (self.H4atrWindow[0] * 0.5), self.PriceRounding)
-        self.FirstTargetShort = round(self.XEntryPrice - (self.H4atrWindow[0] * 1.5), self.PriceRounding)
-        self.SecondTargetShort = round(self.XEntryPrice - (self.H4atrWindow[0] * self.UpsideRisk), self.PriceRounding)
-        self.HighStopShort = round(self.XEntryPrice - (self.H4atrWindow[0] * 2.5), self.PriceRounding)
-        self.ThirdTargetShort = round(self.XEntryPrice - (self.H4atrWindow[0] * 4), self.PriceRounding)
-        self.HugeMoveStopShort = round(self.XEntryPrice - (self.H4atrWindow[0] * 8), self.PriceRounding)
-        self.HugeMoveShort = round(self.XEntryPrice - (self.H4atrWindow[0] * 10), self.PriceRounding)
-
-    def ShiftFirmStop(self):
-        
-        self.Stop_ATR_Thresholds = {'AUDUSD': 0.0015, 'GBPJPY': 0.35, 'NZDJPY': 0.15}
-
-        # Moving stop when price reaches ATRx1.5 to breakeven
-
-        if self.Portfolio[self.ccypair].IsLong and (self.Securities[self.ccypair].Price > self.FirstTargetLong)\
-        and self.H4atrWindow[0] > self.Stop_ATR_Thresholds[self.ccypair] and self.AdjustStop == 0 :
-            updateFields = UpdateOrderFields()
-            updateFields.StopPrice = self.XEntryPrice
-            self.sl_order.Update(updateFields)
-            self.AdjustStop += 1
-        
-        if self.Portfolio[self.ccypair].IsShort and (self.Securities[self.ccypair].Price < self.FirstTargetShort)\
-        and self.H4atrWindow[0] > self.Stop_ATR_Thresholds[self.ccypair] and self.AdjustStop == 0 :
-            updateFields = UpdateOrderFields()
-            updateFields.StopPrice = self.XEntryPrice
-            self.sl_order.Update(updateFields)
-            self.AdjustStop += 1
-
-        # Moving stop again when price reaches ATRx2 to +ATRx0.5
-        
-        if self.Portfolio[self.ccypair].IsLong and (self.Securities[self.ccypair].Price > self.SecondTargetLong)\
-        and self.H4atrWindow[0] > self.Stop_ATR_Thresholds[self.ccypair] and self.AdjustStop == 1:
-            updateFields = UpdateOrderFields()
-            updateFields.StopPrice = self.MidStopLong
-            self.sl_order.Update(updateFields)
-            self.AdjustStop += 1
-
-        if self.Portfolio[self.ccypair].IsShort and (self.Securities[self.ccypair].Price < self.SecondTargetShort)\
-        and self.H4atrWindow[0] > self.Stop_ATR_Thresholds[self.ccypair] and self.AdjustStop == 1:
-            updateFields = UpdateOrderFields()
-            updateFields.StopPrice = self.MidStopShort
-            self.sl_order.Update(updateFields)
-            self.AdjustStop += 1
- 
-        # When profit hits ATRx4 readjust stop again to +ATRx2.5
-        # Stop ATR thresholds are removed as at these levels it shouldn't be a factor
-        
-        if self.Portfolio[self.ccypair].IsLong and (self.Securities[self.ccypair].Price > self.ThirdTargetLong)\
-        and self.AdjustStop == 2:
-            updateFields = UpdateOrderFields()
-            updateFields.StopPrice = self.HighStopLong
-            self.sl_order.Update(updateFields)
-            self.AdjustStop += 1
-
-        if self.Portfolio[self.ccypair].IsShort and (self.Securities[self.ccypair].Price < self.ThirdTargetShort)\
-        and self.AdjustStop == 2:
-            updateFields = UpdateOrderFields()
-            updateFields.StopPrice = self.HighStopShort
-            self.sl_order.Update(updateFields)
-            self.AdjustStop += 1
-
-        # When profit hits ATRx10 readjust stop again to +ATRx8 (caters for huge sudden moves)
-        
-        if self.Portfolio[self.ccypair].IsLong and (self.Securities[self.ccypair].Price > self.HugeMoveLong)\
-        and self.AdjustStop == 3:
-            updateFields = UpdateOrderFields()
-            updateFields.StopPrice = self.HugeMoveStopLong
-            self.sl_order.Update(updateFields)
-            self.AdjustStop += 1
-
-        if self.Portfolio[self.ccypair].IsShort and (self.Securities[self.ccypair].Price < self.HugeMoveShort)\
-        and self.AdjustStop == 3:
-            updateFields = UpdateOrderFields()
-            updateFields.StopPrice = self.HugeMoveStopShort
-            self.sl_order.Update(updateFields)
-            self.AdjustStop += 1
-
-    def LetProfitsRun(self):
-
-        self.High_Histogram_Threshold = {'AUDUSD': 0.00100, 'NZDJPY': 0.1}
-        self.Mid_Histogram_Threshold = {'AUDUSD': 0.00050, 'NZDJPY': 0.05}
-        self.Low_Histogram_Threshold = {'AUDUSD': 0.00020, 'NZDJPY': 0.02}
-
-        if self.Portfolio[self.ccypair].IsLong and self.H4MACDhistogramWindow[0] > self.High_Histogram_Threshold[self.ccypair]:
-            self.HighHistThreshold = 'Y'
-        elif self.Portfolio[self.ccypair].IsShort and self.H4MACDhistogramWindow[0] < (self.High_Histogram_Threshold[self.ccypair] * -1):
-            self.HighHistThreshold = 'Y'
+    def OpenLong(self, pair):
+        pair.XEntryPrice = self.Securities[pair.ccypair].AskPrice
+        pair.CloseLongPosition = pair.BuyPositionSize * -1
+        self.router.MarketOrder(pair.ccypair, pair.BuyPositionSize)
+        self.InitialLongTargets(pair, pair.H4atrWindow[0])
+        pair.AdjustStop = 0
+        pair.GreenLight = 'N'
+        self.router.StopMarketOrder(pair.ccypair, pair.SellPositionSize, pair.InitialStopLong, 'SL', pair.SetStopTicket)
+
+    def OpenShort(self, pair):
+        pair.XEntryPrice = self.Securities[pair.ccypair].BidPrice
+        pair.CloseShortPosition = pair.SellPositionSize * -1
+        self.router.MarketOrder(pair.ccypair, pair.SellPositionSize)
+        self.InitialShortTargets(pair, pair.H4atrWindow[0])
+        pair.AdjustStop = 0
+        pair.GreenLight = 'N'
+        self.router.StopMarketOrder(pair.ccypair, pair.BuyPositionSize, pair.InitialStopShort, 'SL', pair.SetStopTicket)
+
+    def InitialLongTargets(self, pair, atr):
+        pair.InitialStopLong = round(self.Securities[pair.ccypair].Price - (atr * self.DownsideRisk), pair.PriceRounding) #-ATRx1.5
+        pair.MidStopLong = round(pair.XEntryPrice + (atr * 0.5), pair.PriceRounding) #ATRx0.5
+        pair.FirstTargetLong = round(pair.XEntryPrice + (atr * 1.5), pair.PriceRounding) #ATRx1.5
+        pair.SecondTargetLong = round(pair.XEntryPrice + (atr * self.UpsideRisk), pair.PriceRounding) #ATRx2
+        pair.HighStopLong = round(pair.XEntryPrice + (atr * 2.5), pair.PriceRounding) #ATRx2.5
+        pair.ThirdTargetLong = round(pair.XEntryPrice + (atr * 4), pair.PriceRounding) #ATRx4
+        pair.HugeMoveStopLong = round(pair.XEntryPrice + (atr * 8), pair.PriceRounding) #ATRx8
+        pair.HugeMoveLong = round(pair.XEntryPrice + (atr * 10), pair.PriceRounding) #ATRx10
+
+        self.SetStopSchedule(pair, 1, (
+            (pair.FirstTargetLong, pair.XEntryPrice, True),
+            (pair.SecondTargetLong, pair.MidStopLong, True),
+            (pair.ThirdTargetLong, pair.HighStopLong, False),
+            (pair.HugeMoveLong, pair.HugeMoveStopLong, False)))
+
+    def InitialShortTargets(self, pair, atr):
+        pair.InitialStopShort = round(self.Securities[pair.ccypair].Price + (atr * self.DownsideRisk), pair.PriceRounding)
+        pair.MidStopShort = round(pair.XEntryPrice - (atr * 0.5), pair.PriceRounding)
+        pair.FirstTargetShort = round(pair.XEntryPrice - (atr * 1.5), pair.PriceRounding)
+        pair.SecondTargetShort = round(pair.XEntryPrice - (atr * self.UpsideRisk), pair.PriceRounding)
+        pair.HighStopShort = round(pair.XEntryPrice - (atr * 2.5), pair.PriceRounding)
+        pair.ThirdTargetShort = round(pair.XEntryPrice - (atr * 4), pair.PriceRounding)
+        pair.HugeMoveStopShort = round(pair.XEntryPrice - (atr * 8), pair.PriceRounding)
+        pair.HugeMoveShort = round(pair.XEntryPrice - (atr * 10), pair.PriceRounding)
+
+        self.SetStopSchedule(pair, -1, (
+            (pair.FirstTargetShort, pair.XEntryPrice, True),
+            (pair.SecondTargetShort, pair.MidStopShort, True),
+            (pair.ThirdTargetShort, pair.HighStopShort, False),
+            (pair.HugeMoveShort, pair.HugeMoveStopShort, False)))
+
+    def SetStopSchedule(self, pair, side, schedule):
+
+        # Each rung is (trigger price, new stop price, needs ATR above the Stop ATR threshold). Only the
+        # next trigger is kept, signed by side, so ShiftFirmStop is one comparison per price update
+
+        pair.StopSide = side
+        pair.StopSchedule = schedule
+        pair.NextStopLevel = schedule[0][0] * side
+
+    def ShiftFirmStop(self, pair):
+
+        # Moving stop when price reaches ATRx1.5 to breakeven, ATRx2 to +ATRx0.5, ATRx4 to +ATRx2.5
+        # and ATRx10 to +ATRx8 (caters for huge sudden moves). Stop ATR thresholds only gate the first
+        # two rungs as at the higher levels they shouldn't be a factor
+
+        if pair.StopSide == 0:
+            self.RebuildStopSchedule(pair)
+
+        price = self.Securities[pair.ccypair].Price * pair.StopSide
+        rung, level = pair.AdjustStop, pair.NextStopLevel
+
+        while price > level:
+            trigger, stopPrice, atrGated = pair.StopSchedule[rung]
+            if atrGated and pair.H4atrWindow[0] <= pair.StopATRThreshold:
+                break
+            if pair.sl_order is None:
+                pair.sl_order = self.FindStopTicket(pair)
+                if pair.sl_order is None: break
+            pair.StopFields.StopPrice = stopPrice
+            rung += 1
+            level = self.StopLevel(pair, rung)
+
+        # The rungs passed count once the update is sent at the end of OnData. A Close in the same pass
+        # drops it, and the trade closes on the stop it had
+
+        if rung > pair.AdjustStop:
+            self.router.UpdateStop(pair.ccypair, pair.sl_order, pair.StopFields, lambda ticket: self.StopShifted(pair, rung))
+
+    def StopShifted(self, pair, rung):
+        pair.AdjustStop = rung
+        pair.NextStopLevel = self.StopLevel(pair, rung)
+        if self.results is not None:
+            self.results.StopUpdate(pair)
+        self.snapshotDue = True
+
+    def StopLevel(self, pair, rung):
+        if rung < len(pair.StopSchedule):
+            return pair.StopSchedule[rung][0] * pair.StopSide
+        return float('inf')
+
+    def RebuildStopSchedule(self, pair):
+
+        # Restarted mid trade without a snapshot: the entry is the average holding price, the ATR the
+        # targets were set from is read back off a stop still below (above) the entry, else the latest
+        # ATR stands in, and the rungs the stop has already reached are skipped
+
+        holding = self.Portfolio[pair.ccypair]
+        side = 1 if holding.IsLong else -1
+        pair.XEntryPrice = holding.AveragePrice
+        pair.sl_order = self.FindStopTicket(pair)
+        stop = pair.sl_order.Get(OrderField.StopPrice) if pair.sl_order is not None else None
+        atr = pair.H4atrWindow[0]
+        if stop is not None and (pair.XEntryPrice - stop) * side > 0:
+            atr = abs(pair.XEntryPrice - stop) / self.DownsideRisk
+
+        if side > 0:
+            self.InitialLongTargets(pair, atr)
+            pair.InitialStopLong = stop if stop is not None else pair.InitialStopLong
+        else:
+            self.InitialShortTargets(pair, atr)
+            pair.InitialStopShort = stop if stop is not None else pair.InitialStopShort
+
+        pair.AdjustStop = 0 if stop is None else sum(rung[1] * side <= stop * side for rung in pair.StopSchedule)
+        pair.NextStopLevel = self.StopLevel(pair, pair.AdjustStop)
+        self.Debug("{} held without a snapshot, stop schedule rebuilt from entry {} and stop {}".format(
+            pair.ccypair, pair.XEntryPrice, stop))
+
+    def FindStopTicket(self, pair):
+
+        # The stop order ticket isn't in a snapshot, after a restore it is found among the open orders
+
+        for ticket in self.Transactions.GetOpenOrderTickets(pair.ccypair):
+            if ticket.OrderType == OrderType.StopMarket:
+                return ticket
+        return None
+
+    def LetProfitsRun(self, pair):
+
+        if self.Portfolio[pair.ccypair].IsLong and pair.H4MACDhistogramWindow[0] > pair.HighHistogramThreshold:
+            pair.HighHistThreshold = 'Y'
+        elif self.Portfolio[pair.ccypair].IsShort and pair.H4MACDhistogramWindow[0] < (pair.HighHistogramThreshold * -1):
+            pair.HighHistThreshold = 'Y'
 
         # Long positions that hit > atr x 2 and High Histogram theshold
-        if self.Portfolio[self.ccypair].IsLong and self.Securities[self.ccypair].BidPrice > self.SecondTargetLong:
-            if self.HighHistThreshold == 'Y' and self.H4MACDhistogramWindow[0] < self.Mid_Histogram_Threshold[self.ccypair]:
-                self.MarketOrder(self.ccypair, self.CloseLongPosition)
-                self.Liquidate(self.ccypair)
+        if self.Portfolio[pair.ccypair].IsLong and self.Securities[pair.ccypair].BidPrice > pair.SecondTargetLong:
+            if pair.HighHistThreshold == 'Y' and pair.H4MACDhistogramWindow[0] < pair.MidHistogramThreshold:
+                self.router.Close(pair.ccypair)
         # Long positions that hit > atr x 2 and do not hit the High Histogram threshold
-            if self.HighHistThreshold == 'N' and self.H4MACDhistogramWindow[0] < self.Low_Histogram_Threshold[self.ccypair]:
-                self.MarketOrder(self.ccypair, self.CloseLongPosition)
-                self.Liquidate(self.ccypair)
+            if pair.HighHistThreshold == 'N' and pair.H4MACDhistogramWindow[0] < pair.LowHistogramThreshold:
+                self.router.Close(pair.ccypair)
 
         # Short positions that hit > atr x 2 and High Histogram theshold
-        if self.Portfolio[self.ccypair].IsShort and self.Securities[self.ccypair].AskPrice < self.SecondTargetShort:
-            if self.HighHistThreshold == 'Y' and self.H4MACDhistogramWindow[0] > (self.Mid_Histogram_Threshold[self.ccypair] * -1):
-                self.MarketOrder(self.ccypair, self.CloseShortPosition)
-                self.Liquidate(self.ccypair)
+        if self.Portfolio[pair.ccypair].IsShort and self.Securities[pair.ccypair].AskPrice < pair.SecondTargetShort:
+            if pair.HighHistThreshold == 'Y' and pair.H4MACDhistogramWindow[0] > (pair.MidHistogramThreshold * -1):
+                self.router.Close(pair.ccypair)
         # Short positions that hit > atr x 2 and do not hit the High Histogram threshold
-            if self.HighHistThreshold == 'N' and self.H4MACDhistogramWindow[0] > (self.Low_Histogram_Threshold[self.ccypair] * -1):
-                self.MarketOrder(self.ccypair, self.CloseShortPosition)
-                self.Liquidate(self.ccypair)
+            if pair.HighHistThreshold == 'N' and pair.H4MACDhistogramWindow[0] > (pair.LowHistogramThreshold * -1):
+                self.router.Close(pair.ccypair)
 
-    def CancelOutstandings(self):
-        if not self.Portfolio[self.ccypair].Invested and self.GreenLight == 'N':
-            self.Liquidate(self.ccypair)
+    def CancelOutstandings(self, pair):
+        # Flat counting the orders queued this pass (entries are only sent at the end of OnData). The
+        # router sends nothing when there are no open orders to cancel
 
-    def Failsafes(self):
+        if self.router.Quantity(pair.ccypair) == 0 and pair.GreenLight == 'N':
+            self.router.Cancel(pair.ccypair)
 
-        self.BarRangeExceeded = 'N'
-        self.HighVolWarning = 'N'
+    def Failsafes(self, pair):
+
+        pair.BarRangeExceeded = 'N'
+        pair.HighVolWarning = 'N'
 
         # Will not open trades when the latest completed bar has moved > 3.5% (using highest and lowest prices)
-        if self.barRangePct > 0.0350:
-            self.GreenLight = 'N'
-            self.BarRangeExceeded = 'Y'
+        if pair.barRangePct > 0.0350:
+            pair.GreenLight = 'N'
+            pair.BarRangeExceeded = 'Y'
         else:
-            self.BarRangeExceeded = 'N'
+            pair.BarRangeExceeded = 'N'
 
         # Will not open trades when ATR levels exceed certain thresholds. Should only be triggered during
         # periods of extreme volatility
 
-        TradeOpen_ATR_Thresholds = {'AUDUSD': 0.008, 'GBPJPY': 0.9, 'NZDJPY': 0.8}
-
-        if self.H4atrWindow[0] > TradeOpen_ATR_Thresholds[self.ccypair]:
-            self.GreenLight = 'N'
-            self.HighVolWarning = 'Y'
+        if pair.H4atrWindow[0] > pair.TradeOpenATRThreshold:
+            pair.GreenLight = 'N'
+            pair.HighVolWarning = 'Y'
         else:
-            self.HighVolWarning = 'N'
+            pair.HighVolWarning = 'N'
 
         # Will take profits if the price reverses on the latest completed bar over 2%
 
-        if self.Portfolio[self.ccypair].IsLong and self.barReversalLong > 0.02:
-            self.MarketOrder(self.ccypair, self.CloseLongPosition)
-            self.Liquidate(self.ccypair)
-        elif self.Portfolio[self.ccypair].IsShort and self.barReversalShort > 0.02:
-            self.MarketOrder(self.ccypair, self.CloseShortPosition)
-            self.Liquidate(self.ccypair)
+        if self.Portfolio[pair.ccypair].IsLong and pair.barReversalLong > 0.02:
+            self.router.Close(pair.ccypair)
+        elif self.Portfolio[pair.ccypair].IsShort and pair.barReversalShort > 0.02:
+            self.router.Close(pair.ccypair)
 
     def OnOrderEvent(self, orderEvent):
         if orderEvent.Status == OrderStatus.Filled:
             self.lastOrderEvent = orderEvent
-            self.Debug("Time: {}, Order ID: {}, Order Event: {}".format(self.Time, str(self.lastOrderEvent.OrderId), orderEvent))
\ No newline at end of file
+            if self.results is not None:
+                self.results.Fill(self.pairs[orderEvent.Symbol.Value], orderEvent)
+            else:
+                self.Debug("Time: {}, Order ID: {}, Order Event: {}".format(self.Time, str(self.lastOrderEvent.OrderId), orderEvent))
+            if self.trace is not None and self.trace.dumpPrefix:
+                self.trace.Save(self, "{}-{}".format(self.trace.dumpPrefix, orderEvent.OrderId))
+            self.snapshotDue = True
+
+    def SaveSnapshot(self):
+        self.snapshotDue = False
+        if self.snapshotKey and not self.IsWarmingUp:
+            self.ObjectStore.SaveBytes(self.snapshotKey, bytearray(snapshot.Capture(self)))
+
+    def OnEndOfAlgorithm(self):
+        self.router.Flush()
+        self.Debug("Order router: {} intents, {} brokerage requests".format(self.router.intentCount, self.router.requestCount))
+        if self.trace is not None and self.trace.dumpPrefix:
+            self.trace.Save(self, "{}-final".format(self.trace.dumpPrefix))
+        if self.results is not None:
+            self.results.Close()
\ No newline at end of file
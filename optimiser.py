@@ -0,0 +1,280 @@
+'''
+Parallel parameter sweep over the per pair thresholds
+
+Grid and/or random search over the StrategyParams fields of backtest.py (XBaseline_Signal_Thresholds,
+Stop_ATR_Thresholds, High/Mid/Low_Histogram_Threshold, TradeOpen_ATR_Thresholds, DownsideRisk,
+UpsideRisk ...) for many pairs at once, spread across a process pool on all cores.
+
+The hourly indicator arrays don't depend on the swept parameters, so they are computed once per pair
+and shared with the workers through shared memory instead of being pickled to each one. Results are
+written as a table ranked within each pair.
+
+    python optimiser.py --pairs AUDUSD,NZDJPY --csv data/{pair}.csv \
+        --grid stop_atr=0.001,0.0015,0.002 --random upside_risk=1.5:3 --samples 100 --out sweep.csv
+
+--relative treats the grid/random values as multipliers of each pair's current thresholds, so one
+sweep covers pairs quoted on different scales (AUDUSD vs JPY crosses). With --results every run's
+trades are also written to a results store (results.py), as run <pair>-<parameter hash>, for
+python results.py report.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import argparse
+import csv
+import hashlib
+import itertools
+import os
+import sys
+
+import numpy as np
+
+import backtest
+import results
+
+METRICS = ('trades', 'win_rate', 'pnl', 'profit_factor', 'max_drawdown', 'avg_r', 'total_r')
+LOWER_IS_BETTER = ('max_drawdown',)
+
+
+''' SHARED MEMORY '''
+
+def share(series):
+    ''' Packs indicator_series() arrays into one shared memory block, returning (block, layout) '''
+    columns, offset = [], 0
+    for name in backtest.SERIES_COLUMNS:
+        values = np.ascontiguousarray(series[name])
+        offset = -(-offset // 8) * 8
+        columns.append((name, values.dtype.str, offset, len(values)))
+        offset += values.nbytes
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (name, dtype, start, length), view in zip(columns, _views(block, columns).values()):
+        view[:] = series[name]
+    return block, (block.name, columns)
+
+
+def attach(layout):
+    ''' Maps a shared block back to zero-copy arrays, returning (block, series) '''
+    name, columns = layout
+    block = shared_memory.SharedMemory(name=name)
+    return block, _views(block, columns)
+
+
+def _views(block, columns):
+    return dict((name, np.ndarray((length,), dtype=np.dtype(dtype), buffer=block.buf, offset=start))
+                for name, dtype, start, length in columns)
+
+
+''' SEARCH SPACE '''
+
+INTEGER_FIELDS = ('warmup',)                                            # StrategyParams fields counted in bars
+
+def grid_points(grid):
+    ''' Every combination of {field: [values]} '''
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def random_points(ranges, samples, seed=0):
+    ''' samples draws from {field: (low, high)}, uniform (integers, bounds included, for INTEGER_FIELDS) '''
+    rng = np.random.default_rng(seed)
+    draws = {}
+    for name, (low, high) in sorted(ranges.items()):
+        if name in INTEGER_FIELDS:
+            draws[name] = rng.integers(int(low), int(high) + 1, samples).tolist()
+        else:
+            draws[name] = rng.uniform(low, high, samples).tolist()
+    return [dict((name, draws[name][i]) for name in draws) for i in range(samples)]
+
+
+def candidates(grid=None, ranges=None, samples=0, seed=0):
+    ''' Grid points crossed with random draws (either may be empty) '''
+    points = grid_points(grid) if grid else [{}]
+    draws = random_points(ranges, samples, seed) if ranges and samples else [{}]
+    return [dict(point, **draw) for point in points for draw in draws]
+
+
+def resolve(ccypair, point, relative=False, fixed=None):
+    ''' StrategyParams for a pair and search point (multiplying the pair's values when relative) '''
+    base = backtest.params_for(ccypair, **(fixed or {}))
+    if relative:
+        point = dict((name, getattr(base, name) * value) for name, value in point.items())
+    return base._replace(**point)
+
+
+''' METRICS '''
+
+def summarise(trades):
+    '''
+    Sweep metrics for one run. pnl, profit_factor and max_drawdown are in USD (backtest.run converts
+    each trade's P&L), so they compare across pairs; R multiples are relative to the initial stop distance
+    '''
+    closed = trades[trades['exit_reason'] != backtest.OPEN]
+    pnl = closed['pnl']
+    risk = np.abs(closed['entry_price'] - closed['initial_stop'])
+    move = closed['side'] * (closed['exit_price'] - closed['entry_price'])
+    r = np.divide(move, risk, out=np.zeros(len(move)), where=risk > 0)
+    equity = np.cumsum(pnl)
+    gains, losses = pnl[pnl > 0].sum(), -pnl[pnl < 0].sum()
+    return {
+        'trades': len(closed),
+        'win_rate': float((pnl > 0).mean()) if len(pnl) else 0.0,
+        'pnl': float(pnl.sum()),
+        'profit_factor': float(gains / losses) if losses else (float('inf') if gains else 0.0),
+        'max_drawdown': float((np.maximum.accumulate(np.r_[0.0, equity]) - np.r_[0.0, equity]).max()),
+        'avg_r': float(r.mean()) if len(r) else 0.0,
+        'total_r': float(r.sum())}
+
+
+def score(row, rank):
+    ''' row[rank] signed so that higher is better, for ranking on any of METRICS '''
+    return -row[rank] if rank in LOWER_IS_BETTER else row[rank]
+
+
+''' WORKERS '''
+
+_shared = {}
+
+
+def _initialise(layouts):
+    for ccypair, layout in layouts.items():
+        _shared[ccypair] = attach(layout)
+
+
+def run_name(ccypair, params):
+    return '{}-{}'.format(ccypair, hashlib.sha1(repr(tuple(params)).encode()).hexdigest()[:12])
+
+
+def _evaluate(ccypair, batch, resultsRoot=None):
+    series = _shared[ccypair][1]
+    rows = []
+    for params in batch:
+        trades = backtest.run(None, ccypair, params, series=series)
+        row = summarise(trades)
+        row.update(ccypair=ccypair, **params._asdict())
+        if resultsRoot:
+            row['run'] = run_name(ccypair, params)
+            results.write_trades(resultsRoot, row['run'], trades, ccypair, params._asdict())
+        rows.append(row)
+    return rows
+
+
+def sweep(seriesByPair, points, relative=False, fixed=None, workers=None, rank='total_r', batch=16, log=None,
+          resultsRoot=None):
+    '''
+    Runs every search point for every pair on a process pool
+
+    seriesByPair maps pair -> indicator_series(). Pairs whose thresholds can't be resolved (missing
+    dictionary keys with no fixed override) are skipped. Returns rows sorted by pair then rank. With
+    resultsRoot each run's trades are stored there too (the row's run column names it).
+    '''
+    jobs = []
+    for ccypair in seriesByPair:
+        try:
+            params = [resolve(ccypair, point, relative, fixed) for point in points]
+        except KeyError:
+            if log:
+                log('Skipping {}: missing from thresholds.py (run calibrate.py or pass them with --set)'.format(ccypair))
+            continue
+        jobs += [(ccypair, params[i:i + batch]) for i in range(0, len(params), batch)]
+
+    blocks, layouts = [], {}
+    try:
+        for ccypair in set(job[0] for job in jobs):
+            block, layouts[ccypair] = share(seriesByPair[ccypair])
+            blocks.append(block)
+        rows = []
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_initialise, initargs=(layouts,)) as pool:
+            for done in pool.map(_evaluate, *zip(*jobs), [resultsRoot] * len(jobs)) if jobs else ():
+                rows += done
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    rows.sort(key=lambda row: (row['ccypair'], -score(row, rank)))
+    position = {}
+    for row in rows:
+        row['rank'] = position[row['ccypair']] = position.get(row['ccypair'], 0) + 1
+    return rows
+
+
+def write_results(rows, path):
+    fields = ['rank', 'ccypair'] + list(METRICS) + list(backtest.StrategyParams._fields)
+    if rows and 'run' in rows[0]:
+        fields.append('run')
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+''' COMMAND LINE '''
+
+def _number(text):
+    return int(text) if text.lstrip('-').isdigit() else float(text)
+
+
+def _assignments(items):
+    return dict(item.split('=', 1) for item in items or ())
+
+
+def add_search_arguments(parser):
+    ''' --grid, --random, --samples, --seed, --relative and --set, shared by the sweep and walk-forward CLIs '''
+    parser.add_argument('--grid', action='append', metavar='FIELD=V1,V2,..')
+    parser.add_argument('--random', action='append', metavar='FIELD=LOW:HIGH')
+    parser.add_argument('--samples', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--relative', action='store_true', help='values multiply each pair\'s thresholds')
+    parser.add_argument('--set', action='append', metavar='FIELD=VALUE', help='fixed overrides for every run')
+
+
+def parse_search_space(args):
+    '''
+    (grid, ranges, fixed) from the add_search_arguments() options, for candidates() and resolve()
+
+    Raises ValueError naming any field that isn't a StrategyParams field.
+    '''
+    grid = dict((name, [_number(v) for v in values.split(',')]) for name, values in _assignments(args.grid).items())
+    ranges = dict((name, tuple(_number(v) for v in bounds.split(':'))) for name, bounds in _assignments(args.random).items())
+    fixed = dict((name, _number(value)) for name, value in _assignments(args.set).items())
+    unknown = (set(grid) | set(ranges) | set(fixed)) - set(backtest.StrategyParams._fields)
+    if unknown:
+        raise ValueError('unknown parameters: {}'.format(', '.join(sorted(unknown))))
+    return grid, ranges, fixed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parallel parameter sweep for the PenskeFile strategy')
+    parser.add_argument('--pairs', default='AUDUSD', help='comma separated, e.g. AUDUSD,GBPJPY,NZDJPY')
+    parser.add_argument('--csv', help='hourly quote CSV path with {pair} placeholder')
+    parser.add_argument('--store', help='quotestore.py root to read the quotes from')
+    parser.add_argument('--synthetic', type=float, metavar='YEARS', help='use synthetic quotes instead of CSV')
+    add_search_arguments(parser)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--rank', default='total_r', choices=METRICS, help='best first; lowest first for max_drawdown')
+    parser.add_argument('--out', default='sweep_results.csv')
+    parser.add_argument('--results', metavar='ROOT', help='also store every run\'s trades in a results store')
+    args = parser.parse_args(argv)
+
+    try:
+        grid, ranges, fixed = parse_search_space(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not (args.synthetic or args.store or args.csv):
+        parser.error('one of --csv, --store or --synthetic is required')
+
+    seriesByPair = {}
+    for ccypair in args.pairs.split(','):
+        seriesByPair[ccypair] = backtest.indicator_series(backtest.load_source(args, ccypair), ccypair,
+                                                          backtest.load_conversion(args, ccypair))
+
+    points = candidates(grid, ranges, args.samples, args.seed)
+    log = lambda message: print(message, file=sys.stderr)
+    rows = sweep(seriesByPair, points, args.relative, fixed, args.workers, args.rank, log=log, resultsRoot=args.results)
+    write_results(rows, args.out)
+    log('{} runs over {} pairs written to {}'.format(len(rows), len(seriesByPair), args.out))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+'''
+Order intent router for PenskeFile style strategies
+
+Strategy code records what it wants done (enter, close, place/update a stop, cancel) instead of
+calling the brokerage straight away. Intents are kept per symbol and reduced as they arrive, and
+Flush() at the end of the OnData pass sends only the net actions:
+
+- MarketOrder(q) then Close() is one market order for the holdings, with the stop cancelled,
+  instead of a market order followed by a Liquidate
+- Close() or Cancel() drop stop updates and stop placements queued before them for that symbol
+- Cancel() with nothing open sends nothing (CancelOutstandings runs on every flat 4 hour bar)
+- Only the last stop update per ticket is sent, and none for tickets that are no longer open. Its
+  onSent(ticket) callback runs only when it is sent, so state that follows the stop isn't moved by a
+  dropped update
+- Market quantities for a symbol are netted into one order
+
+Per symbol the batch goes out as cancels, stop updates, the market order, then new stops.
+Quantity() is the holdings once the queued intents are done, for checks made before the flush.
+
+Usage from an algorithm:
+    self.router = OrderRouter(self)
+    self.router.MarketOrder(pair.ccypair, pair.BuyPositionSize)
+    self.router.StopMarketOrder(pair.ccypair, pair.SellPositionSize, stop, 'SL', onTicket)
+    self.router.UpdateStop(pair.ccypair, ticket, fields, onSent)
+    self.router.Close(pair.ccypair)
+    self.router.Flush()                                     # end of OnData
+'''
+
+from QuantConnect import *
+from QuantConnect.Orders import *
+
+class SymbolIntents(object):
+
+    # Net intents for one symbol since the last flush
+
+    __slots__ = ('quantity', 'flatten', 'cancel', 'updates', 'stops', 'tag')
+
+    def __init__(self):
+        self.quantity = 0
+        self.flatten = False
+        self.cancel = False
+        self.updates = {}
+        self.stops = []
+        self.tag = ''
+
+class OrderRouter(object):
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        self.pending = {}
+        self.intentCount = 0                                            # intents recorded
+        self.requestCount = 0                                           # brokerage calls sent
+
+    def _intents(self, symbol):
+        intents = self.pending.get(symbol)
+        if intents is None:
+            intents = self.pending[symbol] = SymbolIntents()
+        self.intentCount += 1
+        return intents
+
+    ''' INTENTS '''
+
+    def MarketOrder(self, symbol, quantity, tag=''):
+        intents = self._intents(symbol)
+        intents.quantity += quantity
+        intents.tag = tag or intents.tag
+
+    def StopMarketOrder(self, symbol, quantity, stopPrice, tag='', onTicket=None):
+        # onTicket(ticket) is called when the order is placed at the flush
+        self._intents(symbol).stops.append((quantity, stopPrice, tag, onTicket))
+
+    def UpdateStop(self, symbol, ticket, fields, onSent=None):
+        # onSent(ticket) is called when the update is sent at the flush
+        intents = self._intents(symbol)
+        if not intents.cancel:
+            intents.updates[ticket.OrderId] = (ticket, fields, onSent)
+
+    def Cancel(self, symbol):
+        ''' Cancel the symbol's open orders, and any stops queued for it '''
+        intents = self._intents(symbol)
+        intents.cancel = True
+        intents.updates.clear()
+        del intents.stops[:]
+
+    def Close(self, symbol, tag='Liquidated'):
+        ''' Liquidate: cancel the symbol's orders and flatten its holdings (earlier market intents included) '''
+        self.Cancel(symbol)
+        intents = self.pending[symbol]
+        intents.flatten = True
+        intents.quantity = 0
+        intents.tag = tag
+
+    def Quantity(self, symbol):
+        ''' Holdings once the queued intents for symbol are done '''
+        holdings = self.algorithm.Portfolio[symbol].Quantity
+        intents = self.pending.get(symbol)
+        if intents is None:
+            return holdings
+        return intents.quantity + (0 if intents.flatten else holdings)
+
+    ''' FLUSH '''
+
+    def Flush(self):
+        if not self.pending:
+            return
+        algorithm = self.algorithm
+        pending, self.pending = self.pending, {}
+
+        for symbol, intents in pending.items():
+            if intents.cancel:
+                for ticket in list(algorithm.Transactions.GetOpenOrderTickets(symbol)):
+                    ticket.Cancel()
+                    self.requestCount += 1
+
+            for ticket, fields, onSent in intents.updates.values():
+                if ticket.Status in (OrderStatus.Filled, OrderStatus.Canceled, OrderStatus.Invalid):
+                    continue
+                ticket.Update(fields)
+                self.requestCount += 1
+                if onSent is not None:
+                    onSent(ticket)
+
+            quantity = intents.quantity
+            if intents.flatten:
+                quantity -= algorithm.Portfolio[symbol].Quantity
+            if quantity:
+                algorithm.MarketOrder(symbol, quantity, False, intents.tag)
+                self.requestCount += 1
+
+            for quantity, stopPrice, tag, onTicket in intents.stops:
+                ticket = algorithm.StopMarketOrder(symbol, quantity, stopPrice, tag)
+                self.requestCount += 1
+                if onTicket is not None:
+                    onTicket(ticket)
@@ -0,0 +1,211 @@
+'''
+Memory mapped columnar store for hourly bid/ask quote bars
+
+Raw quotes (CSV in the load_quotes_csv layout, or LEAN hour quote zips) are converted once into
+fixed width little endian column files, one directory per symbol and year:
+
+    <root>/AUDUSD/2018/time.i8           int64 bar start, UTC epoch seconds
+    <root>/AUDUSD/2018/bid_open.f8 ...   float64, one file per QUOTE_COLUMNS entry
+
+A partition is written whole into a staging directory and swapped in with renames, so a reader
+never mixes columns from before and after an ingest.
+
+Reads open the columns with numpy.memmap, so every backtest process on the machine shares the
+page cache instead of holding its own copy. A date range inside one year is a zero copy view; a
+range across years is joined once. 4 hour bars are resampled on the fly from the mapped columns.
+
+    python quotestore.py ingest --root store --pair AUDUSD data/AUDUSD.csv
+    python quotestore.py ingest --root store --pair AUDUSD --lean data/forex/oanda/hour/audusd.zip
+    python quotestore.py info --root store
+'''
+
+from datetime import datetime
+import argparse
+import calendar
+import os
+import shutil
+import sys
+import zipfile
+
+import numpy as np
+
+import backtest
+
+COLUMNS = ('time',) + backtest.QUOTE_COLUMNS
+DTYPES = dict([('time', '<i8')] + [(name, '<f8') for name in backtest.QUOTE_COLUMNS])
+SUFFIX = {'<i8': '.i8', '<f8': '.f8'}
+YEAR_START = dict((year, calendar.timegm((year, 1, 1, 0, 0, 0))) for year in range(1970, 2101))
+
+
+''' INGEST '''
+
+def read_lean_zip(path):
+    '''
+    Reads a LEAN hour/daily quote zip (rows of 'YYYYMMDD HH:mm,bid OHLC,bid size,ask OHLC,ask size')
+    '''
+    with zipfile.ZipFile(path) as archive:
+        text = b''.join(archive.read(name) for name in archive.namelist()).decode()
+    rows = [line.split(',') for line in text.splitlines() if line.strip()]
+    quotes = {'time': np.array([calendar.timegm(datetime.strptime(row[0], '%Y%m%d %H:%M').timetuple())
+                                for row in rows], dtype=np.int64)}
+    values = np.array([row[1:5] + row[6:10] for row in rows], dtype=float).reshape(-1, 8)
+    for i, name in enumerate(backtest.QUOTE_COLUMNS):
+        quotes[name] = values[:, i]
+    return quotes
+
+
+def ingest(root, ccypair, quotes):
+    '''
+    Writes quotes into the store, merging with any partitions already there (new rows win on
+    duplicate times). Returns the number of rows written.
+    '''
+    t = np.asarray(quotes['time'], dtype=np.int64)
+    written = 0
+    for year in np.unique(t.astype('datetime64[s]').astype('datetime64[Y]').astype(int) + 1970).tolist():
+        inside = (t >= YEAR_START[year]) & (t < YEAR_START[year + 1])
+        merged = dict((name, np.asarray(quotes[name])[inside]) for name in COLUMNS)
+        existing = read_partition(root, ccypair, year)
+        if existing is not None:
+            merged = dict((name, np.r_[merged[name], existing[name]]) for name in COLUMNS)
+        _, keep = np.unique(merged['time'], return_index=True)          # sorted, first (new) row wins
+        write_partition(root, ccypair, year, dict((name, merged[name][keep]) for name in COLUMNS))
+        written += len(keep)
+    return written
+
+
+def write_partition(root, ccypair, year, columns):
+    '''
+    Writes every column into <pair>/.<year>.staging and swaps that directory in for the partition,
+    so readers see either the old partition or the new one whole, never a mix of their columns
+    '''
+    path, staging, old = _partition_paths(root, ccypair, year)
+    _recover(path, old)
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name in COLUMNS:
+        np.ascontiguousarray(columns[name], dtype=DTYPES[name]).tofile(os.path.join(staging, name + SUFFIX[DTYPES[name]]))
+    if os.path.isdir(path):
+        os.rename(path, old)
+    os.rename(staging, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def read_partition(root, ccypair, year):
+    ''' Memory mapped columns for one symbol/year, or None when the partition doesn't exist '''
+    path, _, old = _partition_paths(root, ccypair, year)
+    if not os.path.isdir(path):
+        path = old                                                      # mid swap, or a swap cut short
+        if not os.path.isdir(path):
+            return None
+    columns = {}
+    for name in COLUMNS:
+        target = os.path.join(path, name + SUFFIX[DTYPES[name]])
+        if os.path.getsize(target) == 0:
+            columns[name] = np.zeros(0, dtype=DTYPES[name])
+        else:
+            columns[name] = np.memmap(target, dtype=DTYPES[name], mode='r')
+    return columns
+
+
+def _partition_paths(root, ccypair, year):
+    ''' The partition directory and its staging and replaced siblings (dot names, not listed as years) '''
+    parent = os.path.join(root, ccypair)
+    return os.path.join(parent, str(year)), os.path.join(parent, '.{}.staging'.format(year)), \
+        os.path.join(parent, '.{}.old'.format(year))
+
+
+def _recover(path, old):
+    ''' Puts back the partition a write stopped between its two renames, or drops a stale old copy '''
+    if os.path.isdir(old):
+        if os.path.isdir(path):
+            shutil.rmtree(old)
+        else:
+            os.rename(old, path)
+
+
+''' READ '''
+
+class QuoteStore(object):
+
+    def __init__(self, root):
+        self.root = root
+
+    def symbols(self):
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name))) \
+            if os.path.isdir(self.root) else []
+
+    def years(self, ccypair):
+        path = os.path.join(self.root, ccypair)
+        if not os.path.isdir(path):
+            return []
+        names = os.listdir(path)
+        years = set(int(name) for name in names if name.isdigit())
+        years.update(int(name[1:-4]) for name in names if name.startswith('.') and name.endswith('.old'))
+        return sorted(years)
+
+    def quotes(self, ccypair, start=None, end=None):
+        '''
+        Hourly quotes with start <= time < end (epoch seconds or datetime, None for open ended)
+
+        Returns a dict of arrays in the load_quotes_csv layout. Within one year these are views on
+        the mapped files; across years they are joined into new arrays.
+        '''
+        start, end = _seconds(start), _seconds(end)
+        parts = []
+        for year in self.years(ccypair):
+            if (end is not None and YEAR_START[year] >= end) or (start is not None and YEAR_START[year + 1] <= start):
+                continue
+            columns = read_partition(self.root, ccypair, year)
+            t = columns['time']
+            lo = 0 if start is None else int(np.searchsorted(t, start))
+            hi = len(t) if end is None else int(np.searchsorted(t, end))
+            if hi > lo:
+                parts.append(dict((name, columns[name][lo:hi]) for name in COLUMNS))
+        if not parts:
+            raise KeyError('No quotes for {} in the requested range under {}'.format(ccypair, self.root))
+        if len(parts) == 1:
+            return parts[0]
+        return dict((name, np.concatenate([part[name] for part in parts])) for name in COLUMNS)
+
+    def h4(self, ccypair, start=None, end=None):
+        ''' 4 hour bars resampled from the stored hourly quotes, see backtest.resample_h4 '''
+        return backtest.resample_h4(self.quotes(ccypair, start, end))
+
+    __call__ = quotes
+
+
+def _seconds(value):
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    return calendar.timegm(value.timetuple())
+
+
+''' COMMAND LINE '''
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Columnar quote store for local backtests')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingestParser = commands.add_parser('ingest', help='convert raw quotes into the store')
+    ingestParser.add_argument('--root', required=True)
+    ingestParser.add_argument('--pair', required=True)
+    ingestParser.add_argument('--lean', action='store_true', help='inputs are LEAN hour quote zips')
+    ingestParser.add_argument('paths', nargs='+')
+    infoParser = commands.add_parser('info', help='list symbols, years and row counts')
+    infoParser.add_argument('--root', required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == 'ingest':
+        for path in args.paths:
+            quotes = read_lean_zip(path) if args.lean else backtest.load_quotes_csv(path)
+            rows = ingest(args.root, args.pair, quotes)
+            print('{}: {} rows into {} ({} rows in the touched years)'.format(path, len(quotes['time']), args.pair, rows))
+    else:
+        store = QuoteStore(args.root)
+        for ccypair in store.symbols():
+            counts = ['{}:{}'.format(year, len(read_partition(args.root, ccypair, year)['time'])) for year in store.years(ccypair)]
+            print(ccypair, ' '.join(counts))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
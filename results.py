@@ -0,0 +1,495 @@
+'''
+Append-only columnar results store and report for PenskeFile runs
+
+Replaces scraping the fill Debug lines. Each run is a directory of fixed width little endian column
+files, one directory per table, written a chunk at a time while the run goes on:
+
+    <root>/<run>/meta.json              pairs, parameters, committed row count of every table
+    <root>/<run>/fills/time.i8 ...      one file per column of FILL_DTYPE
+
+    fills       every fill: pair, order id, trade number, quantity, price and kind (entry, stop, close)
+    stops       stop updates sent from ShiftFirmStop: trade, rung reached and the new stop price
+    equity      portfolio value and cash after every OnData pass
+    positions   quantity, price, stop and rung of every invested pair after every OnData pass
+    trades      closed (and, at the end, still open) trades in the backtest.TRADE_DTYPE layout
+
+meta.json is replaced atomically after the columns are appended, so a reader (or a writer resuming
+the run after a warm restart) only trusts the rows it counts and a crash mid chunk loses that chunk
+only. Opening a run without resume starts it afresh, so running the same backtest or sweep again
+replaces its rows instead of adding to them. Readers memory map the columns, so reports over thousands of runs never build Python objects
+per row: report() groups trades by (run, branch) with bincount and reduces the equity curves of all
+runs in one pass.
+
+Usage from an algorithm (the results parameter is the store root, results_run the run name):
+    self.results = ResultsRecorder.FromParameter(self, root, run, parameters, resume)      # None when off
+    self.results.Fill(pair, orderEvent)                     # OnOrderEvent, filled
+    self.results.StopUpdate(pair)                           # ShiftFirmStop
+    self.results.Bar(data)                                  # end of OnData
+    self.results.Close()                                    # OnEndOfAlgorithm
+
+    python results.py report --root results [--runs 'AUDUSD-*'] [--out report.csv]
+'''
+
+from datetime import datetime
+import argparse
+import csv
+import fnmatch
+import json
+import os
+import sys
+
+import numpy as np
+
+import backtest
+
+EPOCH = datetime(1970, 1, 1)
+DAY = 86400
+TRADING_DAYS = 252
+
+# Fill kinds
+ENTRY, STOP, CLOSE = 1, 2, 3
+
+FILL_DTYPE = np.dtype([('time', '<i8'), ('pair', '<i2'), ('order', '<i4'), ('trade', '<i4'), ('quantity', '<i8'),
+                       ('price', '<f8'), ('kind', 'i1')])
+STOP_DTYPE = np.dtype([('time', '<i8'), ('pair', '<i2'), ('trade', '<i4'), ('rung', 'i1'), ('stop', '<f8')])
+EQUITY_DTYPE = np.dtype([('time', '<i8'), ('value', '<f8'), ('cash', '<f8')])
+POSITION_DTYPE = np.dtype([('time', '<i8'), ('pair', '<i2'), ('trade', '<i4'), ('quantity', '<i8'), ('price', '<f8'),
+                           ('stop', '<f8'), ('rung', 'i1')])
+TRADE_DTYPE = np.dtype([('pair', '<i2')] + [(name, backtest.TRADE_DTYPE[name].newbyteorder('<'))
+                                            for name in backtest.TRADE_DTYPE.names])
+
+TABLES = {'fills': FILL_DTYPE, 'stops': STOP_DTYPE, 'equity': EQUITY_DTYPE, 'positions': POSITION_DTYPE,
+          'trades': TRADE_DTYPE}
+
+BRANCHES = ((backtest.WITH_LONG, 'with_long'), (backtest.WITH_SHORT, 'with_short'),
+            (backtest.AGAINST_LONG, 'against_long'), (backtest.AGAINST_SHORT, 'against_short'))
+
+
+def _suffix(dtype):
+    return '.' + dtype.str[1:]
+
+
+''' WRITING '''
+
+class ResultsWriter(object):
+    '''
+    One run of the store, opened for appending
+
+    Rows are buffered per table in preallocated arrays of chunk rows and appended to the column
+    files when a buffer fills, on Flush() and on Close(). With resume an existing run goes on after
+    its committed rows (a warm restart), otherwise any rows already stored under run are dropped.
+    '''
+
+    def __init__(self, root, run, parameters=None, chunk=4096, resume=False):
+        self.path = os.path.join(root, run)
+        self.chunk = chunk
+        self.buffers = dict((table, np.zeros(chunk, dtype=dtype)) for table, dtype in TABLES.items())
+        self.pending = dict((table, 0) for table in TABLES)
+
+        meta = _read_meta(self.path) if resume else None
+        if meta is None:
+            meta = {'run': run, 'pairs': [], 'parameters': {}, 'rows': dict((table, 0) for table in TABLES)}
+        meta['parameters'].update(parameters or {})
+        self.meta = meta
+        self.pairs = dict((ccypair, index) for index, ccypair in enumerate(meta['pairs']))
+        for table, dtype in TABLES.items():
+            os.makedirs(os.path.join(self.path, table), exist_ok=True)
+            for name in dtype.names:
+                _truncate(self._column(table, name, dtype), meta['rows'][table] * dtype[name].itemsize)
+        self._commit()
+
+    def _column(self, table, name, dtype):
+        return os.path.join(self.path, table, name + _suffix(dtype[name]))
+
+    def Pair(self, ccypair):
+        index = self.pairs.get(ccypair)
+        if index is None:
+            index = self.pairs[ccypair] = len(self.meta['pairs'])
+            self.meta['pairs'].append(ccypair)
+        return index
+
+    def Append(self, table, row):
+        count = self.pending[table]
+        self.buffers[table][count] = row
+        self.pending[table] = count + 1
+        if count + 1 == self.chunk:
+            self.Flush()
+
+    def AppendMany(self, table, rows):
+        ''' Appends a structured array (or anything that converts to one) in one go '''
+        self.Flush()
+        self._write(table, np.asarray(rows, dtype=TABLES[table]))
+        self._commit()
+
+    def Flush(self):
+        written = False
+        for table, count in self.pending.items():
+            if count:
+                self._write(table, self.buffers[table][:count])
+                self.pending[table] = 0
+                written = True
+        if written:
+            self._commit()
+
+    def _write(self, table, rows):
+        dtype = TABLES[table]
+        for name in dtype.names:
+            with open(self._column(table, name, dtype), 'ab') as f:
+                f.write(np.ascontiguousarray(rows[name]).tobytes())
+        self.meta['rows'][table] += len(rows)
+
+    def _commit(self):
+        staging = os.path.join(self.path, 'meta.json.tmp')
+        with open(staging, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(staging, os.path.join(self.path, 'meta.json'))
+
+    def Retract(self, table, count):
+        ''' Drops the last count committed rows of table (provisional rows a resumed run replaces) '''
+        self.Flush()
+        dtype = TABLES[table]
+        self.meta['rows'][table] -= count
+        for name in dtype.names:
+            _truncate(self._column(table, name, dtype), self.meta['rows'][table] * dtype[name].itemsize)
+        self._commit()
+
+    def Close(self):
+        self.Flush()
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _truncate(path, size):
+    if not os.path.exists(path):
+        open(path, 'wb').close()
+    elif os.path.getsize(path) > size:
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+
+
+def write_trades(root, run, trades, ccypair, parameters=None):
+    '''
+    Stores a backtest.run() trade array as a run of its own (sweeps have no fills or equity). Its bar
+    start times become the end of the hour, the algorithm time the recorder uses
+    '''
+    writer = ResultsWriter(root, run, parameters)
+    rows = np.zeros(len(trades), dtype=TRADE_DTYPE)
+    rows['pair'] = writer.Pair(ccypair)
+    for name in backtest.TRADE_DTYPE.names:
+        rows[name] = trades[name]
+    rows['entry_time'] += backtest.HOUR
+    rows['exit_time'] = np.where(rows['exit_time'] >= 0, rows['exit_time'] + backtest.HOUR, -1)
+    writer.AppendMany('trades', rows)
+
+
+class ResultsRecorder(object):
+
+    # Algorithm side: turns order events, stop updates and OnData passes into rows. One open trade
+    # per pair, numbered from 1 in entry order. A resumed run drops the open trade rows the previous
+    # run closed with. Positions already held are picked up as open trades from the holdings and the
+    # PairState (restored, or rebuilt by ShiftFirmStop) on the first fill or OnData pass, as the
+    # brokerage holdings aren't loaded yet in Initialize. That includes a restart without a snapshot
+
+    def __init__(self, algorithm, writer):
+        from QuantConnect.Orders import OrderType
+        self.algorithm = algorithm
+        self.writer = writer
+        self.stopMarket = OrderType.StopMarket
+        fills = _committed(writer.path, 'fills', writer.meta)['trade']
+        self.trades = int(fills.max()) if len(fills) else 0                # numbering goes on when a run resumes
+        self.open = {}
+        self.resuming = True                                                # until the holdings are checked
+
+        reasons = _committed(writer.path, 'trades', writer.meta)['exit_reason']
+        closed = np.flatnonzero(reasons != backtest.OPEN)
+        provisional = len(reasons) - (int(closed[-1]) + 1 if len(closed) else 0)
+        if provisional:
+            writer.Retract('trades', provisional)
+
+    @staticmethod
+    def FromParameter(algorithm, root, run=None, parameters=None, resume=False, chunk=4096):
+        '''
+        ResultsRecorder writing run (default PenskeFile) under root, or None when recording is off.
+        resume carries on the stored run after a warm restart, otherwise it starts afresh
+        '''
+        if not root:
+            return None
+        return ResultsRecorder(algorithm, ResultsWriter(root, run or 'PenskeFile', parameters, chunk, resume))
+
+    @staticmethod
+    def _epoch(time):
+        return int((time - EPOCH).total_seconds())
+
+    def Resume(self):
+        ''' Open trades again for the pairs still held after a warm restart '''
+        self.resuming = False
+        algorithm, writer = self.algorithm, self.writer
+        fills = _committed(writer.path, 'fills', writer.meta)
+        for ccypair, pair in algorithm.pairs.items():
+            quantity = algorithm.Portfolio[ccypair].Quantity
+            index = writer.Pair(ccypair)
+            if quantity == 0 or index in self.open:
+                continue
+            side = 1 if quantity > 0 else -1
+            entries = np.flatnonzero((fills['pair'] == index) & (fills['kind'] == ENTRY))
+            if len(entries):
+                entry = entries[-1]
+                number, time, price = int(fills['trade'][entry]), int(fills['time'][entry]), float(fills['price'][entry])
+            else:
+                self.trades += 1
+                number, time, price = self.trades, self._epoch(algorithm.Time), pair.XEntryPrice
+            self.open[index] = [number, time, side, pair.EntryBranch, quantity, pair.XEntryPrice,
+                                pair.InitialStopLong if side > 0 else pair.InitialStopShort, 0, 0.0, -price * quantity]
+
+    def Fill(self, pair, orderEvent):
+        if self.resuming:
+            self.Resume()
+        algorithm, writer = self.algorithm, self.writer
+        index = writer.Pair(pair.ccypair)
+        time = self._epoch(algorithm.Time)
+        quantity, price = orderEvent.FillQuantity, orderEvent.FillPrice
+        trade = self.open.get(index)
+
+        if trade is None:
+            self.trades += 1
+            side = 1 if quantity > 0 else -1
+            trade = self.open[index] = [self.trades, time, side, pair.EntryBranch, quantity, pair.XEntryPrice,
+                                        pair.InitialStopLong if side > 0 else pair.InitialStopShort, 0, 0.0, -price * quantity]
+            writer.Append('fills', (time, index, orderEvent.OrderId, trade[0], quantity, price, ENTRY))
+            return
+
+        order = algorithm.Transactions.GetOrderById(orderEvent.OrderId)
+        stopped = order is not None and order.Type == self.stopMarket
+        writer.Append('fills', (time, index, orderEvent.OrderId, trade[0], quantity, price, STOP if stopped else CLOSE))
+        trade[7] -= quantity
+        trade[8] += price * -quantity
+        trade[9] -= price * quantity
+        if algorithm.Portfolio[pair.ccypair].Quantity == 0:
+            del self.open[index]
+            rate = algorithm.Portfolio.CashBook[pair.ccypair[3:]].ConversionRate     # quote currency P&L to USD
+            writer.Append('trades', (index, trade[1], time, trade[2], trade[3], trade[4], trade[5], trade[6],
+                                     trade[8] / trade[7], backtest.STOPPED if stopped else backtest.CLOSED,
+                                     pair.AdjustStop, trade[9] * rate))
+
+    def StopUpdate(self, pair):
+        index = self.writer.Pair(pair.ccypair)
+        trade = self.open.get(index)
+        self.writer.Append('stops', (self._epoch(self.algorithm.Time), index, trade[0] if trade else 0,
+                                     pair.AdjustStop, pair.StopFields.StopPrice))
+
+    def Bar(self, data):
+        if self.resuming:
+            self.Resume()
+        algorithm, writer = self.algorithm, self.writer
+        time = self._epoch(algorithm.Time)
+        portfolio = algorithm.Portfolio
+        writer.Append('equity', (time, portfolio.TotalPortfolioValue, portfolio.Cash))
+        for index, trade in self.open.items():
+            pair = algorithm.pairs[writer.meta['pairs'][index]]
+            stop = pair.StopSchedule[pair.AdjustStop - 1][1] if pair.AdjustStop else trade[6]
+            writer.Append('positions', (time, index, trade[0], portfolio[pair.ccypair].Quantity,
+                                        algorithm.Securities[pair.ccypair].Price, stop, pair.AdjustStop))
+
+    def Close(self):
+        ''' Records the trades still open (exit time -1, like backtest.run) and flushes '''
+        for index, trade in self.open.items():
+            self.writer.Append('trades', (index, trade[1], -1, trade[2], trade[3], trade[4], trade[5], trade[6],
+                                          np.nan, backtest.OPEN, self.algorithm.pairs[self.writer.meta['pairs'][index]].AdjustStop, 0.0))
+        self.open.clear()
+        self.writer.Close()
+
+
+''' READING '''
+
+class ResultsStore(object):
+
+    def __init__(self, root):
+        self.root = root
+
+    def runs(self, pattern='*'):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if fnmatch.fnmatch(name, pattern) and os.path.isfile(os.path.join(self.root, name, 'meta.json')))
+
+    def meta(self, run):
+        return _read_meta(os.path.join(self.root, run))
+
+    def columns(self, run, table):
+        ''' {column: memory mapped array} of the committed rows of one run's table '''
+        path = os.path.join(self.root, run)
+        return _committed(path, table, _read_meta(path))
+
+    def table(self, table, runs, names=None):
+        '''
+        Committed rows of table across runs as {column: array} plus 'run' (index into runs), and the
+        row offset of each run (len(runs) + 1 entries)
+
+        Only the names columns are read (all by default), each straight into one array, so no file
+        stays open however many runs there are.
+        '''
+        dtype = TABLES[table]
+        names = names or dtype.names
+        paths = [os.path.join(self.root, run) for run in runs]
+        counts = np.array([_read_meta(path)['rows'][table] for path in paths], dtype=np.int64)
+        offsets = np.r_[0, np.cumsum(counts)]
+        result = {}
+        for name in names:
+            column = result[name] = np.empty(offsets[-1], dtype=dtype[name])
+            for path, lo, hi in zip(paths, offsets[:-1], offsets[1:]):
+                if hi > lo:
+                    with open(os.path.join(path, table, name + _suffix(dtype[name])), 'rb') as f:
+                        f.readinto(memoryview(column[lo:hi]).cast('B'))
+        result['run'] = np.repeat(np.arange(len(runs)), counts)
+        return result, offsets
+
+
+def _committed(path, table, meta):
+    dtype = TABLES[table]
+    count = meta['rows'][table]
+    columns = {}
+    for name in dtype.names:
+        column = os.path.join(path, table, name + _suffix(dtype[name]))
+        columns[name] = np.memmap(column, dtype=dtype[name], mode='r', shape=(count,)) if count else np.zeros(0, dtype[name])
+    return columns
+
+
+''' REPORT '''
+
+METRICS = ('trades', 'win_rate', 'avg_r', 'total_r', 'pnl', 'open', 'sharpe', 'max_drawdown', 'max_drawdown_pct',
+           'final_equity')
+
+
+def report(store, runs):
+    '''
+    One row per run: trade count, win rate and R multiples overall and per entry branch from the
+    trades table, then Sharpe (daily, annualised over 252 days) and drawdown from the equity table
+    (NaN for runs without one, e.g. sweeps written by write_trades)
+
+    R is the exit move over the initial risk, side * (exit - XEntryPrice) / |XEntryPrice - InitialStop|.
+    '''
+    runCount = len(runs)
+    rows = [{'run': run} for run in runs]
+    if not runCount:
+        return rows
+
+    trades, _ = store.table('trades', runs, ('side', 'branch', 'entry_price', 'initial_stop', 'exit_price',
+                                             'exit_reason', 'pnl'))
+    closed = trades['exit_reason'] != backtest.OPEN
+    run, branch = trades['run'][closed], trades['branch'][closed].astype(np.int64)
+    entry, exit_, stop = trades['entry_price'][closed], trades['exit_price'][closed], trades['initial_stop'][closed]
+    risk = np.abs(entry - stop)
+    r = np.divide(trades['side'][closed] * (exit_ - entry), risk, out=np.zeros(len(risk)), where=risk > 0)
+    wins = (r > 0).astype(float)
+
+    def grouped(keys, size):
+        count = np.bincount(keys, minlength=size)
+        won = np.bincount(keys, wins, minlength=size)
+        total = np.bincount(keys, r, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return count, won / count, total / count, total
+
+    count, winRate, avgR, totalR = grouped(run, runCount)
+    pnl = np.bincount(run, trades['pnl'][closed], minlength=runCount)
+    still = np.bincount(trades['run'][~closed], minlength=runCount)
+    byBranch = grouped(run * 5 + branch, runCount * 5)
+
+    sharpe, drawdown, drawdownPct, final = _equity_metrics(store, runs)
+
+    for i, row in enumerate(rows):
+        row.update(trades=int(count[i]), win_rate=float(winRate[i]), avg_r=float(avgR[i]), total_r=float(totalR[i]),
+                   pnl=float(pnl[i]), open=int(still[i]), sharpe=float(sharpe[i]), max_drawdown=float(drawdown[i]),
+                   max_drawdown_pct=float(drawdownPct[i]), final_equity=float(final[i]))
+        for code, name in BRANCHES:
+            key = i * 5 + code
+            row[name + '_trades'] = int(byBranch[0][key])
+            row[name + '_win_rate'] = float(byBranch[1][key])
+            row[name + '_avg_r'] = float(byBranch[2][key])
+    return rows
+
+
+def _equity_metrics(store, runs):
+    ''' Per run (Sharpe, max drawdown, max drawdown as a fraction of the peak, final equity) '''
+    size = len(runs)
+    sharpe, drawdown, drawdownPct, final = (np.full(size, np.nan) for _ in range(4))
+    equity, offsets = store.table('equity', runs, ('time', 'value'))
+    value, run = equity['value'], equity['run']
+    if not len(value):
+        return sharpe, drawdown, drawdownPct, final
+    present = offsets[1:] > offsets[:-1]
+    last = offsets[1:][present] - 1
+    final[present] = value[last]
+
+    # Running peak per run in one accumulate: each run is lifted above every earlier one
+    lift = float(value.max() - value.min()) + 1.0
+    peak = np.maximum.accumulate(value + run * lift) - run * lift
+    loss = peak - value
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lossPct = np.where(peak > 0, loss / peak, np.nan)
+    starts = offsets[:-1][present]
+    drawdown[present] = np.maximum.reduceat(loss, starts)
+    drawdownPct[present] = np.fmax.reduceat(lossPct, starts)
+
+    # Daily closes: the last sample of every (run, day), then returns within each run
+    day = equity['time'] // DAY
+    key = run * (int(day.max()) + 1) + day
+    closes = np.r_[np.flatnonzero(np.diff(key)), len(key) - 1]
+    closeRun, closeValue = run[closes], value[closes]
+    same = closeRun[1:] == closeRun[:-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = (closeValue[1:] / closeValue[:-1] - 1.0)[same]
+        owner = closeRun[1:][same]
+        n = np.bincount(owner, minlength=size)
+        mean = np.bincount(owner, returns, minlength=size) / n
+        variance = np.bincount(owner, (returns - mean[owner]) ** 2, minlength=size) / (n - 1)
+        ratio = mean / np.sqrt(variance) * np.sqrt(TRADING_DAYS)
+    usable = n > 1
+    sharpe[usable] = ratio[usable]
+    return sharpe, drawdown, drawdownPct, final
+
+
+def write_report(rows, path):
+    fields = ['run'] + list(METRICS) + ['{}_{}'.format(name, metric) for _, name in BRANCHES
+                                        for metric in ('trades', 'win_rate', 'avg_r')]
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+''' COMMAND LINE '''
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='PenskeFile results store')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('report', help='metrics per run, printed or written as CSV')
+    command.add_argument('--root', default='results', help='results store root')
+    command.add_argument('--runs', default='*', help='run name pattern')
+    command.add_argument('--out', help='CSV path (default: print a summary)')
+    args = parser.parse_args(argv)
+
+    store = ResultsStore(args.root)
+    runs = store.runs(args.runs)
+    rows = report(store, runs)
+    if args.out:
+        write_report(rows, args.out)
+        print('{} runs written to {}'.format(len(rows), args.out), file=sys.stderr)
+        return 0
+    for row in rows:
+        print('{run}: {trades} trades, win rate {win_rate:.1%}, avg R {avg_r:.2f}, total R {total_r:.1f}, '
+              'Sharpe {sharpe:.2f}, max drawdown {max_drawdown_pct:.1%}'.format(**row))
+        for _, name in BRANCHES:
+            if row[name + '_trades']:
+                print('    {:<14} {:>4} trades, win rate {:.1%}, avg R {:.2f}'.format(
+                    name, row[name + '_trades'], row[name + '_win_rate'], row[name + '_avg_r']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1328 @@
+'''
+Local stand-in for the QuantConnect API used by main.py
+
+Runs PenskeFile (or any algorithm written against the same API surface) unmodified from local
+quote data, as a fast iteration and CI loop outside the cloud:
+
+- QCAlgorithm with AddForex, SetWarmup, Portfolio/Securities, MarketOrder, StopMarketOrder, Liquidate,
+  Transactions, SubscriptionManager.AddConsolidator, RegisterIndicator & the EMA/ATR/MACD helpers
+- QuoteBar, QuoteBarConsolidator, PythonConsolidator, RollingWindow, IndicatorExtensions, UpdateOrderFields, order events
+- ObjectStore (SaveBytes/ReadBytes) kept as files in a local storage directory, LiveMode False
+- ExponentialMovingAverage, AverageTrueRange (Wilders) & MovingAverageConvergenceDivergence as in LEAN
+- Oanda-like fills: market orders fill at the ask/bid close, stop orders trigger on the bid low/ask high
+  of later bars and fill at the worse of the stop and the close. No fees, spread only
+
+Each time slice follows the LEAN order: security prices, consolidators (update then scan), stop fills,
+then OnData (stops don't fill on warm up bars, which a restarted run has already traded). Account cash is kept per currency like the LEAN cash book, and Portfolio.Cash is its
+total in USD (conversion feeds such as USDJPY are loaded from the same data source when needed).
+
+    python simulator.py --csv data/{pair}.csv [--start 2018-01-16] [--end 2018-03-01]
+    python simulator.py --store store --start 2018-01-16 --end 2022-12-31   # see quotestore.py
+    python simulator.py --synthetic 2 --parity --pairs AUDUSD,NZDJPY       # trades vs the vectorised engine
+    python simulator.py --synthetic 2 --restart-check                      # warm restart mid position vs no restart
+'''
+
+from datetime import datetime, timedelta
+import argparse
+import importlib
+import os
+import sys
+import time as timer
+import types
+
+import numpy as np
+
+from backtest import QUOTED_IN_USD
+
+EPOCH = datetime(1970, 1, 1)
+
+
+''' ENUMS '''
+
+class Resolution(object):
+    Tick, Second, Minute, Hour, Daily = range(5)
+
+RESOLUTION_SECONDS = {Resolution.Second: 1, Resolution.Minute: 60, Resolution.Hour: 3600, Resolution.Daily: 86400}
+
+class Market(object):
+    Oanda = 'oanda'
+    FXCM = 'fxcm'
+
+class TimeZones(object):
+    Utc = 'UTC'
+
+class BrokerageName(object):
+    Default, OandaBrokerage, FxcmBrokerage = range(3)
+
+class MovingAverageType(object):
+    Simple, Exponential, Wilders = range(3)
+
+class OrderStatus(object):
+    New, Submitted, PartiallyFilled, Filled, Canceled, Invalid, CancelPending, UpdateSubmitted = range(8)
+    Names = ('New', 'Submitted', 'PartiallyFilled', 'Filled', 'Canceled', 'Invalid', 'CancelPending', 'UpdateSubmitted')
+
+class OrderDirection(object):
+    Buy, Sell, Hold = range(3)
+
+class OrderType(object):
+    Market, Limit, StopMarket = range(3)
+
+class OrderField(object):
+    LimitPrice, StopPrice = 'LimitPrice', 'StopPrice'               # OrderTicket.Get reads the Order attribute
+
+
+''' DATA TYPES '''
+
+class _Event(object):
+
+    # .NET style event: handlers attached with += and called in attach order
+
+    __slots__ = ('handlers',)
+
+    def __init__(self):
+        self.handlers = []
+
+    def __iadd__(self, handler):
+        self.handlers.append(handler)
+        return self
+
+    def __isub__(self, handler):
+        self.handlers.remove(handler)
+        return self
+
+    def Fire(self, sender, value):
+        for handler in self.handlers:
+            handler(sender, value)
+
+class Symbol(object):
+
+    __slots__ = ('Value',)
+
+    def __init__(self, ticker):
+        self.Value = ticker
+
+    def __str__(self):
+        return self.Value
+
+    __repr__ = __str__
+
+    def __eq__(self, other):
+        return str(other) == self.Value
+
+    def __hash__(self):
+        return hash(self.Value)
+
+class Bar(object):
+
+    __slots__ = ('Open', 'High', 'Low', 'Close')
+
+    def __init__(self, open_, high, low, close):
+        self.Open, self.High, self.Low, self.Close = open_, high, low, close
+
+class QuoteBar(object):
+
+    # Bid & ask bars, with Open/High/Low/Close as their mid like LEAN. epoch is Time in UTC seconds
+
+    __slots__ = ('Symbol', 'Time', 'EndTime', 'Period', 'Bid', 'Ask', 'epoch', 'seconds')
+
+    def __init__(self, *args):
+        if len(args) == 7:                                              # LEAN (time, symbol, bid, bidSize, ask, askSize, period)
+            time, symbol, bid, _, ask, _, period = args
+            args = (symbol, int((time - EPOCH).total_seconds()), int(period.total_seconds()), bid, ask)
+        symbol, epoch, seconds, bid, ask = args
+        self.Symbol = symbol
+        self.epoch, self.seconds = epoch, seconds
+        self.Time = EPOCH + timedelta(seconds=epoch)
+        self.Period = timedelta(seconds=seconds)
+        self.EndTime = self.Time + self.Period
+        self.Bid, self.Ask = bid, ask
+
+    Open = property(lambda self: (self.Bid.Open + self.Ask.Open) / 2)
+    High = property(lambda self: (self.Bid.High + self.Ask.High) / 2)
+    Low = property(lambda self: (self.Bid.Low + self.Ask.Low) / 2)
+    Close = property(lambda self: (self.Bid.Close + self.Ask.Close) / 2)
+    Value = Price = Close
+
+    def __str__(self):
+        return '{} {} O:{} H:{} L:{} C:{}'.format(self.Symbol, self.EndTime, self.Open, self.High, self.Low, self.Close)
+
+class IndicatorDataPoint(object):
+
+    __slots__ = ('Time', 'EndTime', 'Value')
+
+    def __init__(self, time, value):
+        self.Time = self.EndTime = time
+        self.Value = value
+
+    def __str__(self):
+        return str(self.Value)
+
+    def __float__(self):
+        return float(self.Value)
+
+class RollingWindow(object):
+
+    # RollingWindow[T](size): [0] is the most recent item
+
+    __slots__ = ('Size', 'items')
+
+    def __class_getitem__(cls, itemType):
+        return cls
+
+    def __init__(self, size):
+        self.Size = size
+        self.items = []
+
+    def Add(self, item):
+        self.items.insert(0, item)
+        del self.items[self.Size:]
+
+    def __getitem__(self, i):
+        if i >= len(self.items):
+            raise IndexError('Index {} is out of range for a window holding {} items'.format(i, len(self.items)))
+        return self.items[i]
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    Count = property(lambda self: len(self.items))
+    IsReady = property(lambda self: len(self.items) >= self.Size)
+
+    def Reset(self):
+        self.items = []
+
+
+''' INDICATORS '''
+
+class IndicatorBase(object):
+
+    # Takes (time, value), an IndicatorDataPoint or a bar (its Close) unless the indicator needs bars
+
+    needsBars = False
+
+    def __init__(self, name):
+        self.Name = name
+        self.Samples = 0
+        self.Current = IndicatorDataPoint(EPOCH, 0.0)
+        self.Updated = _Event()
+
+    @property
+    def IsReady(self):
+        return self.Samples >= self.WarmUpPeriod
+
+    def Update(self, time, value=None):
+        if value is None:
+            point = time
+            time, value = point.EndTime, (point if self.needsBars else point.Value)
+        self.Samples += 1
+        self.Current = IndicatorDataPoint(time, self.ComputeNextValue(time, value))
+        self.Updated.Fire(self, self.Current)
+        return self.IsReady
+
+    def Reset(self):
+        self.Samples = 0
+        self.Current = IndicatorDataPoint(EPOCH, 0.0)
+
+    def __str__(self):
+        return str(self.Current.Value)
+
+class Identity(IndicatorBase):
+
+    WarmUpPeriod = 1
+
+    def ComputeNextValue(self, time, value):
+        return value
+
+class SimpleMovingAverage(IndicatorBase):
+
+    def __init__(self, period):
+        IndicatorBase.__init__(self, 'SMA({})'.format(period))
+        self.WarmUpPeriod = period
+        self.window = RollingWindow(period)
+        self.total = 0.0
+
+    def ComputeNextValue(self, time, value):
+        if self.window.IsReady:
+            self.total -= self.window[self.window.Size - 1]
+        self.window.Add(value)
+        self.total += value
+        return self.total / len(self.window)
+
+class ExponentialMovingAverage(IndicatorBase):
+
+    # Identity on the first sample, then value * k + previous * (1 - k)
+
+    def __init__(self, period, smoothingFactor=None):
+        IndicatorBase.__init__(self, 'EMA({})'.format(period))
+        self.WarmUpPeriod = period
+        self.k = smoothingFactor if smoothingFactor is not None else 2.0 / (period + 1)
+
+    def ComputeNextValue(self, time, value):
+        if self.Samples == 1:
+            return value
+        return value * self.k + self.Current.Value * (1 - self.k)
+
+class WilderMovingAverage(IndicatorBase):
+
+    # Simple average until ready, then (previous * (n - 1) + value) / n
+
+    def __init__(self, period):
+        IndicatorBase.__init__(self, 'WWMA({})'.format(period))
+        self.WarmUpPeriod = period
+
+    def ComputeNextValue(self, time, value):
+        return self.Current.Value + (value - self.Current.Value) / min(self.Samples, self.WarmUpPeriod)
+
+def moving_average(kind, period):
+    if kind == MovingAverageType.Simple:
+        return SimpleMovingAverage(period)
+    if kind == MovingAverageType.Wilders:
+        return WilderMovingAverage(period)
+    return ExponentialMovingAverage(period)
+
+class AverageTrueRange(IndicatorBase):
+
+    needsBars = True
+
+    def __init__(self, period, movingAverageType=MovingAverageType.Wilders):
+        IndicatorBase.__init__(self, 'ATR({})'.format(period))
+        self.WarmUpPeriod = period
+        self.smoother = moving_average(movingAverageType, period)
+        self.previous = None
+
+    @property
+    def IsReady(self):
+        return self.smoother.IsReady
+
+    def ComputeNextValue(self, time, bar):
+        high, low = bar.High, bar.Low
+        if self.previous is None:
+            trueRange = high - low
+        else:
+            trueRange = max(high - low, abs(high - self.previous), abs(low - self.previous))
+        self.previous = bar.Close
+        self.smoother.Update(time, trueRange)
+        return self.smoother.Current.Value
+
+class MovingAverageConvergenceDivergence(IndicatorBase):
+
+    # Signal only takes samples once Fast & Slow are ready, Histogram once Signal is ready
+
+    def __init__(self, fastPeriod, slowPeriod, signalPeriod, movingAverageType=MovingAverageType.Exponential):
+        IndicatorBase.__init__(self, 'MACD({},{},{})'.format(fastPeriod, slowPeriod, signalPeriod))
+        self.Fast = moving_average(movingAverageType, fastPeriod)
+        self.Slow = moving_average(movingAverageType, slowPeriod)
+        self.Signal = moving_average(movingAverageType, signalPeriod)
+        self.Histogram = Identity('MACD_histogram')
+        self.WarmUpPeriod = slowPeriod + signalPeriod - 1
+
+    @property
+    def IsReady(self):
+        return self.Signal.IsReady
+
+    def ComputeNextValue(self, time, value):
+        fastReady = self.Fast.Update(time, value)
+        slowReady = self.Slow.Update(time, value)
+        macd = self.Fast.Current.Value - self.Slow.Current.Value
+        if fastReady and slowReady:
+            if self.Signal.Update(time, macd):
+                self.Histogram.Update(time, macd - self.Signal.Current.Value)
+        return macd
+
+class CompositeIndicator(IndicatorBase):
+
+    # Recomputes whenever either side updates, like IndicatorExtensions.Minus/Times in LEAN
+
+    def __init__(self, name, left, right, compose):
+        IndicatorBase.__init__(self, name)
+        self.left, self.right, self.compose = left, right, compose
+        for side in (left, right):
+            if isinstance(side, IndicatorBase):
+                side.Updated += self.OnSideUpdated
+
+    @property
+    def IsReady(self):
+        return all(side.IsReady for side in (self.left, self.right) if isinstance(side, IndicatorBase))
+
+    def value(self, side):
+        return side.Current.Value if isinstance(side, IndicatorBase) else side
+
+    def OnSideUpdated(self, sender, point):
+        self.Samples += 1
+        self.Current = IndicatorDataPoint(point.Time, self.compose(self.value(self.left), self.value(self.right)))
+        self.Updated.Fire(self, self.Current)
+
+class IndicatorExtensions(object):
+
+    @staticmethod
+    def Times(left, right):
+        return CompositeIndicator('TIMES', left, right, lambda a, b: a * b)
+
+    @staticmethod
+    def Minus(left, right):
+        return CompositeIndicator('MINUS', left, right, lambda a, b: a - b)
+
+    @staticmethod
+    def Plus(left, right):
+        return CompositeIndicator('PLUS', left, right, lambda a, b: a + b)
+
+    @staticmethod
+    def Over(left, right):
+        return CompositeIndicator('OVER', left, right, lambda a, b: a / b if b else 0.0)
+
+
+''' CONSOLIDATORS '''
+
+class QuoteBarConsolidator(object):
+
+    # Period consolidator aligned to midnight UTC. Fires when a bar from a later period arrives or
+    # when the engine scans past the working bar's end time
+
+    def __init__(self, period):
+        self.period = int(period.total_seconds())
+        self.working = None
+        self.Consolidated = None
+        self.DataConsolidated = _Event()
+
+    def Update(self, bar):
+        working = self.working
+        if working is not None and bar.epoch >= working.epoch + self.period:
+            self.Fire()
+            working = None
+        if working is None:
+            start = bar.epoch - bar.epoch % self.period
+            b, a = bar.Bid, bar.Ask
+            self.working = QuoteBar(bar.Symbol, start, self.period, Bar(b.Open, b.High, b.Low, b.Close), Bar(a.Open, a.High, a.Low, a.Close))
+        else:
+            for merged, new in ((working.Bid, bar.Bid), (working.Ask, bar.Ask)):
+                if new.High > merged.High:
+                    merged.High = new.High
+                if new.Low < merged.Low:
+                    merged.Low = new.Low
+                merged.Close = new.Close
+
+    def Scan(self, time):
+        epoch = time if isinstance(time, int) else int((time - EPOCH).total_seconds())
+        if self.working is not None and epoch >= self.working.epoch + self.period:
+            self.Fire()
+
+    def Fire(self):
+        bar, self.working = self.working, None
+        self.Consolidated = bar
+        self.DataConsolidated.Fire(self, bar)
+
+class PythonConsolidator(object):
+
+    # Base for consolidators written in Python: subclasses set InputType/OutputType, implement
+    # Update(data) & Scan(time) and fire through OnDataConsolidated. They don't call __init__ in LEAN
+
+    @property
+    def DataConsolidated(self):
+        event = self.__dict__.get('_dataConsolidated')
+        if event is None:
+            event = self.__dict__['_dataConsolidated'] = _Event()
+        return event
+
+    @DataConsolidated.setter
+    def DataConsolidated(self, event):
+        self.__dict__['_dataConsolidated'] = event
+
+    def OnDataConsolidated(self, consolidator, data):
+        self.Consolidated = data
+        self.DataConsolidated.Fire(consolidator, data)
+
+
+''' ORDERS & PORTFOLIO '''
+
+class UpdateOrderFields(object):
+
+    def __init__(self):
+        self.Quantity = None
+        self.StopPrice = None
+        self.LimitPrice = None
+        self.Tag = None
+
+class Order(object):
+
+    __slots__ = ('Id', 'Symbol', 'Quantity', 'Type', 'StopPrice', 'Status', 'Time', 'epoch', 'Tag')
+
+    def __init__(self, orderId, symbol, quantity, orderType, stopPrice, time, epoch, tag):
+        self.Id, self.Symbol, self.Quantity, self.Type = orderId, symbol, quantity, orderType
+        self.StopPrice, self.Time, self.epoch, self.Tag = stopPrice, time, epoch, tag
+        self.Status = OrderStatus.New
+
+    Direction = property(lambda self: OrderDirection.Buy if self.Quantity > 0 else OrderDirection.Sell)
+
+    def __str__(self):
+        return 'OrderId: {} {} {} {} @ {}'.format(self.Id, self.Symbol, OrderStatus.Names[self.Status], self.Quantity, self.StopPrice)
+
+    __repr__ = __str__
+
+class OrderResponse(object):
+
+    def __init__(self, orderId, error=None):
+        self.OrderId = orderId
+        self.IsSuccess = error is None
+        self.IsError = error is not None
+        self.ErrorMessage = error or ''
+
+class OrderTicket(object):
+
+    def __init__(self, transactions, order):
+        self.transactions = transactions
+        self.order = order
+
+    OrderId = property(lambda self: self.order.Id)
+    Symbol = property(lambda self: self.order.Symbol)
+    Quantity = property(lambda self: self.order.Quantity)
+    Status = property(lambda self: self.order.Status)
+    Tag = property(lambda self: self.order.Tag)
+    OrderType = property(lambda self: self.order.Type)
+
+    def Get(self, field):
+        return getattr(self.order, field)
+
+    def Update(self, fields):
+        return self.transactions.UpdateOrder(self.order, fields)
+
+    def Cancel(self, tag=None):
+        return self.transactions.CancelOrder(self.order)
+
+    def __str__(self):
+        return str(self.order)
+
+class OrderEvent(object):
+
+    __slots__ = ('OrderId', 'Symbol', 'UtcTime', 'Status', 'FillPrice', 'FillQuantity', 'Quantity', 'Message')
+
+    def __init__(self, order, time, status, fillPrice=0.0, fillQuantity=0, message=''):
+        self.OrderId, self.Symbol, self.UtcTime, self.Status = order.Id, order.Symbol, time, status
+        self.FillPrice, self.FillQuantity, self.Quantity, self.Message = fillPrice, fillQuantity, order.Quantity, message
+
+    Direction = property(lambda self: OrderDirection.Buy if self.Quantity > 0 else OrderDirection.Sell)
+
+    def __str__(self):
+        text = 'Time: {} OrderID: {} Symbol: {} Status: {} Quantity: {}'.format(
+            self.UtcTime, self.OrderId, self.Symbol, OrderStatus.Names[self.Status], self.Quantity)
+        if self.Status == OrderStatus.Filled:
+            text += ' FillQuantity: {} FillPrice: {}'.format(self.FillQuantity, self.FillPrice)
+        return text + (' Message: ' + self.Message if self.Message else '')
+
+class Security(object):
+
+    __slots__ = ('Symbol', 'BidPrice', 'AskPrice', 'Price', 'Open', 'High', 'Low', 'Close', 'HasData', 'Holdings',
+                 'BaseCurrency', 'QuoteCurrency')
+
+    def __init__(self, symbol):
+        self.Symbol = symbol
+        self.BidPrice = self.AskPrice = self.Price = self.Open = self.High = self.Low = self.Close = 0.0
+        self.HasData = False
+        self.Holdings = SecurityHolding(self)
+        self.BaseCurrency, self.QuoteCurrency = symbol.Value[:3], symbol.Value[3:]
+
+    def SetQuote(self, bar):
+        self.BidPrice, self.AskPrice = bar.Bid.Close, bar.Ask.Close
+        self.Price = self.Close = (bar.Bid.Close + bar.Ask.Close) / 2
+        self.Open, self.High, self.Low = bar.Open, bar.High, bar.Low
+        self.HasData = True
+
+class SecurityHolding(object):
+
+    __slots__ = ('security', 'Quantity', 'AveragePrice')
+
+    def __init__(self, security):
+        self.security = security
+        self.Quantity = 0
+        self.AveragePrice = 0.0
+
+    Symbol = property(lambda self: self.security.Symbol)
+    Invested = property(lambda self: self.Quantity != 0)
+    IsLong = property(lambda self: self.Quantity > 0)
+    IsShort = property(lambda self: self.Quantity < 0)
+    AbsoluteQuantity = property(lambda self: abs(self.Quantity))
+    Price = property(lambda self: self.security.Price)
+    HoldingsValue = property(lambda self: self.Quantity * self.security.Price)    # quote currency
+
+class SecurityManager(dict):
+
+    # Securities/Portfolio style lookup by ticker or Symbol
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self, str(key))
+
+    def __contains__(self, key):
+        return dict.__contains__(self, str(key))
+
+    def ContainsKey(self, key):
+        return str(key) in self
+
+class Cash(object):
+
+    # One CashBook entry: the Amount held in a currency and its ConversionRate to USD
+
+    __slots__ = ('portfolio', 'Symbol', 'Amount')
+
+    def __init__(self, portfolio, symbol, amount=0.0):
+        self.portfolio, self.Symbol, self.Amount = portfolio, symbol, amount
+
+    ConversionRate = property(lambda self: self.portfolio.ConversionRate(self.Symbol))
+    ValueInAccountCurrency = property(lambda self: self.Amount * self.ConversionRate)
+
+class CashBook(dict):
+
+    # Cash by currency symbol, entries added when a currency is first used
+
+    def __init__(self, portfolio, amounts=()):
+        dict.__init__(self)
+        self.portfolio = portfolio
+        for symbol, amount in dict(amounts).items():
+            self[symbol].Amount = amount
+
+    def __missing__(self, symbol):
+        cash = self[symbol] = Cash(self.portfolio, symbol)
+        return cash
+
+    Amounts = property(lambda self: dict((symbol, cash.Amount) for symbol, cash in self.items()))
+
+class SecurityPortfolioManager(object):
+
+    # Cash is the whole cash book in USD like LEAN, so open forex positions count through their
+    # base currency balance. conversions holds the XXXUSD/USDXXX feeds the engine adds for currencies
+    # no subscribed pair converts
+
+    def __init__(self, securities):
+        self.securities = securities
+        self.conversions = {}
+        self.CashBook = CashBook(self, {'USD': 0.0})
+
+    def __getitem__(self, key):
+        return self.securities[key].Holdings
+
+    Invested = property(lambda self: any(s.Holdings.Quantity for s in self.securities.values()))
+
+    def ConversionRate(self, currency):
+        ''' USD per unit of currency, from an XXXUSD or USDXXX feed (0 when there is none) '''
+        if currency == 'USD':
+            return 1.0
+        direct, inverse = currency + 'USD', 'USD' + currency
+        for securities in (self.securities, self.conversions):
+            if direct in securities and securities[direct].Price:
+                return securities[direct].Price
+            if inverse in securities and securities[inverse].Price:
+                return 1.0 / securities[inverse].Price
+        return 0.0
+
+    @property
+    def TotalPortfolioValue(self):
+        return sum(cash.ValueInAccountCurrency for cash in self.CashBook.values())
+
+    Cash = TotalPortfolioValue
+
+    def Fill(self, security, quantity, price):
+        holding = security.Holdings
+        total = holding.Quantity + quantity
+        if total == 0:
+            holding.AveragePrice = 0.0
+        elif holding.Quantity == 0 or (holding.Quantity > 0) != (total > 0):
+            holding.AveragePrice = price
+        elif (holding.Quantity > 0) == (quantity > 0):
+            holding.AveragePrice = (holding.AveragePrice * holding.Quantity + price * quantity) / total
+        holding.Quantity = total
+
+        self.CashBook[security.BaseCurrency].Amount += quantity
+        self.CashBook[security.QuoteCurrency].Amount -= quantity * price
+
+class SecurityTransactionManager(object):
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        self.orders = {}
+        self.openOrders = {}
+        self.nextId = 1
+
+    def GetOpenOrders(self, symbol=None):
+        return [o for o in self.openOrders.values() if symbol is None or o.Symbol == symbol]
+
+    def GetOpenOrderTickets(self, symbol=None):
+        return [OrderTicket(self, order) for order in self.GetOpenOrders(symbol)]
+
+    def GetOrderById(self, orderId):
+        return self.orders.get(orderId)
+
+    def CancelOpenOrders(self, symbol=None):
+        return [self.CancelOrder(order) for order in self.GetOpenOrders(symbol)]
+
+    def Submit(self, symbol, quantity, orderType, stopPrice, tag):
+        algorithm = self.algorithm
+        order = Order(self.nextId, algorithm.Securities[symbol].Symbol, quantity, orderType, stopPrice,
+                      algorithm.Time, algorithm.epoch, tag)
+        self.nextId += 1
+        self.orders[order.Id] = order
+        ticket = OrderTicket(self, order)
+
+        if algorithm.IsWarmingUp or quantity == 0:
+            order.Status = OrderStatus.Invalid
+            message = 'Orders are not allowed during warm up' if algorithm.IsWarmingUp else 'Zero quantity'
+            algorithm.Emit(OrderEvent(order, algorithm.UtcTime, OrderStatus.Invalid, message=message))
+            return ticket
+
+        order.Status = OrderStatus.Submitted
+        algorithm.Emit(OrderEvent(order, algorithm.UtcTime, OrderStatus.Submitted))
+        if orderType == OrderType.Market:
+            security = algorithm.Securities[symbol]
+            self.Fill(order, security.AskPrice if quantity > 0 else security.BidPrice)
+        else:
+            self.openOrders[order.Id] = order
+        return ticket
+
+    def Fill(self, order, price):
+        algorithm = self.algorithm
+        self.openOrders.pop(order.Id, None)
+        order.Status = OrderStatus.Filled
+        algorithm.Portfolio.Fill(algorithm.Securities[order.Symbol], order.Quantity, price)
+        algorithm.Emit(OrderEvent(order, algorithm.UtcTime, OrderStatus.Filled, price, order.Quantity))
+
+    def UpdateOrder(self, order, fields):
+        if order.Id not in self.openOrders:
+            return OrderResponse(order.Id, 'Order {} is not open ({})'.format(order.Id, OrderStatus.Names[order.Status]))
+        if fields.StopPrice is not None:
+            order.StopPrice = fields.StopPrice
+        if fields.Quantity is not None:
+            order.Quantity = fields.Quantity
+        if fields.Tag is not None:
+            order.Tag = fields.Tag
+        self.algorithm.Emit(OrderEvent(order, self.algorithm.UtcTime, OrderStatus.UpdateSubmitted))
+        return OrderResponse(order.Id)
+
+    def CancelOrder(self, order):
+        if self.openOrders.pop(order.Id, None) is None:
+            return OrderResponse(order.Id, 'Order {} is not open'.format(order.Id))
+        order.Status = OrderStatus.Canceled
+        self.algorithm.Emit(OrderEvent(order, self.algorithm.UtcTime, OrderStatus.Canceled))
+        return OrderResponse(order.Id)
+
+    def ProcessStops(self, security, bar):
+        # Stop market orders fill on data newer than the order, at the worse of stop and close
+        for order in [o for o in self.openOrders.values() if o.Symbol == security.Symbol]:
+            if order.Type != OrderType.StopMarket or order.epoch >= bar.epoch + bar.seconds:
+                continue
+            if order.Quantity < 0 and bar.Bid.Low < order.StopPrice:
+                self.Fill(order, min(order.StopPrice, bar.Bid.Close))
+            elif order.Quantity > 0 and bar.Ask.High > order.StopPrice:
+                self.Fill(order, max(order.StopPrice, bar.Ask.Close))
+
+class ObjectStore(object):
+
+    # Keys are file names under root, like the project ObjectStore in the cloud
+
+    def __init__(self, root='storage'):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def ContainsKey(self, key):
+        return os.path.isfile(self.path(key))
+
+    def SaveBytes(self, key, data):
+        os.makedirs(os.path.dirname(self.path(key)) or '.', exist_ok=True)
+        staging = self.path(key) + '.tmp'
+        with open(staging, 'wb') as f:
+            f.write(bytes(data))
+        os.replace(staging, self.path(key))
+        return True
+
+    def ReadBytes(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def Delete(self, key):
+        if not self.ContainsKey(key):
+            return False
+        os.remove(self.path(key))
+        return True
+
+class SubscriptionManager(object):
+
+    def __init__(self):
+        self.consolidators = {}
+
+    def AddConsolidator(self, symbol, consolidator):
+        consolidators = self.consolidators.setdefault(str(symbol), [])
+        if consolidator not in consolidators:
+            consolidators.append(consolidator)
+
+    def RemoveConsolidator(self, symbol, consolidator):
+        self.consolidators.get(str(symbol), []).remove(consolidator)
+
+class Slice(object):
+
+    def __init__(self, time, quoteBars):
+        self.Time = time
+        self.QuoteBars = QuoteBarDictionary(quoteBars)
+
+    def ContainsKey(self, symbol):
+        return self.QuoteBars.ContainsKey(symbol)
+
+    def __getitem__(self, symbol):
+        return self.QuoteBars[symbol]
+
+class QuoteBarDictionary(dict):
+
+    Keys = property(lambda self: [bar.Symbol for bar in self.values()])
+    Values = property(lambda self: list(self.values()))
+    Count = property(lambda self: len(self))
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self, str(key))
+
+    def ContainsKey(self, key):
+        return dict.__contains__(self, str(key))
+
+
+''' ALGORITHM '''
+
+class QCAlgorithm(object):
+
+    def __init__(self):
+        self.Securities = SecurityManager()
+        self.Portfolio = SecurityPortfolioManager(self.Securities)
+        self.Transactions = SecurityTransactionManager(self)
+        self.SubscriptionManager = SubscriptionManager()
+        self.StartDate, self.EndDate = datetime(1998, 1, 1), datetime.utcnow()
+        self.dateOverrides = {}
+        self.ObjectStore = ObjectStore()
+        self.LiveMode = False
+        self.warmup = None
+        self.resolutions = {}
+        self.rawHandlers = {}
+        self.Benchmark = None
+        self.BrokerageModel = BrokerageName.Default
+        self.IsWarmingUp = False
+        self.Time = self.UtcTime = EPOCH
+        self.epoch = 0
+        self.debugMessages = []
+        self.parameters = {}
+        self.log = None
+
+    # Setup
+
+    def Initialize(self):
+        pass
+
+    def SetTimeZone(self, timeZone):
+        if timeZone != TimeZones.Utc:
+            raise NotImplementedError('Only UTC is supported locally')
+
+    def SetStartDate(self, year, month=None, day=None):
+        self.StartDate = self.dateOverrides.get('start') or (year if month is None else datetime(year, month, day))
+
+    def SetEndDate(self, year, month=None, day=None):
+        self.EndDate = self.dateOverrides.get('end') or (year if month is None else datetime(year, month, day))
+
+    def SetCash(self, cash):
+        self.Portfolio.CashBook['USD'].Amount = float(cash)
+
+    def SetBrokerageModel(self, brokerage, accountType=None):
+        self.BrokerageModel = brokerage
+
+    def SetBenchmark(self, symbol):
+        self.Benchmark = str(symbol)
+
+    def GetParameter(self, name):
+        return self.parameters.get(name)
+
+    def SetWarmup(self, period, resolution=None):
+        self.warmup = period
+
+    SetWarmUp = SetWarmup
+
+    def AddForex(self, ticker, resolution=Resolution.Minute, market=Market.Oanda):
+        security = Security(Symbol(ticker))
+        self.Securities[ticker] = security
+        self.resolutions[ticker] = resolution
+        return security
+
+    def RegisterIndicator(self, symbol, indicator, period=None, selector=None):
+        if period is None or isinstance(period, timedelta):
+            consolidator = QuoteBarConsolidator(period or timedelta(seconds=RESOLUTION_SECONDS[self.resolutions[str(symbol)]]))
+        else:
+            consolidator = period
+        self.SubscriptionManager.AddConsolidator(symbol, consolidator)
+
+        def update(sender, bar):
+            if selector is not None:
+                indicator.Update(bar.EndTime, selector(bar))
+            else:
+                indicator.Update(bar)
+        consolidator.DataConsolidated += update
+
+    def Indicator(self, symbol, indicator, resolution=None, selector=None):
+        # Helper indicators on the raw subscription bars
+        def update(bar):
+            indicator.Update(bar if selector is None else IndicatorDataPoint(bar.EndTime, selector(bar)))
+        self.rawHandlers.setdefault(str(symbol), []).append(update)
+        return indicator
+
+    def EMA(self, symbol, period, resolution=None, selector=None):
+        return self.Indicator(symbol, ExponentialMovingAverage(period), resolution, selector)
+
+    def ATR(self, symbol, period, movingAverageType=MovingAverageType.Wilders, resolution=None, selector=None):
+        return self.Indicator(symbol, AverageTrueRange(period, movingAverageType), resolution, selector)
+
+    def MACD(self, symbol, fast, slow, signal, movingAverageType=MovingAverageType.Exponential, resolution=None, selector=None):
+        return self.Indicator(symbol, MovingAverageConvergenceDivergence(fast, slow, signal, movingAverageType), resolution, selector)
+
+    # Trading
+
+    def MarketOrder(self, symbol, quantity, asynchronous=False, tag=''):
+        return self.Transactions.Submit(symbol, int(quantity), OrderType.Market, None, tag)
+
+    def StopMarketOrder(self, symbol, quantity, stopPrice, tag=''):
+        return self.Transactions.Submit(symbol, int(quantity), OrderType.StopMarket, stopPrice, tag)
+
+    def Liquidate(self, symbol=None, tag='Liquidated'):
+        orderIds = [r.OrderId for r in self.Transactions.CancelOpenOrders(symbol)]
+        for security in (self.Securities.values() if symbol is None else [self.Securities[symbol]]):
+            if security.Holdings.Quantity:
+                orderIds.append(self.MarketOrder(security.Symbol, -security.Holdings.Quantity, tag=tag).OrderId)
+        return orderIds
+
+    # Events & logging
+
+    def OnData(self, data):
+        pass
+
+    def OnOrderEvent(self, orderEvent):
+        pass
+
+    def OnEndOfAlgorithm(self):
+        pass
+
+    def Emit(self, orderEvent):
+        self.OnOrderEvent(orderEvent)
+
+    def Debug(self, message):
+        self.debugMessages.append(str(message))
+        if self.log:
+            self.log(message)
+
+    Log = Error = Debug
+
+
+''' ENGINE '''
+
+class Simulator(object):
+    '''
+    Replays local hourly quotes through a QCAlgorithm subclass
+
+    data maps ticker -> quotes (time + bid/ask OHLC arrays, see backtest.QUOTE_COLUMNS) or is a
+    callable returning them. start/end override the algorithm's SetStartDate/SetEndDate (already in
+    Initialize), parameters are returned by GetParameter, like the cloud project parameters, and
+    storage is the ObjectStore directory. account (from Account() at the end of an earlier run) is
+    loaded after Initialize like a live brokerage's cash, holdings and open orders on a restart.
+    '''
+
+    def __init__(self, data, start=None, end=None, log=None, parameters=None, storage='storage', account=None):
+        self.data = data
+        self.start, self.end = start, end
+        self.log = log
+        self.parameters = dict(parameters or {})
+        self.storage = storage
+        self.account = account
+
+    def quotes(self, ticker):
+        return self.data(ticker) if callable(self.data) else self.data[ticker]
+
+    def conversions(self, algorithm):
+        ''' Hidden XXXUSD/USDXXX feeds for currencies none of the algorithm's pairs convert to USD '''
+        portfolio, added = algorithm.Portfolio, []
+        currencies = set(c for s in algorithm.Securities.values() for c in (s.BaseCurrency, s.QuoteCurrency))
+        for currency in sorted(currencies - {'USD'}):
+            tickers = (currency + 'USD', 'USD' + currency)[::1 if currency in QUOTED_IN_USD else -1]
+            if any(ticker in algorithm.Securities for ticker in tickers):
+                continue
+            for ticker in tickers:
+                try:
+                    self.quotes(ticker)
+                except (KeyError, OSError):
+                    continue
+                portfolio.conversions[ticker] = Security(Symbol(ticker))
+                algorithm.resolutions.setdefault(ticker, Resolution.Hour)
+                added.append((ticker, portfolio.conversions[ticker]))
+                break
+            else:
+                algorithm.Debug('No USD conversion for {}, its balance is left out of Portfolio.Cash'.format(currency))
+        return added
+
+    @staticmethod
+    def Account(algorithm):
+        ''' Brokerage side state at the end of a run: cash book, holdings and open orders '''
+        return {'cash': algorithm.Portfolio.CashBook.Amounts,
+                'holdings': dict((ticker, (s.Holdings.Quantity, s.Holdings.AveragePrice))
+                                 for ticker, s in algorithm.Securities.items() if s.Holdings.Quantity),
+                'orders': [(o.Id, o.Symbol.Value, o.Quantity, o.Type, o.StopPrice, o.epoch, o.Tag)
+                           for o in algorithm.Transactions.openOrders.values()],
+                'nextId': algorithm.Transactions.nextId}
+
+    def load_account(self, algorithm):
+        account, transactions = self.account, algorithm.Transactions
+        algorithm.Portfolio.CashBook = CashBook(algorithm.Portfolio, account['cash'])
+        for ticker, (quantity, averagePrice) in account['holdings'].items():
+            holding = algorithm.Securities[ticker].Holdings
+            holding.Quantity, holding.AveragePrice = quantity, averagePrice
+        for orderId, ticker, quantity, orderType, stopPrice, epoch, tag in account['orders']:
+            order = Order(orderId, algorithm.Securities[ticker].Symbol, quantity, orderType, stopPrice,
+                          EPOCH + timedelta(seconds=epoch), epoch, tag)
+            order.Status = OrderStatus.Submitted
+            transactions.orders[orderId] = transactions.openOrders[orderId] = order
+        transactions.nextId = max(transactions.nextId, account['nextId'])
+
+    def run(self, algorithmType):
+        return self.run_variants(algorithmType, [{}])[0]
+
+    def run_variants(self, algorithmType, variants):
+        '''
+        Runs one algorithm instance per variant (parameters merged over self.parameters) side by side
+        on the same feeds, and returns the instances in variants order
+
+        Every instance gets its own account, orders and ObjectStore key space. Each slice is set on
+        all of them, then their consolidators run, then each instance's stops and OnData, so
+        consolidators they share (IndicatorGraph.Attach while sharing, registered on the first
+        instance only) see every bar once.
+        '''
+        algorithms = []
+        for variant in variants:
+            algorithm = algorithmType()
+            algorithm.log = self.log
+            algorithm.parameters = dict(self.parameters, **variant)
+            algorithm.ObjectStore = ObjectStore(self.storage)
+            if self.start:
+                algorithm.StartDate = algorithm.dateOverrides['start'] = self.start
+            if self.end:
+                algorithm.EndDate = algorithm.dateOverrides['end'] = self.end
+            algorithm.Initialize()
+            if self.account:
+                self.load_account(algorithm)
+            algorithms.append(algorithm)
+        lead = algorithms[0]
+        start = self.start or lead.StartDate
+        end = self.end or lead.EndDate + timedelta(days=1)
+        startEpoch, endEpoch = [int((d - EPOCH).total_seconds()) for d in (start, end)]
+
+        # Per ticker bars from the earliest warm up start (bar count or time span before start) to
+        # the end, and each instance's Security for it
+        tickers = {}
+        for index, algorithm in enumerate(algorithms):
+            for ticker, security in list(algorithm.Securities.items()) + self.conversions(algorithm):
+                tickers.setdefault(ticker, []).append((index, security))
+        feeds = []
+        for ticker, owners in tickers.items():
+            quotes = self.quotes(ticker)
+            t = np.asarray(quotes['time'], dtype=np.int64)
+            first, last = np.searchsorted(t, startEpoch), np.searchsorted(t, endEpoch)
+            for algorithm in (algorithms[index] for index, _ in owners):
+                if isinstance(algorithm.warmup, timedelta):
+                    first = min(first, np.searchsorted(t, startEpoch - int(algorithm.warmup.total_seconds())))
+                elif algorithm.warmup:
+                    first = min(first, max(0, np.searchsorted(t, startEpoch) - algorithm.warmup))
+            columns = [np.asarray(quotes[name], dtype=float)[first:last].tolist() for name in
+                       ('bid_open', 'bid_high', 'bid_low', 'bid_close', 'ask_open', 'ask_high', 'ask_low', 'ask_close')]
+            seconds = RESOLUTION_SECONDS[algorithms[owners[0][0]].resolutions[ticker]]
+            visible = [(index, security) for index, security in owners if ticker in algorithms[index].Securities]
+            hidden = [security for index, security in owners if ticker not in algorithms[index].Securities]
+            feeds.append((ticker, owners[0][1].Symbol, t[first:last], list(zip(*columns)), seconds, visible, hidden))
+
+        # Time slices across all tickers, keyed by bar end time
+        ends = np.concatenate([feed[2] + feed[4] for feed in feeds]) if feeds else np.zeros(0, dtype=np.int64)
+        owners = np.concatenate([np.full(len(feed[2]), i) for i, feed in enumerate(feeds)]) if feeds else ends
+        rows = np.concatenate([np.arange(len(feed[2])) for feed in feeds]) if feeds else ends
+        order = np.argsort(ends, kind='stable')
+        ends, owners, rows = ends[order].tolist(), owners[order].tolist(), rows[order].tolist()
+
+        i, n = 0, len(ends)
+        while i < n:
+            endEpoch = ends[i]
+            time = EPOCH + timedelta(seconds=endEpoch)
+            slices = [{} for _ in algorithms]
+            first = None
+            while i < n and ends[i] == endEpoch:
+                ticker, symbol, t, values, seconds, visible, hidden = feeds[owners[i]]
+                bo, bh, bl, bc, ao, ah, al, ac = values[rows[i]]
+                bar = QuoteBar(symbol, int(t[rows[i]]), seconds, Bar(bo, bh, bl, bc), Bar(ao, ah, al, ac))
+                for security in hidden:
+                    security.SetQuote(bar)
+                for index, security in visible:
+                    security.SetQuote(bar)
+                    slices[index][ticker] = bar
+                if visible and (first is None or bar.epoch < first):
+                    first = bar.epoch
+                i += 1
+            if first is None:
+                continue
+
+            for algorithm in algorithms:
+                algorithm.epoch = endEpoch
+                algorithm.Time = algorithm.UtcTime = time
+                algorithm.IsWarmingUp = first < startEpoch
+            # Consolidators see every bar of the slice, not just their instance's: a shared
+            # IndicatorGraph registers its resamplers on the first instance only
+            merged = {}
+            for algorithm, bars in zip(algorithms, slices):
+                merged.update(bars)
+                for ticker, bar in bars.items():
+                    for handler in algorithm.rawHandlers.get(ticker, ()):
+                        handler(bar)
+            for algorithm in algorithms:
+                consolidators = algorithm.SubscriptionManager.consolidators
+                for ticker, bar in merged.items():
+                    for consolidator in consolidators.get(ticker, ()):
+                        consolidator.Update(bar)
+            for algorithm in algorithms:
+                for tickerConsolidators in algorithm.SubscriptionManager.consolidators.values():
+                    for consolidator in tickerConsolidators:
+                        consolidator.Scan(endEpoch)
+            for algorithm, bars in zip(algorithms, slices):
+                if not bars:
+                    continue
+                transactions = algorithm.Transactions
+                if transactions.openOrders and not algorithm.IsWarmingUp:
+                    for ticker, bar in bars.items():
+                        transactions.ProcessStops(algorithm.Securities[ticker], bar)
+                algorithm.OnData(Slice(time, bars))
+
+        for algorithm in algorithms:
+            algorithm.IsWarmingUp = False
+            algorithm.OnEndOfAlgorithm()
+        return algorithms
+
+
+''' QUANTCONNECT MODULES '''
+
+API = ('QCAlgorithm', 'Resolution', 'Market', 'TimeZones', 'BrokerageName', 'MovingAverageType', 'OrderStatus',
+       'OrderDirection', 'OrderType', 'OrderField', 'Symbol', 'Bar', 'QuoteBar', 'IndicatorDataPoint', 'RollingWindow',
+       'IndicatorBase', 'Identity', 'SimpleMovingAverage', 'ExponentialMovingAverage', 'WilderMovingAverage',
+       'AverageTrueRange', 'MovingAverageConvergenceDivergence', 'CompositeIndicator', 'IndicatorExtensions',
+       'QuoteBarConsolidator', 'PythonConsolidator', 'UpdateOrderFields', 'OrderTicket', 'OrderEvent', 'Slice')
+
+MODULES = ('QuantConnect', 'QuantConnect.Algorithm', 'QuantConnect.Indicators', 'QuantConnect.Data',
+           'QuantConnect.Data.Consolidators', 'QuantConnect.Data.Market', 'QuantConnect.Orders',
+           'QuantConnect.Brokerages')
+
+
+def install():
+    ''' Registers the QuantConnect.* modules so algorithms can be imported unmodified '''
+    if 'QuantConnect' in sys.modules:
+        return
+    namespace = dict((name, globals()[name]) for name in API)
+    for name in MODULES:
+        module = types.ModuleType(name)
+        module.__dict__.update(namespace)
+        module.__all__ = list(API)
+        module.__path__ = []
+        sys.modules[name] = module
+
+
+def load_algorithm(path):
+    ''' Imports 'module.Class' after installing the QuantConnect modules '''
+    install()
+    moduleName, className = path.rsplit('.', 1)
+    return getattr(importlib.import_module(moduleName), className)
+
+
+''' PARITY '''
+
+def parity(source, ccypair='AUDUSD', algorithmPath='main.PenskeFile', warmup=100):
+    '''
+    Runs the algorithm locally on ccypair and compares its fills with backtest.run over the same bars
+
+    source is the Simulator data (ticker -> quotes callable or dict), so the local run loads its
+    conversion feeds like any other run and backtest.run gets the same conversion_pair() quotes. The
+    local run starts after warmup bars so both engines see the same warm up. Fills (time, quantity,
+    price) are keyed by the start of the hourly bar they happened on. Returns (matches, local fills,
+    vectorised fills).
+    '''
+    import backtest
+
+    quotes, conversion = _pair_quotes(source, ccypair)
+
+    algorithmType = load_algorithm(algorithmPath)
+
+    class Recorded(algorithmType):
+        def Initialize(self):
+            self.recorded = []
+            algorithmType.Initialize(self)
+
+        def OnOrderEvent(self, orderEvent):
+            if orderEvent.Status == OrderStatus.Filled:
+                self.recorded.append((int((orderEvent.UtcTime - EPOCH).total_seconds()) - 3600,
+                                      orderEvent.FillQuantity, orderEvent.FillPrice))
+            algorithmType.OnOrderEvent(self, orderEvent)
+
+    t = np.asarray(quotes['time'], dtype=np.int64)
+    start = EPOCH + timedelta(seconds=int(t[warmup]))
+    end = EPOCH + timedelta(seconds=int(t[-1]) + 3600)
+    algorithm = Simulator(source, start, end, parameters={'ccypairs': ccypair}).run(Recorded)
+
+    trades = backtest.run(quotes, ccypair, conversion=conversion)
+    expected = []
+    for trade in trades:
+        expected.append((int(trade['entry_time']), int(trade['quantity']), float(trade['entry_price'])))
+        if trade['exit_reason'] != backtest.OPEN:
+            expected.append((int(trade['exit_time']), -int(trade['quantity']), float(trade['exit_price'])))
+
+    local = algorithm.recorded
+    same = len(local) == len(expected) and all(
+        a[0] == b[0] and a[1] == b[1] and abs(a[2] - b[2]) < 1e-9 for a, b in zip(local, expected))
+    return same, local, expected
+
+
+def _pair_quotes(source, ccypair):
+    ''' ccypair's quotes from source, and its backtest.conversion_pair() quotes or None '''
+    import backtest
+
+    load = source if callable(source) else source.__getitem__
+    conversion = backtest.conversion_pair(ccypair)
+    if conversion is not None:
+        try:
+            conversion = load(conversion)
+        except (KeyError, OSError):
+            conversion = None
+    return load(ccypair), conversion
+
+
+''' RESTART '''
+
+def restart_check(source, ccypair='AUDUSD', algorithmPath='main.PenskeFile', warmup=100, storage=None):
+    '''
+    Stops the algorithm mid position and restarts it from its snapshot and the account it left, then
+    compares the fills and stop updates after the restart with an uninterrupted run
+
+    The restart falls on the hour after the first stop update of the first trade that has another
+    stop update or an exit after it, so the restored run has to keep managing that stop. Returns
+    (matches, restart epoch, events after it uninterrupted, events after it restarted), events being
+    (epoch, 'fill', order id, quantity, price) and (epoch, 'update', order id, stop price). source is
+    the Simulator data, as for parity().
+    '''
+    import shutil
+    import tempfile
+
+    algorithmType = load_algorithm(algorithmPath)
+
+    class Recorded(algorithmType):
+        def Initialize(self):
+            self.recorded = []
+            algorithmType.Initialize(self)
+
+        def OnOrderEvent(self, orderEvent):
+            epoch = int((orderEvent.UtcTime - EPOCH).total_seconds())
+            if orderEvent.Status == OrderStatus.Filled:
+                self.recorded.append((epoch, 'fill', orderEvent.OrderId, orderEvent.FillQuantity, orderEvent.FillPrice))
+            elif orderEvent.Status == OrderStatus.UpdateSubmitted:
+                order = self.Transactions.GetOrderById(orderEvent.OrderId)
+                self.recorded.append((epoch, 'update', orderEvent.OrderId, order.StopPrice))
+            algorithmType.OnOrderEvent(self, orderEvent)
+
+    quotes, _ = _pair_quotes(source, ccypair)
+    t = np.asarray(quotes['time'], dtype=np.int64)
+    start = EPOCH + timedelta(seconds=int(t[warmup]))
+    end = EPOCH + timedelta(seconds=int(t[-1]) + 3600)
+    root = storage or tempfile.mkdtemp(prefix='restart-')
+    parameters = {'ccypairs': ccypair, 'snapshot': 'restart-check'}
+    try:
+        whole = Simulator(source, start, end, parameters={'ccypairs': ccypair}).run(Recorded).recorded
+
+        restart = None
+        for i, event in enumerate(whole):
+            if event[1] == 'update' and any(later[2] == event[2] for later in whole[i + 1:]):
+                restart = event[0] + 3600
+                break
+        if restart is None:
+            return False, None, whole, []
+        split = EPOCH + timedelta(seconds=restart)
+
+        ObjectStore(root).Delete('restart-check')
+        before = Simulator(source, start, split, parameters=parameters, storage=root).run(Recorded)
+        after = Simulator(source, split, end, parameters=parameters, storage=root,
+                          account=Simulator.Account(before)).run(Recorded)
+    finally:
+        if storage is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    expected = [event for event in whole if event[0] > restart]
+    local = after.recorded
+    same = len(local) == len(expected) and all(
+        a[:3] == b[:3] and all(abs(x - y) < 1e-9 for x, y in zip(a[3:], b[3:])) for a, b in zip(local, expected))
+    return same, restart, expected, local
+
+
+''' COMMAND LINE '''
+
+def _date(text):
+    return datetime.strptime(text, '%Y-%m-%d')
+
+
+def main(argv=None):
+    import backtest
+
+    parser = argparse.ArgumentParser(description='Run a QuantConnect algorithm locally')
+    parser.add_argument('--algorithm', default='main.PenskeFile', help='module.Class')
+    parser.add_argument('--csv', help='hourly quote CSV path with {pair} placeholder')
+    parser.add_argument('--store', help='quotestore.py root to read the quotes from')
+    parser.add_argument('--synthetic', type=float, metavar='YEARS', help='synthetic quotes from 2018-01-01')
+    parser.add_argument('--start', type=_date)
+    parser.add_argument('--end', type=_date)
+    parser.add_argument('--pairs', help='comma separated, passed to the algorithm as the ccypairs parameter')
+    parser.add_argument('--parameter', action='append', metavar='NAME=VALUE', help='algorithm parameter (GetParameter)')
+    parser.add_argument('--storage', default='storage', help='ObjectStore directory')
+    parser.add_argument('--parity', action='store_true', help='compare fills with the vectorised engine, per pair')
+    parser.add_argument('--restart-check', action='store_true', help='restart mid position and compare with an uninterrupted run, per pair')
+    parser.add_argument('--quiet', action='store_true', help='don\'t print Debug messages')
+    args = parser.parse_args(argv)
+
+    if not (args.synthetic or args.store or args.csv):
+        parser.error('one of --csv, --store or --synthetic is required')
+
+    quotes = {}
+
+    def source(ticker):
+        if ticker not in quotes:
+            quotes[ticker] = backtest.load_source(args, ticker)
+        return quotes[ticker]
+
+    pairs = args.pairs.split(',') if args.pairs else ['AUDUSD']
+    if args.parity:
+        failed = 0
+        for ccypair in pairs:
+            same, local, expected = parity(source, ccypair, args.algorithm)
+            print('{}: {} local fills, {} vectorised fills: {}'.format(
+                ccypair, len(local), len(expected), 'OK' if same else 'MISMATCH'))
+            failed += not same
+        return 1 if failed else 0
+
+    if args.restart_check:
+        failed = 0
+        for ccypair in pairs:
+            same, restart, expected, local = restart_check(source, ccypair, args.algorithm)
+            print('{}: restarted at {}: {} events after it, {} uninterrupted: {}'.format(
+                ccypair, restart and EPOCH + timedelta(seconds=restart), len(local), len(expected), 'OK' if same else 'MISMATCH'))
+            failed += not same
+        return 1 if failed else 0
+
+    began = timer.perf_counter()
+    parameters = dict(item.split('=', 1) for item in args.parameter or ())
+    if args.pairs:
+        parameters['ccypairs'] = args.pairs
+    simulator = Simulator(source, args.start, args.end, None if args.quiet else print, parameters, args.storage)
+    algorithm = simulator.run(load_algorithm(args.algorithm))
+    elapsed = timer.perf_counter() - began
+    print('Finished in {:.2f}s, {} orders, portfolio value {:.2f} USD'.format(
+        elapsed, len(algorithm.Transactions.orders), algorithm.Portfolio.TotalPortfolioValue))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
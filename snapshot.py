@@ -0,0 +1,199 @@
+'''
+Versioned binary snapshots of PenskeFile state for warm restarts
+
+A snapshot holds, for every pair, the signal timeframe's indicator internals (EMA, ATR, MACD), the ten rolling
+windows and the trade state (GreenLight, HighHistThreshold, AdjustStop, entry price and branch,
+position sizes, targets and the stop schedule), so a restart doesn't need SetWarmup to rebuild them and a restart
+mid trade keeps its stop-shift progress. The stop order ticket is found again among the open orders.
+
+Layout (little endian): header '4s H H q H I I' = magic, version, doubles per pair, time taken (epoch
+seconds), pair count, signal timeframe in seconds and a CRC32 of the strategy parameters (LossRisk,
+DownsideRisk, UpsideRisk). Then per pair '8s' ccypair followed by a fixed list of doubles, NaN where
+a value isn't set yet. Any other version, layout, timeframe or parameters is ignored and the
+algorithm warms up normally.
+
+    data = snapshot.Capture(self)
+    restored = snapshot.Restore(self, data, now)    # {ccypair: last signal bar end}, or None when unusable
+'''
+
+from datetime import datetime, timedelta
+import struct
+import zlib
+
+from QuantConnect import *
+from QuantConnect.Data.Market import *
+
+MAGIC = b'PSKF'
+VERSION = 4
+EPOCH = datetime(1970, 1, 1)
+NAN = float('nan')
+
+HEADER = struct.Struct('<4sHHqHII')
+
+WINDOWS = ('H4emaWindow', 'H4atrWindow', 'H4macdWindow', 'H4MACDhistogramWindow', 'H4MACDsignalWindow',
+           'goLongWindow', 'goShortWindow', 'signalLongWindow', 'signalShortWindow')
+FLAGS = ('GreenLight', 'HighHistThreshold', 'BarRangeExceeded', 'HighVolWarning')
+VALUES = ('AdjustStop', 'BuyPositionSize', 'SellPositionSize', 'CloseLongPosition', 'CloseShortPosition',
+          'XEntryPrice', 'EntryBranch', 'StopSide', 'NextStopLevel',
+          'InitialStopLong', 'MidStopLong', 'FirstTargetLong', 'SecondTargetLong', 'HighStopLong',
+          'ThirdTargetLong', 'HugeMoveStopLong', 'HugeMoveLong',
+          'InitialStopShort', 'MidStopShort', 'FirstTargetShort', 'SecondTargetShort', 'HighStopShort',
+          'ThirdTargetShort', 'HugeMoveStopShort', 'HugeMoveShort')
+INTEGERS = ('AdjustStop', 'BuyPositionSize', 'SellPositionSize', 'CloseLongPosition', 'CloseShortPosition', 'EntryBranch',
+            'StopSide')
+
+WINDOW_SIZE = 3
+RUNGS = 4
+EMA_STATE, ATR_STATE, MACD_STATE = 2, 3, 9
+BAR_FIELDS = 9                                                          # start time, bid OHLC, ask OHLC
+
+# barEnd, indicators, windows (count + values), bar window, flags, values, schedule
+DOUBLES = 1 + EMA_STATE + ATR_STATE + MACD_STATE + len(WINDOWS) * (1 + WINDOW_SIZE) + \
+    1 + WINDOW_SIZE * BAR_FIELDS + len(FLAGS) + len(VALUES) + RUNGS * 3
+PAIR = struct.Struct('<8s{}d'.format(DOUBLES))
+
+
+def _epoch(time):
+    return (time - EPOCH).total_seconds()
+
+
+def _time(epoch):
+    return EPOCH + timedelta(seconds=epoch)
+
+
+def _parameters(algorithm):
+    ''' CRC32 of the parameters the saved targets, sizes and stop schedule were derived with '''
+    return zlib.crc32(repr((algorithm.LossRisk, algorithm.DownsideRisk, algorithm.UpsideRisk)).encode())
+
+
+''' CAPTURE '''
+
+def Capture(algorithm):
+    ''' Snapshot of every pair's state as bytes '''
+    chunks = [HEADER.pack(MAGIC, VERSION, DOUBLES, int(_epoch(algorithm.Time)), len(algorithm.pairs),
+                          int(algorithm.timeframe.total_seconds()), _parameters(algorithm))]
+    for ccypair, pair in algorithm.pairs.items():
+        chunks.append(PAIR.pack(ccypair.encode(), *_pair_values(pair)))
+    return b''.join(chunks)
+
+
+def _pair_values(pair):
+    triggers = pair.triggers
+    values = [_epoch(pair.window[0].EndTime) if pair.window.Count else NAN]
+    values += triggers.ema.State() + triggers.atr.State() + triggers.macd.State()
+
+    for name in WINDOWS:
+        window = getattr(pair, name)
+        values.append(window.Count)
+        values += [window[i] if i < window.Count else NAN for i in range(WINDOW_SIZE)]
+
+    values.append(pair.window.Count)
+    for i in range(WINDOW_SIZE):
+        if i < pair.window.Count:
+            bar = pair.window[i]
+            values += [_epoch(bar.Time), bar.Bid.Open, bar.Bid.High, bar.Bid.Low, bar.Bid.Close,
+                       bar.Ask.Open, bar.Ask.High, bar.Ask.Low, bar.Ask.Close]
+        else:
+            values += [NAN] * BAR_FIELDS
+
+    values += [1.0 if getattr(pair, name) == 'Y' else 0.0 for name in FLAGS]
+    values += [_get(pair, name) for name in VALUES]
+
+    schedule = _get(pair, 'StopSchedule', ())
+    for i in range(RUNGS):
+        values += [float(x) for x in schedule[i]] if i < len(schedule) else [NAN] * 3
+    return values
+
+
+def _get(pair, name, default=NAN):
+    try:
+        return getattr(pair, name)
+    except AttributeError:
+        return default
+
+
+''' RESTORE '''
+
+def Restore(algorithm, data, now):
+    '''
+    Restores every pair found in both the snapshot and the algorithm
+
+    Returns {ccypair: last signal bar end} for the restored pairs (the warm up only needs to replay
+    from the earliest when every pair is there), or None when the snapshot is unusable (other
+    version/layout, taken on another timeframe or with other parameters, or newer than now) and
+    nothing was changed.
+    '''
+    if len(data) < HEADER.size:
+        return None
+    magic, version, doubles, taken, count, timeframe, parameters = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or doubles != DOUBLES or len(data) != HEADER.size + count * PAIR.size:
+        return None
+    if timeframe != int(algorithm.timeframe.total_seconds()) or parameters != _parameters(algorithm):
+        return None
+    if _time(taken) > now:
+        return None
+
+    records = [PAIR.unpack_from(data, HEADER.size + i * PAIR.size) for i in range(count)]
+    restored = {}
+    for record in records:
+        ccypair, values = record[0].rstrip(b'\0').decode(), record[1:]
+        pair = algorithm.pairs.get(ccypair)
+        if pair is None or values[0] != values[0]:
+            continue
+        barEnd = _time(values[0])
+        _restore_pair(algorithm, pair, values, barEnd)
+        restored[ccypair] = barEnd
+    return restored
+
+
+def _restore_pair(algorithm, pair, values, barEnd):
+    i = 1
+    triggers = pair.triggers
+    for indicator, size in ((triggers.ema, EMA_STATE), (triggers.atr, ATR_STATE), (triggers.macd, MACD_STATE)):
+        indicator.Restore(values[i:i + size])
+        i += size
+    triggers.Update()
+
+    for name in WINDOWS:
+        window = getattr(pair, name)
+        window.Reset()
+        count = int(values[i])
+        for value in reversed(values[i + 1:i + 1 + count]):
+            window.Add(value)
+        i += 1 + WINDOW_SIZE
+
+    pair.window.Reset()
+    count = int(values[i])
+    i += 1
+    period = algorithm.timeframe
+    bars = []
+    for j in range(WINDOW_SIZE):
+        fields = values[i + j * BAR_FIELDS:i + (j + 1) * BAR_FIELDS]
+        if j < count:
+            bars.append(QuoteBar(_time(fields[0]), algorithm.Securities[pair.ccypair].Symbol,
+                                 Bar(*fields[1:5]), 0, Bar(*fields[5:9]), 0, period))
+    for bar in reversed(bars):
+        pair.window.Add(bar)
+    i += WINDOW_SIZE * BAR_FIELDS
+
+    for name in FLAGS:
+        setattr(pair, name, 'Y' if values[i] else 'N')
+        i += 1
+    for name in VALUES:
+        value = values[i]
+        if value == value:
+            setattr(pair, name, int(value) if name in INTEGERS else value)
+        i += 1
+
+    schedule = []
+    for _ in range(RUNGS):
+        trigger, stop, gated = values[i:i + 3]
+        if trigger == trigger:
+            schedule.append((trigger, stop, bool(gated)))
+        i += 3
+    if schedule:
+        pair.StopSchedule = tuple(schedule)
+
+    # The stop ticket is looked up again among the open orders when the stop is next shifted
+    pair.sl_order = None
+    algorithm.graph.Node(pair.ccypair, period).resumeAfter = barEnd
@@ -0,0 +1,22 @@
+'''
+Per pair thresholds for the PenskeFile strategy, generated by calibrate.py
+
+Loaded once when the algorithm initialises (main.py) and by backtest.params_for. Regenerate with
+calibrate.py rather than editing by hand, NOTES records where each row came from.
+'''
+
+from collections import namedtuple
+
+PairThresholds = namedtuple('PairThresholds', ('xbaseline_signal', 'stop_atr', 'high_histogram', 'mid_histogram', 'low_histogram', 'tradeopen_atr'))
+
+THRESHOLDS = {
+    'AUDUSD': PairThresholds(0.002, 0.0015, 0.001, 0.0005, 0.0002, 0.008),
+    'GBPJPY': PairThresholds(0.38, 0.35, 0.23, 0.12, 0.047, 0.9),
+    'NZDJPY': PairThresholds(0.2, 0.15, 0.1, 0.05, 0.02, 0.8),
+}
+
+NOTES = {
+    'AUDUSD': 'hand tuned',
+    'GBPJPY': 'hand tuned, histogram thresholds at the AUDUSD/NZDJPY ratios to stop_atr (2/3, 1/3, 2/15)',
+    'NZDJPY': 'hand tuned',
+}
@@ -0,0 +1,123 @@
+'''
+Several PenskeFile variants in one pass over the quotes
+
+Each variant is a signal timeframe with its Downside/UpsideRisk, given as timeframe:downside:upside
+(e.g. 4h:1.5:2). All variants run side by side in the local simulator (Simulator.run_variants), each
+with its own account and orders, while IndicatorGraph.Attach hands them one shared graph: every
+symbol is resampled once into all the timeframes used, and variants on the same timeframe share its
+bars, EMA/ATR/MACD and triggers instead of each building their own.
+
+The thresholds in thresholds.py are calibrated on H4, so other timeframes trade with H4 levels
+unless the table is recalibrated for them. --results stores each variant as a run named after it
+(4h-1.5-2 ...) for python results.py report.
+
+    python variants.py --synthetic 3 --variants 4h:1.5:2,8h:1.5:2,1d:1.5:2
+    python variants.py --store store --pairs AUDUSD,NZDJPY --variants 4h:1.5:2,4h:1:3 --separate
+'''
+
+from contextlib import contextmanager
+from datetime import datetime
+import argparse
+import sys
+import time as timer
+
+import backtest
+import simulator
+
+
+def parse_variants(text):
+    ''' [{'timeframe', 'downside_risk', 'upside_risk'}] from "4h:1.5:2,8h:1.5:2" '''
+    variants = []
+    for item in text.split(','):
+        timeframe, downside, upside = item.split(':')
+        variants.append({'timeframe': timeframe, 'downside_risk': downside, 'upside_risk': upside})
+    return variants
+
+
+def label(variant):
+    return '{timeframe}:{downside_risk}:{upside_risk}'.format(**variant)
+
+
+@contextmanager
+def shared_graph():
+    ''' Algorithms initialised inside the block attach to one IndicatorGraph '''
+    from indicatorgraph import IndicatorGraph
+    IndicatorGraph.sharing, IndicatorGraph.shared = True, None
+    try:
+        yield
+    finally:
+        IndicatorGraph.sharing, IndicatorGraph.shared = False, None
+
+
+def run(source, variants, parameters=None, start=None, end=None, log=None, algorithmPath='main.PenskeFile'):
+    ''' Runs every variant in one simulator pass, returns the algorithm instances in variants order '''
+    algorithmType = simulator.load_algorithm(algorithmPath)
+    with shared_graph():
+        return simulator.Simulator(source, start, end, log, parameters).run_variants(algorithmType, variants)
+
+
+def fills(algorithm):
+    ''' (order id, type, status, quantity, stop price) of every order, to compare runs '''
+    return [(order.Id, order.Type, order.Status, order.Quantity, order.StopPrice)
+            for order in algorithm.Transactions.orders.values()]
+
+
+''' COMMAND LINE '''
+
+def _date(text):
+    return datetime.strptime(text, '%Y-%m-%d')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run PenskeFile variants over one shared feed and indicator graph')
+    parser.add_argument('--variants', default='4h:1.5:2,8h:1.5:2,1d:1.5:2', help='timeframe:downside:upside, comma separated')
+    parser.add_argument('--pairs', default='AUDUSD', help='comma separated, traded by every variant')
+    parser.add_argument('--csv', help='hourly quote CSV path with {pair} placeholder')
+    parser.add_argument('--store', help='quotestore.py root to read the quotes from')
+    parser.add_argument('--synthetic', type=float, metavar='YEARS', help='synthetic quotes from 2018-01-01')
+    parser.add_argument('--start', type=_date)
+    parser.add_argument('--end', type=_date)
+    parser.add_argument('--algorithm', default='main.PenskeFile', help='module.Class')
+    parser.add_argument('--separate', action='store_true', help='also run each variant alone and compare')
+    parser.add_argument('--results', metavar='ROOT', help='results store root, one run per variant (results.py)')
+    args = parser.parse_args(argv)
+
+    if not (args.synthetic or args.store or args.csv):
+        parser.error('one of --csv, --store or --synthetic is required')
+    quotes = {}
+
+    def source(ticker):
+        if ticker not in quotes:
+            quotes[ticker] = backtest.load_source(args, ticker)
+        return quotes[ticker]
+
+    variants = parse_variants(args.variants)
+    parameters = {'ccypairs': args.pairs}
+    if args.results:
+        parameters['results'] = args.results
+        for variant in variants:
+            variant['results_run'] = label(variant).replace(':', '-')
+
+    began = timer.perf_counter()
+    algorithms = run(source, variants, parameters, args.start, args.end, algorithmPath=args.algorithm)
+    elapsed = timer.perf_counter() - began
+    for variant, algorithm in zip(variants, algorithms):
+        print('{:<14} {:>6} orders, portfolio value {:.2f} USD'.format(
+            label(variant), len(algorithm.Transactions.orders), algorithm.Portfolio.TotalPortfolioValue))
+    print('{} variants in one pass: {:.2f}s'.format(len(variants), elapsed))
+
+    if not args.separate:
+        return 0
+    algorithmType = simulator.load_algorithm(args.algorithm)
+    began = timer.perf_counter()
+    single = dict(parameters, results='')                                # the one pass runs already hold the results
+    alone = [simulator.Simulator(source, args.start, args.end, None, dict(single, **variant)).run(algorithmType)
+             for variant in variants]
+    elapsed = timer.perf_counter() - began
+    same = all(fills(a) == fills(b) for a, b in zip(algorithms, alone))
+    print('{} variants one at a time: {:.2f}s, orders {}'.format(len(variants), elapsed, 'identical' if same else 'DIFFER'))
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+'''
+Walk-forward and rolling out-of-sample validation for the PenskeFile strategy
+
+Splits each pair's history into folds of train days followed by test days (rolling, or anchored at
+the start of the data), picks the best search point on each train window and scores it on the
+following test window. Without a search space every test window is scored with the fixed params.
+
+The H4 indicator arrays (EMA100, ATR14, MACD 12/26/9) are computed once per pair and cached on disk,
+keyed by a hash of the quotes and the indicator parameters, with least recently used entries evicted
+past --cache-mb. Folds slice the cached arrays (memory mapped in every worker) instead of recomputing
+them. Each slice starts warmup hourly bars before its window with trading blocked, as SetWarmup(100)
+does, and the indicators keep the history before it.
+
+    python walkforward.py --pairs AUDUSD,NZDJPY --store store --train 365 --test 90 \
+        --grid stop_atr=0.001,0.0015,0.002 --workers 8 --out walkforward.csv
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import argparse
+import csv
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+import backtest
+import optimiser
+
+# Bump when indicator_series() changes so stale cache entries stop matching
+INDICATOR_VERSION = 2
+INDICATOR_PARAMS = ('H4', 100, 14, 12, 26, 9)
+DAY = 86400
+
+
+''' INDICATOR CACHE '''
+
+class IndicatorCache(object):
+    '''
+    indicator_series() arrays on disk, one directory of .npy columns per key
+
+    get() maps the columns read only, so parallel workers share the page cache. evict() drops
+    entries past maxBytes least recently used first (directory mtime is touched on every hit),
+    except the ones series() handed out through this instance, which the current run still needs.
+    '''
+
+    def __init__(self, root, maxBytes=512 * 2 ** 20):
+        self.root = root
+        self.maxBytes = maxBytes
+        self.pinned = set()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(ccypair, quotes, conversion=None):
+        digest = hashlib.sha1(repr((INDICATOR_VERSION, INDICATOR_PARAMS, ccypair, conversion is not None)).encode())
+        for data in (quotes, conversion) if conversion is not None else (quotes,):
+            for name in ('time',) + backtest.QUOTE_COLUMNS:
+                digest.update(np.ascontiguousarray(data[name]).tobytes())
+        return '{}-{}'.format(ccypair, digest.hexdigest()[:20])
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path)
+        return dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r')) for name in backtest.SERIES_COLUMNS)
+
+    def put(self, key, series):
+        staging = tempfile.mkdtemp(dir=self.root, prefix='.staging-')
+        for name in backtest.SERIES_COLUMNS:
+            np.save(os.path.join(staging, name + '.npy'), np.asarray(series[name]))
+        try:
+            os.rename(staging, self.path(key))
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)                  # another process got there first
+
+    def series(self, ccypair, quotes, conversion=None):
+        ''' Cached indicator_series() for quotes, computing and storing it on a miss. Returns (key, series) '''
+        key = self.key(ccypair, quotes, conversion)
+        self.pinned.add(key)
+        series = self.get(key)
+        if series is None:
+            self.put(key, backtest.indicator_series(quotes, ccypair, conversion))
+            series = self.get(key)
+        return key, series
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.root):
+            path = self.path(name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.stat(path).st_mtime, name, size))
+        total = sum(entry[2] for entry in entries)
+        for _, name, size in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            if name not in self.pinned:
+                shutil.rmtree(self.path(name), ignore_errors=True)
+                total -= size
+
+
+''' FOLDS '''
+
+def folds(times, train, test, step=None, anchored=False):
+    '''
+    (train lo, train hi, test lo, test hi) hourly index ranges for train/test/step lengths in days
+
+    Rolling windows move by step (default test) days; anchored ones always train from the start.
+    '''
+    times = np.asarray(times, dtype=np.int64)
+    step = step or test
+    result = []
+    first = int(times[0])
+    testStart = first + train * DAY
+    while testStart + test * DAY <= int(times[-1]) + backtest.HOUR:
+        trainStart = first if anchored else testStart - train * DAY
+        bounds = np.searchsorted(times, [trainStart, testStart, testStart + test * DAY])
+        result.append((int(bounds[0]), int(bounds[1]), int(bounds[1]), int(bounds[2])))
+        testStart += step * DAY
+    return result
+
+
+def window(series, lo, hi, warmup):
+    ''' Series for hourly bars lo..hi-1 plus warmup bars before lo, and the warmup actually available '''
+    start = max(0, lo - warmup)
+    return backtest.slice_series(series, start, hi), lo - start
+
+
+''' WORKERS '''
+
+def _fold(task):
+    cacheRoot, key, ccypair, number, bounds, candidates, rank = task
+    series = IndicatorCache(cacheRoot).get(key)
+    trainLo, trainHi, testLo, testHi = bounds
+
+    best, bestRow = None, None
+    if len(candidates) > 1:
+        for params in candidates:
+            trainSeries, warmup = window(series, trainLo, trainHi, params.warmup)
+            row = optimiser.summarise(backtest.run(None, ccypair, params._replace(warmup=warmup), series=trainSeries))
+            if bestRow is None or optimiser.score(row, rank) > optimiser.score(bestRow, rank):
+                best, bestRow = params, row
+    else:
+        best = candidates[0]
+
+    testSeries, warmup = window(series, testLo, testHi, best.warmup)
+    trades = backtest.run(None, ccypair, best._replace(warmup=warmup), series=testSeries)
+    time = series['time']
+    row = {'ccypair': ccypair, 'fold': number, 'train_start': _date(time[trainLo]), 'train_end': _date(time[trainHi - 1]),
+           'test_start': _date(time[testLo]), 'test_end': _date(time[testHi - 1])}
+    row.update(best._asdict())
+    row.update(('is_' + name, value) for name, value in (bestRow or {}).items())
+    row.update(('oos_' + name, value) for name, value in optimiser.summarise(trades).items())
+    return row, trades
+
+
+def _date(epoch):
+    return datetime.utcfromtimestamp(int(epoch)).strftime('%Y-%m-%d')
+
+
+def walk_forward(quotesByPair, train, test, step=None, anchored=False, points=None, relative=False, fixed=None,
+                 rank='total_r', cache='.indicator_cache', cacheBytes=512 * 2 ** 20, workers=None, log=None,
+                 conversions=None):
+    '''
+    Runs every fold of every pair on a process pool
+
+    conversions maps a cross to its backtest.conversion_pair() quotes, for the position sizing.
+    Returns (fold rows, {pair: out-of-sample trades of all folds}). Pairs whose thresholds can't be
+    resolved are skipped like in optimiser.sweep.
+    '''
+    store = IndicatorCache(cache, cacheBytes)
+    tasks = []
+    for ccypair, quotes in quotesByPair.items():
+        try:
+            candidates = [optimiser.resolve(ccypair, point, relative, fixed) for point in (points or [{}])]
+        except KeyError:
+            if log:
+                log('Skipping {}: missing from thresholds.py (run calibrate.py or pass them with --set)'.format(ccypair))
+            continue
+        key, series = store.series(ccypair, quotes, (conversions or {}).get(ccypair))
+        for number, bounds in enumerate(folds(series['time'], train, test, step, anchored)):
+            tasks.append((cache, key, ccypair, number, bounds, candidates, rank))
+
+    rows, trades = [], {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for row, foldTrades in pool.map(_fold, tasks) if tasks else ():
+            rows.append(row)
+            trades.setdefault(row['ccypair'], []).append(foldTrades)
+    store.evict()                                                       # every fold has its arrays by now
+    return rows, dict((ccypair, np.concatenate(parts)) for ccypair, parts in trades.items())
+
+
+def write_results(rows, path):
+    fields = ['ccypair', 'fold', 'train_start', 'train_end', 'test_start', 'test_end'] + \
+        ['oos_' + name for name in optimiser.METRICS] + ['is_' + name for name in optimiser.METRICS] + \
+        list(backtest.StrategyParams._fields)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+''' COMMAND LINE '''
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Walk-forward validation for the PenskeFile strategy')
+    parser.add_argument('--pairs', default='AUDUSD', help='comma separated, e.g. AUDUSD,GBPJPY,NZDJPY')
+    parser.add_argument('--csv', help='hourly quote CSV path with {pair} placeholder')
+    parser.add_argument('--store', help='quotestore.py root to read the quotes from')
+    parser.add_argument('--synthetic', type=float, metavar='YEARS', help='use synthetic quotes instead of CSV')
+    parser.add_argument('--train', type=int, default=365, help='train window in days')
+    parser.add_argument('--test', type=int, default=90, help='test window in days')
+    parser.add_argument('--step', type=int, help='days between folds (default: --test)')
+    parser.add_argument('--anchored', action='store_true', help='train from the start of the data every fold')
+    optimiser.add_search_arguments(parser)
+    parser.add_argument('--rank', default='total_r', choices=optimiser.METRICS, help='train window selection metric, lowest wins for max_drawdown')
+    parser.add_argument('--cache', default='.indicator_cache', help='indicator cache directory')
+    parser.add_argument('--cache-mb', type=float, default=512, help='indicator cache size limit')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--out', default='walkforward_results.csv')
+    args = parser.parse_args(argv)
+
+    try:
+        grid, ranges, fixed = optimiser.parse_search_space(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not (args.synthetic or args.store or args.csv):
+        parser.error('one of --csv, --store or --synthetic is required')
+    quotesByPair = dict((ccypair, backtest.load_source(args, ccypair)) for ccypair in args.pairs.split(','))
+    conversions = dict((ccypair, backtest.load_conversion(args, ccypair)) for ccypair in quotesByPair)
+
+    log = lambda message: print(message, file=sys.stderr)
+    points = optimiser.candidates(grid, ranges, args.samples, args.seed)
+    rows, trades = walk_forward(quotesByPair, args.train, args.test, args.step, args.anchored, points, args.relative,
+                                fixed, args.rank, args.cache, int(args.cache_mb * 2 ** 20), args.workers, log, conversions)
+    write_results(rows, args.out)
+    for ccypair, pairTrades in sorted(trades.items()):
+        summary = optimiser.summarise(pairTrades)
+        log('{} out of sample over {} folds: {}'.format(ccypair, sum(row['ccypair'] == ccypair for row in rows),
+                                                        ', '.join('{} {:.4g}'.format(k, v) for k, v in summary.items())))
+    log('{} folds written to {}'.format(len(rows), args.out))
+
+
+if __name__ == '__main__':
+    main()